@@ -0,0 +1,204 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import Date, case, cast, func, null
+from sqlalchemy.orm import Session
+
+from config import settings
+from app.auth import get_current_db_role
+from app.database import new_read_session, shard_for_id
+from app.fx import fx_rates, FxRateMissing
+from app.models import Category, ClosedPeriod, Transaction
+
+# выброс - расход, больший среднего по категории на outlier_z стандартных
+# отклонений; категории с меньшим числом операций не оцениваются
+OUTLIER_MIN_COUNT = 5
+OUTLIER_LIMIT = 20
+
+
+def _shift_month(d: date, months: int) -> date:
+    """Первое число месяца, отстоящего от месяца d на months (назад - отрицательное)."""
+    month_index = d.year * 12 + d.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _archived_through(db: Session) -> Optional[date]:
+    """Конец последнего закрытого периода, операции которого перенесены в архив."""
+    return db.query(func.max(ClosedPeriod.period_end)).filter(ClosedPeriod.archived.is_(True)).scalar()
+
+
+def _fetch_shard(db: Session, user_ids: Sequence[int], start: date, end: date, currency: str, outlier_z: float):
+    """
+    Два запроса к шарду: суммы по (месяц, категория, валюта) - все метрики,
+    кроме выбросов, считаются из них; и выбросы через оконные avg/stddev по
+    категории, так что отдельные операции из БД не читаются.
+    """
+    month = cast(func.date_trunc('month', Transaction.transaction_date), Date)
+    # для сумм в целевой валюте курс не нужен - одна группа на месяц и категорию
+    rate_date = case((Transaction.currency == currency, null()),
+                     else_=Transaction.transaction_date)
+    grouped = db.query(
+        month.label('month'),
+        Category.id,
+        Category.name,
+        Category.type,
+        Transaction.currency,
+        rate_date.label('rate_date'),
+        func.sum(Transaction.amount).label('total_amount'),
+    ).join(Category, Category.id == Transaction.category_id).filter(
+        Category.user_id.in_(user_ids), Transaction.transaction_date.between(start, end)
+    ).group_by(month, Category.id, Category.name, Category.type,
+               Transaction.currency, rate_date).all()
+
+    window = {"partition_by": (Transaction.category_id, Transaction.currency)}
+    scored = db.query(
+        Transaction.id.label('transaction_id'),
+        Transaction.category_id,
+        Transaction.amount,
+        Transaction.currency,
+        Transaction.transaction_date,
+        ((Transaction.amount - func.avg(Transaction.amount).over(**window))
+         / func.nullif(func.stddev_pop(Transaction.amount).over(**window), 0)).label('z_score'),
+        func.count().over(**window).label('sample_size'),
+    ).join(Category, Category.id == Transaction.category_id).filter(
+        Category.user_id.in_(user_ids), Category.type == 'expense',
+        Transaction.transaction_date.between(start, end)
+    ).subquery()
+    outliers = db.query(scored).filter(
+        scored.c.sample_size >= OUTLIER_MIN_COUNT, scored.c.z_score >= outlier_z
+    ).order_by(scored.c.z_score.desc()).limit(OUTLIER_LIMIT).all()
+    return grouped, outliers
+
+
+def spending_analytics(user_ids: Sequence[int], months: int, currency: str, outlier_z: float) -> dict:
+    """
+    Аналитика расходов пользователя или группы пользователей за последние
+    months месяцев: доходы и расходы по месяцам с изменением к прошлому
+    месяцу, доли категорий в расходах и необычно крупные расходы. Суммы
+    переводятся в currency по курсу на дату операции. Операций закрытых
+    периодов, перенесенных в архив, в transactions нет, поэтому такие месяцы
+    (и месяц, архивированный частично) не показываются: start_date сдвигается
+    на первый месяц после archived_through.
+    """
+    end = date.today()
+    start = _shift_month(end, 1 - months)
+    by_shard: Dict[int, List[int]] = {}
+    for user_id in user_ids:
+        by_shard.setdefault(shard_for_id(user_id), []).append(user_id)
+    grouped, outliers = [], []
+    with ExitStack() as stack:
+        sessions = {shard: stack.enter_context(new_read_session(shard)) for shard in by_shard}
+        cutoffs = [c for c in (_archived_through(db) for db in sessions.values()) if c is not None]
+        archived_through = max(cutoffs, default=None)
+        if archived_through is not None:
+            start = max(start, _shift_month(archived_through, 1))
+        for shard, shard_users in by_shard.items():
+            rows, found = _fetch_shard(sessions[shard], shard_users, start, end, currency, outlier_z)
+            grouped += rows
+            outliers += found
+
+    try:
+        converted = fx_rates.convert_column(
+            [r.total_amount for r in grouped], [r.currency for r in grouped],
+            [r.rate_date for r in grouped], currency)
+    except FxRateMissing as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    by_month = {}
+    for i in range((end.year - start.year) * 12 + end.month - start.month + 1):
+        d = _shift_month(start, i)
+        by_month[d] = {"month": d, "income": Decimal(0), "expense": Decimal(0)}
+    categories = {}
+    for r, amount in zip(grouped, converted):
+        by_month[r.month][r.type] += amount
+        if r.type == 'expense':
+            item = categories.setdefault(r.id, {"category_id": r.id, "category": r.name,
+                                                "total_amount": Decimal(0)})
+            item["total_amount"] += amount
+
+    previous = None
+    for item in by_month.values():
+        if previous is not None:
+            item["expense_delta"] = item["expense"] - previous
+            if previous:
+                item["expense_delta_percent"] = round(float(item["expense_delta"] / previous * 100), 2)
+        previous = item["expense"]
+
+    total_expense = sum(item["total_amount"] for item in categories.values())
+    for item in categories.values():
+        item["share"] = round(float(item["total_amount"] / total_expense), 4) if total_expense else 0.0
+
+    outliers.sort(key=lambda r: r.z_score, reverse=True)
+    return {
+        "user_ids": list(user_ids),
+        "currency": currency,
+        "start_date": start,
+        "archived_through": archived_through,
+        "months": list(by_month.values()),
+        "categories": sorted(categories.values(), key=lambda item: item["total_amount"], reverse=True),
+        "outliers": [{"transaction_id": r.transaction_id, "category_id": r.category_id,
+                      "amount": r.amount, "currency": r.currency,
+                      "transaction_date": r.transaction_date, "z_score": round(float(r.z_score), 2)}
+                     for r in outliers[:OUTLIER_LIMIT]],
+    }
+
+
+class AnalyticsCache:
+    """
+    Результаты аналитики в памяти процесса. Запись операций пользователя
+    (invalidate_user) делает устаревшими все закэшированные результаты с
+    его участием, в том числе посчитанные параллельно с записью. Ключ
+    включает роль БД. Изменения из других процессов видны не позже
+    ANALYTICS_CACHE_TTL_SECONDS.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # ключ -> (результат, поколения пользователей на момент расчета, срок)
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._generations: Dict[int, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def _stamp(self, user_ids: Sequence[int]) -> tuple:
+        return (self._epoch, tuple(self._generations.get(u, 0) for u in user_ids))
+
+    def get_or_compute(self, db: Session, user_ids: Sequence[int], months: int, currency: str, outlier_z: float) -> dict:
+        user_ids = sorted(set(user_ids))
+        key = (get_current_db_role(db) or "unknown", tuple(user_ids), months, currency, outlier_z)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            stamp = self._stamp(user_ids)
+            if entry is not None and entry[1] == stamp and entry[2] > now:
+                self._entries.move_to_end(key)
+                return entry[0]
+        result = spending_analytics(user_ids, months, currency, outlier_z)
+        with self._lock:
+            self._entries[key] = (result, stamp, now + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def invalidate_user(self, *user_ids: int):
+        with self._lock:
+            for user_id in user_ids:
+                if user_id is not None:
+                    self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+
+analytics_cache = AnalyticsCache(
+    settings.ANALYTICS_CACHE_MAX_ENTRIES, settings.ANALYTICS_CACHE_TTL_SECONDS)
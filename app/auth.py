@@ -7,13 +7,18 @@ from typing import Optional
 def get_current_db_role(db: Session) -> Optional[str]:
     """
     Получает текущую роль PostgreSQL пользователя из подключения к БД.
+    Роль запоминается в сессии: проверка прав и кэш справочных данных
+    в одном запросе обходятся одним SELECT current_user.
     """
+    if "db_role" in db.info:
+        return db.info["db_role"]
     try:
         result = db.execute(text("SELECT current_user"))
         role = result.scalar()
-        return role
     except Exception:
         return None
+    db.info["db_role"] = role
+    return role
 
 
 def check_permission(db: Session, table_name: str, action: str) -> bool:
@@ -0,0 +1,49 @@
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models import Budget, Transaction
+
+
+class BudgetLimits:
+    """
+    Лимиты бюджетов категорий расходов для серии проводок в одной сессии.
+    Потраченное за период бюджета считается одним запросом при первом
+    обращении, дальше к нему прибавляются принятые проводки серии.
+    """
+
+    def __init__(self, db: Session, expense_category_ids: Iterable[int]):
+        self.db = db
+        # category_id -> [[Budget, потрачено или None], ...]
+        self.budgets: Dict[int, List[list]] = {}
+        expense_category_ids = set(expense_category_ids)
+        if expense_category_ids:
+            for b in db.query(Budget).filter(Budget.category_id.in_(expense_category_ids)).all():
+                self.budgets.setdefault(b.category_id, []).append([b, None])
+
+    def _hit(self, category_id: int, day: date) -> List[list]:
+        hit = []
+        for entry in self.budgets.get(category_id, []):
+            b = entry[0]
+            if not (b.period_start <= day <= b.period_end):
+                continue
+            if entry[1] is None:
+                entry[1] = self.db.query(func.coalesce(func.sum(Transaction.amount), 0)).filter(
+                    Transaction.category_id == category_id,
+                    Transaction.transaction_date >= b.period_start,
+                    Transaction.transaction_date <= b.period_end,
+                ).scalar() or 0
+            hit.append(entry)
+        return hit
+
+    def exceeded(self, category_id: int, day: date, amount: Decimal) -> Optional[Budget]:
+        """Бюджет, лимит которого превысит расход amount в день day, или None."""
+        return next((e[0] for e in self._hit(category_id, day) if e[1] + amount > e[0].amount_limit), None)
+
+    def add(self, category_id: int, day: date, amount: Decimal):
+        """Учитывает принятый расход в потраченном по бюджетам периода."""
+        for entry in self._hit(category_id, day):
+            entry[1] += amount
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from typing import Dict, List
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy.engine import make_url
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+from app.database import shard_count, shard_urls
+
+logger = logging.getLogger("uvicorn.error")
+
+CHANGES_CHANNEL = "log_changes"
+
+# Через сколько секунд повторять LISTEN после неудачного подключения или обрыва
+_RECONNECT_DELAY = 30.0
+
+
+class ChangeNotifier:
+    """
+    Слушает LISTEN log_changes (pg_notify из log_trg_func) на каждом шарде -
+    отдельным соединением вне пула - и будит запросы GET /changes этого шарда,
+    ожидающие новых записей. Соединения открываются в фоне, старт приложения
+    их не ждет. Пока шард не слушается, ожидающие перепроверяют логи по таймауту.
+    """
+
+    def __init__(self, channel: str, connect_timeout: int):
+        self.channel = channel
+        self.connect_timeout = connect_timeout
+        # шард -> (соединение, его сокет)
+        self._conns: Dict[int, tuple] = {}
+        self._events: Dict[int, asyncio.Event] = {}
+        self._lost: Dict[int, asyncio.Event] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._listen(shard)) for shard in range(shard_count())]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for shard in list(self._conns):
+            self._close(shard)
+
+    def _connect(self, shard: int):
+        dsn = make_url(shard_urls()[shard]).set(
+            drivername="postgresql").render_as_string(hide_password=False)
+        conn = psycopg2.connect(dsn, connect_timeout=self.connect_timeout)
+        try:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {self.channel}")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    async def _listen(self, shard: int):
+        while True:
+            try:
+                conn = await run_in_threadpool(self._connect, shard)
+            except Exception:
+                logger.warning("changes: LISTEN %s on shard %s failed, polling for %ss",
+                               self.channel, shard, _RECONNECT_DELAY, exc_info=True)
+                await asyncio.sleep(_RECONNECT_DELAY)
+                continue
+            self._conns[shard] = (conn, conn.fileno())
+            self._events[shard] = asyncio.Event()
+            self._lost[shard] = asyncio.Event()
+            asyncio.get_running_loop().add_reader(self._conns[shard][1], self._on_notify, shard)
+            await self._lost[shard].wait()
+            self._close(shard)
+            await asyncio.sleep(_RECONNECT_DELAY)
+
+    def _close(self, shard: int):
+        entry = self._conns.pop(shard, None)
+        self._events.pop(shard, None)
+        self._lost.pop(shard, None)
+        if entry is not None:
+            conn, fd = entry
+            asyncio.get_running_loop().remove_reader(fd)
+            conn.close()
+
+    def _on_notify(self, shard: int):
+        conn, fd = self._conns[shard]
+        try:
+            conn.poll()
+        except Exception:
+            logger.exception("changes: notification connection to shard %s lost, polling", shard)
+            asyncio.get_running_loop().remove_reader(fd)
+            self._lost[shard].set()
+            return
+        if conn.notifies:
+            conn.notifies.clear()
+            # будим всех, кто ждет сейчас; следующие ждут уже новое событие
+            self._events[shard].set()
+            self._events[shard] = asyncio.Event()
+
+    async def wait(self, timeout: float, shard: int = 0):
+        """Ждет уведомления шарда shard не дольше timeout секунд."""
+        event = self._events.get(shard)
+        if event is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+change_notifier = ChangeNotifier(CHANGES_CHANNEL, settings.CHANGES_LISTEN_CONNECT_TIMEOUT)
@@ -0,0 +1,60 @@
+from typing import Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+
+def if_match_version(request: Request) -> Optional[int]:
+    """Ожидаемая версия из If-Match ("3" или W/"3"); None - заголовка нет или "*"."""
+    value = request.headers.get("If-Match")
+    if value is None or value.strip() == "*":
+        return None
+    value = value.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    value = value.strip('"')
+    if not value.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid If-Match header")
+    return int(value)
+
+
+def set_etag(response: Response, version: int):
+    response.headers["ETag"] = f'"{version}"'
+
+
+def check_version(current: int, expected: Optional[int]):
+    if expected is not None and current != expected:
+        raise HTTPException(
+            status_code=412, detail="Resource was modified by another request")
+
+
+def compare_and_swap(db: Session, model, entity_id: int, expected_version: Optional[int], values: dict,
+                     checks: Sequence[Tuple[object, str]] = (), not_found: str = "Not found") -> dict:
+    """
+    Одним запросом UPDATE ... WHERE id = :id AND version = :v RETURNING *,
+    без предварительного чтения и блокировки строки; версия увеличивается.
+    checks - пары (условие на текущую строку, текст ошибки 400). Если строка
+    не обновилась, причина выясняется отдельно: 404, 412 или 400.
+    """
+    stmt = update(model).where(model.id == entity_id, *[condition for condition, _ in checks])
+    if expected_version is not None:
+        stmt = stmt.where(model.version == expected_version)
+    row = db.execute(
+        stmt.values(**values, version=model.version + 1).returning(*model.__table__.columns),
+        execution_options={"synchronize_session": False},
+    ).mappings().first()
+    if row is None:
+        db.rollback()
+        current = db.query(model.version).filter(model.id == entity_id).scalar()
+        if current is None:
+            raise HTTPException(status_code=404, detail=not_found)
+        check_version(current, expected_version)
+        for condition, detail in checks:
+            if not db.query(model.id).filter(model.id == entity_id, condition).first():
+                raise HTTPException(status_code=400, detail=detail)
+        # строку успели изменить между UPDATE и проверкой
+        raise HTTPException(
+            status_code=412, detail="Resource was modified by another request")
+    db.commit()
+    return dict(row)
@@ -0,0 +1,51 @@
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple, Type
+
+from fastapi import HTTPException, Response
+from pydantic import BaseModel, TypeAdapter, create_model
+
+
+def parse_fields(fields: Optional[str], schema: Type[BaseModel]) -> Optional[Tuple[str, ...]]:
+    """
+    Разбирает параметр fields=id,amount,... в список полей схемы ответа.
+    None - параметр не задан, нужны все поля. Неизвестное поле - 400.
+    """
+    if fields is None:
+        return None
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in schema.model_fields]
+    if not names or unknown:
+        raise HTTPException(
+            status_code=400,
+            detail="Unknown fields: " + ", ".join(unknown) if unknown else "fields must not be empty")
+    return names
+
+
+def select_fields(model, names: Optional[Sequence[str]], *required: str) -> tuple:
+    """
+    Что выбирать запросом: модель целиком или только столбцы names и
+    required (например, ключ сортировки), без загрузки остальных.
+    """
+    if names is None:
+        return (model,)
+    return tuple(getattr(model, name) for name in dict.fromkeys((*names, *required)))
+
+
+@lru_cache(maxsize=256)
+def _adapter(schema: Type[BaseModel], names: Tuple[str, ...]) -> TypeAdapter:
+    partial = create_model(
+        f"{schema.__name__}Fields",
+        **{name: (schema.model_fields[name].annotation, schema.model_fields[name]) for name in names})
+    return TypeAdapter(List[partial])
+
+
+def render_fields(schema: Type[BaseModel], names: Optional[Tuple[str, ...]], rows: list):
+    """
+    Ответ списка: без fields - строки как есть (их проверит response_model),
+    иначе JSON только с запрошенными полями, сериализованный по типам схемы.
+    """
+    if names is None:
+        return rows
+    adapter = _adapter(schema, names)
+    items = adapter.validate_python([{name: row._mapping[name] for name in names} for row in rows])
+    return Response(content=adapter.dump_json(items), media_type="application/json")
@@ -0,0 +1,86 @@
+import csv
+import glob
+import os
+import threading
+from bisect import bisect_right
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Sequence, Tuple
+
+from config import settings
+
+CENT = Decimal("0.01")
+
+
+class FxRateMissing(LookupError):
+    pass
+
+
+class FxRates:
+    """
+    Таблица курсов валют в памяти, загружается из CSV-файлов каталога
+    FX_RATES_DIR (строки: currency,date,rate - сколько единиц базовой валюты
+    за единицу currency). Курс на дату - последний известный на эту дату или раньше.
+    Найденные курсы кэшируются по (currency, date).
+    """
+
+    def __init__(self, base: str, directory: str):
+        self.base = base
+        self.directory = directory
+        self._dates: Dict[str, List[date]] = {}
+        self._rates: Dict[str, List[Decimal]] = {}
+        self._cache: Dict[Tuple[str, date], Decimal] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            series: Dict[str, Dict[date, Decimal]] = {}
+            for path in sorted(glob.glob(os.path.join(self.directory, "*.csv"))):
+                with open(path, newline="", encoding="utf-8") as f:
+                    for row in csv.DictReader(f):
+                        series.setdefault(row["currency"].strip().upper(), {})[
+                            date.fromisoformat(row["date"].strip())] = Decimal(row["rate"].strip())
+            for currency, points in series.items():
+                dates = sorted(points)
+                self._dates[currency] = dates
+                self._rates[currency] = [points[d] for d in dates]
+            self._loaded = True
+
+    def rate(self, currency: str, on_date: date) -> Decimal:
+        """Курс currency к базовой валюте на дату."""
+        if currency == self.base:
+            return Decimal(1)
+        key = (currency, on_date)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        if not self._loaded:
+            self._load()
+        dates = self._dates.get(currency, [])
+        i = bisect_right(dates, on_date)
+        if i == 0:
+            raise FxRateMissing(f"No FX rate for {currency} on {on_date}")
+        self._cache[key] = self._rates[currency][i - 1]
+        return self._cache[key]
+
+    def factor(self, currency: str, target: str, on_date: date) -> Decimal:
+        """Множитель для перевода суммы из currency в target на дату."""
+        if currency == target:
+            return Decimal(1)
+        return self.rate(currency, on_date) / self.rate(target, on_date)
+
+    def convert_column(self, amounts: Sequence[Decimal], currencies: Sequence[str], dates: Sequence[date], target: str) -> List[Decimal]:
+        """
+        Переводит столбец сумм в target: курс ищется один раз на каждую
+        уникальную пару (валюта, дата), затем применяется ко всему столбцу.
+        """
+        factors = {key: self.factor(key[0], target, key[1])
+                   for key in set(zip(currencies, dates))}
+        return [(amount * factors[key]).quantize(CENT)
+                for amount, key in zip(amounts, zip(currencies, dates))]
+
+
+fx_rates = FxRates(settings.BASE_CURRENCY, settings.FX_RATES_DIR)
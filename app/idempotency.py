@@ -0,0 +1,181 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from sqlalchemy.dialects.postgresql import insert
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+from app.database import SessionLocal
+from app.models import IdempotencyKey
+from app.ratelimit import admission
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MUTATING_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "status_code", "body", "expires_at")
+
+    def __init__(self, fingerprint: str, expires_at: float, status_code: Optional[int] = None, body: Optional[bytes] = None):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        # status_code is None -> запрос с этим ключом ещё выполняется
+        self.status_code = status_code
+        self.body = body
+
+
+class IdempotencyStore:
+    """
+    Хранилище ключей идемпотентности: LRU в памяти процесса с TTL
+    и, опционально, таблица idempotency_keys, общая для всех процессов.
+    """
+
+    def __init__(self, max_keys: int, ttl_seconds: int, use_db: bool = False):
+        self.max_keys = max_keys
+        self.ttl_seconds = ttl_seconds
+        self.use_db = use_db
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def begin(self, key: str, fingerprint: str) -> Optional[_Entry]:
+        """
+        Резервирует ключ под новый запрос. Возвращает None, если ключ свободен
+        и запрос нужно выполнить, иначе - уже существующую запись. Запросы к
+        таблице идут в пуле потоков и не под блокировкой процесса.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                return entry
+            if not self.use_db:
+                self._put(key, _Entry(fingerprint, now + self.ttl_seconds))
+                return None
+        # одновременные запросы с ключом (и в этом процессе тоже) разводит
+        # INSERT ... ON CONFLICT: остальные получат запись "выполняется"
+        entry = await run_in_threadpool(self._begin_db, key, fingerprint, now)
+        with self._lock:
+            if entry is None:
+                self._put(key, _Entry(fingerprint, now + self.ttl_seconds))
+            elif entry.status_code is not None:
+                self._put(key, entry)
+        return entry
+
+    async def complete(self, key: str, fingerprint: str, status_code: int, body: bytes):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # вытеснена из LRU, пока запрос выполнялся
+                entry = _Entry(fingerprint, time.monotonic() + self.ttl_seconds)
+                self._put(key, entry)
+            entry.status_code = status_code
+            entry.body = body
+        if self.use_db:
+            await run_in_threadpool(self._complete_db, key, status_code, body)
+
+    async def release(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.use_db:
+            await run_in_threadpool(self._release_db, key)
+
+    def _put(self, key: str, entry: _Entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+
+    def _begin_db(self, key: str, fingerprint: str, now: float) -> Optional[_Entry]:
+        expired_before = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        with SessionLocal() as db:
+            db.query(IdempotencyKey).filter(
+                IdempotencyKey.key == key,
+                IdempotencyKey.created_at < expired_before).delete(synchronize_session=False)
+            inserted = db.execute(
+                insert(IdempotencyKey)
+                .values(key=key, fingerprint=fingerprint, created_at=datetime.utcnow())
+                .on_conflict_do_nothing(index_elements=[IdempotencyKey.key])
+                .returning(IdempotencyKey.key)
+            ).first()
+            db.commit()
+            if inserted:
+                return None
+            row = db.query(IdempotencyKey).filter(IdempotencyKey.key == key).first()
+            if not row:
+                return None
+            age = (datetime.utcnow() - row.created_at).total_seconds()
+            body = row.response_body.encode("utf-8") if row.response_body is not None else None
+            return _Entry(row.fingerprint, now + self.ttl_seconds - age, row.status_code, body)
+
+    def _complete_db(self, key: str, status_code: int, body: bytes):
+        with SessionLocal() as db:
+            db.query(IdempotencyKey).filter(IdempotencyKey.key == key).update(
+                {"status_code": status_code, "response_body": body.decode("utf-8")},
+                synchronize_session=False)
+            db.commit()
+
+    def _release_db(self, key: str):
+        with SessionLocal() as db:
+            db.query(IdempotencyKey).filter(
+                IdempotencyKey.key == key,
+                IdempotencyKey.status_code.is_(None)).delete(synchronize_session=False)
+            db.commit()
+
+
+store = IdempotencyStore(settings.IDEMPOTENCY_MAX_KEYS,
+                         settings.IDEMPOTENCY_TTL_SECONDS, settings.IDEMPOTENCY_USE_DB)
+
+
+class IdempotentRoute(APIRoute):
+    """
+    Маршрут, который для изменяющих запросов с заголовком Idempotency-Key
+    выполняет обработчик один раз, а повторы отдаёт из сохранённого ответа,
+    не открывая сессию БД и не беря блокировок на accounts.
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def idempotent_handler(request: Request) -> Response:
+            idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not idempotency_key or request.method not in MUTATING_METHODS:
+                return await handler(request)
+
+            # ключ клиента действует только в пределах роли БД и пользователя
+            # (X-User-Id): одинаковые ключи разных клиентов не пересекаются
+            caller = f"{await admission.role()}:{request.headers.get('X-User-Id', '')}"
+            key = f"{caller} {request.method} {request.url.path} {idempotency_key}"
+            fingerprint = hashlib.sha256(await request.body()).hexdigest()
+            entry = await store.begin(key, fingerprint)
+            if entry is not None:
+                if entry.fingerprint != fingerprint:
+                    return JSONResponse(
+                        status_code=422,
+                        content={"message": "Idempotency-Key was already used with a different request body"})
+                if entry.status_code is None:
+                    return JSONResponse(
+                        status_code=409,
+                        content={"message": "A request with this Idempotency-Key is still in progress"})
+                return Response(content=entry.body, status_code=entry.status_code,
+                                media_type="application/json", headers={"Idempotent-Replayed": "true"})
+
+            try:
+                response = await handler(request)
+            except Exception:
+                await store.release(key)
+                raise
+            if 200 <= response.status_code < 300:
+                await store.complete(key, fingerprint, response.status_code, response.body)
+            else:
+                await store.release(key)
+            return response
+
+        return idempotent_handler
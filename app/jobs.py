@@ -0,0 +1,168 @@
+import json
+import os
+import re
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Callable, Deque, Dict, Optional
+
+from config import settings
+from app.database import new_read_session
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class Job:
+    def __init__(self, kind: str, role: str, run: Callable, shard: int = 0, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.role = role
+        self.run = run
+        self.shard = shard
+        self.status = "queued"  # queued, running, done, failed
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+        self.error: Optional[str] = None
+        self.result_path = os.path.join(settings.REPORT_JOB_DIR, f"{self.id}.json")
+        self.meta_path = os.path.join(settings.REPORT_JOB_DIR, f"{self.id}.meta.json")
+
+    def save(self):
+        """Состояние задачи в файл рядом с результатом - его читают все воркеры."""
+        os.makedirs(settings.REPORT_JOB_DIR, exist_ok=True)
+        meta = {"kind": self.kind, "role": self.role, "status": self.status, "error": self.error,
+                "created_at": self.created_at.isoformat(),
+                "finished_at": self.finished_at.isoformat() if self.finished_at else None}
+        tmp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    @classmethod
+    def load(cls, job_id: str) -> Optional["Job"]:
+        """Задача по файлу состояния (в том числе запущенная другим воркером) или None."""
+        if not _JOB_ID.fullmatch(job_id):
+            return None
+        job = cls(None, None, None, job_id=job_id)
+        try:
+            with open(job.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        job.kind, job.role, job.status, job.error = meta["kind"], meta["role"], meta["status"], meta["error"]
+        job.created_at = datetime.fromisoformat(meta["created_at"])
+        job.finished_at = datetime.fromisoformat(meta["finished_at"]) if meta["finished_at"] else None
+        return job
+
+
+class JobRunner:
+    """
+    Выполняет тяжелые отчеты вне запроса: общий ограниченный пул потоков,
+    у каждой роли своя очередь и свой лимит одновременно выполняемых задач,
+    чтобы выгрузки audit_user не вытесняли запросы app_user.
+    Результат пишется в файл в виде JSON-массива строк, а состояние задачи -
+    в <id>.meta.json рядом с ним: при нескольких процессах (--prod) статус и
+    результат отдает любой из них, поэтому REPORT_JOB_DIR должен быть у
+    процессов общим. Пул и очереди у каждого процесса свои.
+    """
+
+    def __init__(self, workers: int, role_limits: Dict[str, int], default_limit: int, ttl_seconds: int):
+        self.role_limits = role_limits
+        self.default_limit = default_limit
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report-job")
+        self._jobs: Dict[str, Job] = {}
+        self._pending: Dict[str, Deque[Job]] = {}
+        self._running: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, role: str, run: Callable, shard: int = 0) -> Job:
+        """run(db) на шарде shard возвращает итерируемые строки-словари результата."""
+        job = Job(kind, role, run, shard)
+        job.save()
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+            self._pending.setdefault(role, deque()).append(job)
+            self._dispatch()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id) or Job.load(job_id)
+
+    def _dispatch(self):
+        for role, queue in self._pending.items():
+            limit = self.role_limits.get(role, self.default_limit)
+            while queue and self._running.get(role, 0) < limit:
+                job = queue.popleft()
+                self._running[role] = self._running.get(role, 0) + 1
+                self._executor.submit(self._execute, job)
+
+    def _execute(self, job: Job):
+        job.status = "running"
+        try:
+            job.save()
+            os.makedirs(settings.REPORT_JOB_DIR, exist_ok=True)
+            db = new_read_session(job.shard)
+            try:
+                with open(job.result_path, "w", encoding="utf-8") as f:
+                    f.write("[")
+                    for i, row in enumerate(job.run(db)):
+                        if i:
+                            f.write(",\n")
+                        json.dump(row, f, ensure_ascii=False, default=_json_default)
+                    f.write("]")
+            finally:
+                db.close()
+            job.status = "done"
+        except Exception as exc:
+            job.status = "failed"
+            job.error = str(exc)
+        finally:
+            job.finished_at = datetime.utcnow()
+            try:
+                job.save()
+            except OSError:
+                pass
+            with self._lock:
+                self._running[job.role] -= 1
+                self._dispatch()
+
+    def _prune(self):
+        """
+        Удаляет завершенные задачи старше ttl вместе с файлами результатов,
+        в том числе задачи других процессов (по файлам состояния).
+        """
+        now = datetime.utcnow()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at and (now - job.finished_at).total_seconds() > self.ttl_seconds:
+                del self._jobs[job_id]
+        try:
+            names = os.listdir(settings.REPORT_JOB_DIR)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(".meta.json") or name[:-len(".meta.json")] in self._jobs:
+                continue
+            job = Job.load(name[:-len(".meta.json")])
+            if job and job.finished_at and (now - job.finished_at).total_seconds() > self.ttl_seconds:
+                for path in (job.result_path, job.meta_path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+
+job_runner = JobRunner(settings.REPORT_JOB_WORKERS, settings.REPORT_JOB_ROLE_LIMITS,
+                       settings.REPORT_JOB_DEFAULT_ROLE_LIMIT, settings.REPORT_JOB_TTL_SECONDS)
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import time
+
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+from app.database import SessionLocal, shard_count
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class MatviewRefresher:
+    """
+    Обновляет user_accounts_summary и category_transactions_report
+    (REFRESH ... CONCURRENTLY через refresh_report_views()). После записей
+    представления помечаются устаревшими и обновляются на ближайшем шаге
+    планировщика, без записей - не реже раза в max_staleness секунд.
+    """
+
+    def __init__(self):
+        self.dirty = False
+        self.refreshed_at = 0.0
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def refresh(self) -> bool:
+        # сбрасываем до обновления: записи во время него вызовут еще одно
+        self.dirty = False
+        done = True
+        for shard in range(shard_count()):
+            with SessionLocal(shard) as db:
+                done = db.execute(text("SELECT refresh_report_views()")).scalar() and done
+                db.commit()
+        if done:
+            self.refreshed_at = time.monotonic()
+        else:
+            # обновляет другой процесс - повторим на следующем шаге
+            self.dirty = True
+        return bool(done)
+
+    async def run_periodically(self, interval: float, max_staleness: float):
+        while True:
+            await asyncio.sleep(interval)
+            if not self.dirty and time.monotonic() - self.refreshed_at < max_staleness:
+                continue
+            try:
+                await run_in_threadpool(self.refresh)
+            except Exception:
+                self.dirty = True
+                logger.exception("materialized views refresh failed")
+
+
+matview_refresher = MatviewRefresher()
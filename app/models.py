@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, DateTime, Date, Text, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Date, Text, ForeignKey, Boolean, Float, table, column, text
 from sqlalchemy.types import DECIMAL, JSON
 from sqlalchemy.orm import relationship
 from datetime import datetime, date
+from decimal import Decimal
 from app.database import Base
 
 
@@ -25,8 +26,10 @@ class Account(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     name = Column(String(100), nullable=False)
     type = Column(String(20), nullable=False)
-    balance = Column(DECIMAL(12, 2), default=0.00)
+    balance = Column(DECIMAL(12, 2), default=Decimal("0.00"))
+    currency = Column(String(3), nullable=False, default="RUB")
     created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1)
 
     user = relationship("User", back_populates="accounts")
     transactions = relationship("Transaction", back_populates="account")
@@ -38,6 +41,7 @@ class Category(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     name = Column(String(100), nullable=False)
     type = Column(String(10), nullable=False)
+    version = Column(Integer, nullable=False, default=1)
 
     user = relationship("User", back_populates="categories")
     transactions = relationship("Transaction", back_populates="category")
@@ -52,12 +56,17 @@ class Transaction(Base):
     category_id = Column(Integer, ForeignKey(
         "categories.id"), nullable=False)
     amount = Column(DECIMAL(12, 2), nullable=False)
+    currency = Column(String(3), nullable=False, default="RUB")
     description = Column(Text)
     transaction_date = Column(Date, default=date.today)
 
     account = relationship("Account", back_populates="transactions")
     category = relationship("Category", back_populates="transactions")
 
+    # в bd.sql таблица секционирована по transaction_date: с датой в ключе
+    # UPDATE и DELETE по объекту затрагивают только одну секцию
+    __mapper_args__ = {"primary_key": [id, transaction_date]}
+
 
 class Budget(Base):
     __tablename__ = "budgets"
@@ -68,6 +77,7 @@ class Budget(Base):
     amount_limit = Column(DECIMAL(12, 2), nullable=False)
     period_start = Column(Date, nullable=False)
     period_end = Column(Date, nullable=False)
+    version = Column(Integer, nullable=False, default=1)
 
     user = relationship("User", back_populates="budgets")
     category = relationship("Category", back_populates="budgets")
@@ -86,6 +96,8 @@ class TransactionBA(Base):
     account_from = relationship("Account", foreign_keys=[account_id_from])
     account_to = relationship("Account", foreign_keys=[account_id_to])
 
+    __mapper_args__ = {"primary_key": [id, transaction_date]}
+
 
 class Log(Base):
     __tablename__ = "logs"
@@ -96,4 +108,104 @@ class Log(Base):
     action = Column(String(10), nullable=False)  # INSERT, UPDATE, DELETE
     action_date = Column(DateTime, default=datetime.utcnow)
     old_data = Column(JSON, nullable=True)
-    new_data = Column(JSON, nullable=True)
\ No newline at end of file
+    new_data = Column(JSON, nullable=True)
+    txid = Column(BigInteger, nullable=False, server_default=text("txid_current()"))
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(300), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True)  # NULL пока запрос выполняется
+    response_body = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class RateLimitBucket(Base):
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String(300), primary_key=True)
+    tokens = Column(Float, nullable=False)
+    granted = Column(Integer, nullable=False, default=0)  # сколько токенов выдано последней арендой
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class RecurringRule(Base):
+    __tablename__ = "recurring_rules"
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(Integer, ForeignKey(
+        "accounts.id", ondelete="CASCADE"), nullable=False)
+    category_id = Column(Integer, ForeignKey(
+        "categories.id", ondelete="CASCADE"), nullable=False)
+    amount = Column(DECIMAL(12, 2), nullable=False)
+    description = Column(Text)
+    frequency = Column(String(10), nullable=False)  # daily, weekly, monthly, yearly
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=True)
+    next_run_date = Column(Date, nullable=False)
+    active = Column(Boolean, nullable=False, default=True)
+
+    account = relationship("Account")
+    category = relationship("Category")
+
+
+class ClosedPeriod(Base):
+    __tablename__ = "closed_periods"
+
+    id = Column(Integer, primary_key=True, index=True)
+    period_start = Column(Date, nullable=True)  # NULL - с начала учета
+    period_end = Column(Date, nullable=False, unique=True)
+    closed_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    archived = Column(Boolean, nullable=False, default=False)
+
+
+class PeriodAccountBalance(Base):
+    __tablename__ = "period_account_balances"
+
+    period_id = Column(Integer, ForeignKey(
+        "closed_periods.id", ondelete="CASCADE"), primary_key=True)
+    account_id = Column(Integer, ForeignKey(
+        "accounts.id", ondelete="CASCADE"), primary_key=True)
+    closing_balance = Column(DECIMAL(12, 2), nullable=False)
+
+
+class PeriodCategoryTotal(Base):
+    __tablename__ = "period_category_totals"
+
+    period_id = Column(Integer, ForeignKey(
+        "closed_periods.id", ondelete="CASCADE"), primary_key=True)
+    category_id = Column(Integer, ForeignKey(
+        "categories.id", ondelete="CASCADE"), primary_key=True)
+    currency = Column(String(3), primary_key=True)
+    transaction_count = Column(Integer, nullable=False)
+    total_amount = Column(DECIMAL(14, 2), nullable=False)
+
+
+# Материализованные представления из bd.sql: только для чтения и вне
+# Base.metadata, чтобы create_all не создавал вместо них таблицы
+user_accounts_summary = table(
+    "user_accounts_summary",
+    column("user_id", Integer),
+    column("username", String),
+    column("email", String),
+    column("currency", String),
+    column("total_accounts", Integer),
+    column("total_balance", DECIMAL(12, 2)),
+    column("first_account_created", DateTime),
+)
+
+category_transactions_report = table(
+    "category_transactions_report",
+    column("category_id", Integer),
+    column("category_name", String),
+    column("category_type", String),
+    column("user_id", Integer),
+    column("username", String),
+    column("currency", String),
+    column("transaction_count", Integer),
+    column("total_amount", DECIMAL(12, 2)),
+    column("average_amount", DECIMAL(12, 2)),
+    column("first_transaction_date", Date),
+    column("last_transaction_date", Date),
+)
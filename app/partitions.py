@@ -0,0 +1,32 @@
+import asyncio
+import logging
+
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+from app.database import SessionLocal, shard_count
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def ensure_partitions(months_ahead: int) -> int:
+    """Создает недостающие месячные секции transactions и transactions_b_a на всех шардах."""
+    created = 0
+    for shard in range(shard_count()):
+        with SessionLocal(shard) as db:
+            created += db.execute(text("SELECT ensure_transaction_partitions(:months)"),
+                                  {"months": months_ahead}).scalar() or 0
+            db.commit()
+    return created
+
+
+async def maintain_partitions(interval: float, months_ahead: int):
+    """Фоновая задача приложения: при старте и раз в interval секунд добавляет секции наперед."""
+    while True:
+        try:
+            created = await run_in_threadpool(ensure_partitions, months_ahead)
+            if created:
+                logger.info("partitions: %s created", created)
+        except Exception:
+            logger.exception("partitions: maintenance failed")
+        await asyncio.sleep(interval)
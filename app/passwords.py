@@ -0,0 +1,44 @@
+import asyncio
+import hmac
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+from config import settings
+
+# min = max = default: хэш с другой стоимостью считается устаревшим и
+# пересчитывается при следующем входе
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    bcrypt__default_rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+)
+
+# bcrypt отпускает GIL, поэтому хватает потоков; размер пула ограничивает
+# нагрузку на CPU при массовых регистрациях
+_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+def _verify_and_update(password: str, stored: str) -> Tuple[bool, Optional[str]]:
+    if not pwd_context.identify(stored):
+        # пароль, сохраненный до хэширования открытым текстом
+        if hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8")):
+            return True, pwd_context.hash(password)
+        return False, None
+    return pwd_context.verify_and_update(password, stored)
+
+
+async def hash_password(password: str) -> str:
+    """bcrypt-хэш пароля, считается в пуле потоков, не блокируя цикл событий."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, pwd_context.hash, password)
+
+
+async def verify_password(password: str, stored: str) -> Tuple[bool, Optional[str]]:
+    """
+    Проверка пароля в пуле потоков. Возвращает (верен ли, новый хэш или None);
+    новый хэш - если сохраненный устарел (другая стоимость или открытый текст).
+    """
+    return await asyncio.get_running_loop().run_in_executor(_executor, _verify_and_update, password, stored)
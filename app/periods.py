@@ -0,0 +1,45 @@
+from datetime import date
+from typing import Iterable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from app.models import ClosedPeriod, Transaction, TransactionBA
+
+
+def closed_through(db: Session) -> Optional[date]:
+    """Последний день последнего закрытого периода или None, если закрытых нет."""
+    return db.query(func.max(ClosedPeriod.period_end)).scalar()
+
+
+def ensure_open(db: Session, *dates: date, cutoff: Optional[date] = None):
+    """409, если хотя бы одна дата попадает в закрытый период."""
+    cutoff = cutoff or closed_through(db)
+    if cutoff and any(d is not None and d <= cutoff for d in dates):
+        raise HTTPException(
+            status_code=409, detail=f"Period is closed through {cutoff}")
+
+
+def ensure_no_closed_entries(db: Session, account_ids: Iterable[int], cutoff: Optional[date]):
+    """
+    409, если у счетов есть операции в закрытых (и не перенесенных в архив)
+    периодах: удалить или откатить их нельзя.
+    """
+    account_ids = list(account_ids)
+    if not cutoff or not account_ids:
+        return
+    closed = db.query(Transaction.id).filter(
+        Transaction.account_id.in_(account_ids),
+        Transaction.transaction_date <= cutoff).first() or db.query(TransactionBA.id).filter(
+        or_(TransactionBA.account_id_from.in_(account_ids),
+            TransactionBA.account_id_to.in_(account_ids)),
+        TransactionBA.transaction_date <= cutoff).first()
+    if closed:
+        raise HTTPException(
+            status_code=409, detail=f"Account has entries in periods closed through {cutoff}; archive them first")
+
+
+def open_entries(column, cutoff: Optional[date]):
+    """Условие "операция в открытом периоде" для фильтра по дате (с отсечением секций)."""
+    return column > cutoff if cutoff else column.isnot(None)
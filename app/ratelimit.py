@@ -0,0 +1,190 @@
+import asyncio
+import math
+import time
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
+from sqlalchemy import create_engine, text
+
+from config import settings
+from app.database import SessionLocal, shard_urls
+from app.auth import get_current_db_role
+
+# аренда: пополнить корзину за прошедшее время и забрать до :lease целых токенов
+_REFILLED = "least(:burst, b.tokens + extract(epoch FROM now() - b.updated_at) * :rate)"
+_LEASE_TOKENS_SQL = text(f"""
+INSERT INTO rate_limit_buckets AS b (key, tokens, granted, updated_at)
+VALUES (:key, :burst - least(:lease, floor(:burst)), least(:lease, floor(:burst)), now())
+ON CONFLICT (key) DO UPDATE SET
+    tokens = {_REFILLED} - least(:lease, floor({_REFILLED})),
+    granted = least(:lease, floor({_REFILLED})),
+    updated_at = now()
+RETURNING b.granted, b.tokens
+""")
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionControl:
+    """
+    Ограничение запросов по роли БД и маршруту: корзина токенов на частоту
+    и счетчик одновременно выполняемых запросов. Вместо ожидания соединения
+    из пула лишние запросы сразу получают 429 с Retry-After.
+
+    Роль задается подключением (DATABASE_URL), поэтому определяется один раз
+    на процесс. Без RATE_LIMIT_USE_DB корзины живут в памяти процесса, и лимиты
+    делятся между WEB_WORKERS; с ним корзины хранятся в rate_limit_buckets,
+    а процесс арендует из них токены на lease_seconds вперед через свое
+    соединение вне пула запросов - в БД ходит одна аренда на порцию запросов.
+    """
+
+    def __init__(self, rate_rules: Dict[str, str], concurrency_rules: Dict[str, str], workers: int,
+                 use_db: bool = False, lease_seconds: float = 0.1):
+        self.use_db = use_db
+        self.lease_seconds = lease_seconds
+        share = 1 if use_db else max(1, workers)
+        self.rate_rules = {}
+        for key, value in rate_rules.items():
+            rate, _, burst = value.partition("/")
+            rate = float(rate)
+            burst = float(burst) if burst else max(1.0, rate)
+            self.rate_rules[key] = (rate / share, max(1.0, burst / share))
+        self.concurrency_rules = {key: max(1, math.ceil(int(value) / max(1, workers)))
+                                  for key, value in concurrency_rules.items()}
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._metrics: Dict[str, Dict[str, int]] = {}
+        self._role: Optional[str] = None
+        # корзина -> (арендованные токены, когда снова спрашивать БД после отказа)
+        self._leases: Dict[str, Tuple[int, float]] = {}
+        self._lease_locks: Dict[str, asyncio.Lock] = {}
+        self._engine = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.rate_rules or self.concurrency_rules)
+
+    def route_key(self, request: Request) -> Optional[str]:
+        """"МЕТОД /шаблон/{пути}" маршрута, на который попадет запрос."""
+        for route in request.app.router.routes:
+            match, _ = route.matches(request.scope)
+            if match == Match.FULL:
+                return f"{request.method} {route.path}"
+        return None
+
+    async def role(self) -> str:
+        if self._role is None:
+            def resolve():
+                with SessionLocal() as db:
+                    return get_current_db_role(db)
+            role = await run_in_threadpool(resolve)
+            if role is None:
+                return "unknown"
+            self._role = role
+        return self._role
+
+    def _rule(self, rules: dict, role: str, route: str):
+        for key in (f"{role}:{route}", f"*:{route}", f"{role}:*", "*:*"):
+            if key in rules:
+                return rules[key]
+        return None
+
+    def _count(self, bucket: str, name: str):
+        metrics = self._metrics.setdefault(
+            bucket, {"allowed": 0, "rejected_rate": 0, "rejected_concurrency": 0})
+        metrics[name] += 1
+
+    async def acquire(self, role: str, route: str) -> Optional[str]:
+        """
+        Пропускает запрос или выбрасывает RateLimited. Возвращает ключ, который
+        нужно передать в release() после ответа (None - освобождать нечего).
+        """
+        bucket = f"{role}:{route}"
+        # сначала место по параллельности: запрос, отклоненный по ней, не тратит токен
+        limit = self._rule(self.concurrency_rules, role, route)
+        if limit is not None:
+            if self._in_flight.get(bucket, 0) >= limit:
+                self._count(bucket, "rejected_concurrency")
+                raise RateLimited(1, "Too many concurrent requests")
+            self._in_flight[bucket] = self._in_flight.get(bucket, 0) + 1
+        rate_rule = self._rule(self.rate_rules, role, route)
+        if rate_rule is not None:
+            try:
+                wait = await self._take_token(bucket, *rate_rule)
+            except BaseException:
+                self.release(bucket if limit is not None else None)
+                raise
+            if wait > 0:
+                self.release(bucket if limit is not None else None)
+                self._count(bucket, "rejected_rate")
+                raise RateLimited(wait, "Too many requests")
+        self._count(bucket, "allowed")
+        return bucket if limit is not None else None
+
+    def release(self, bucket: Optional[str]):
+        if bucket is not None:
+            self._in_flight[bucket] -= 1
+
+    async def _take_token(self, bucket: str, rate: float, burst: float) -> float:
+        """Списывает токен; 0 - запрос пропущен, иначе через сколько секунд появится токен."""
+        if self.use_db:
+            return await self._take_leased_token(bucket, rate, burst)
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(bucket, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        self._buckets[bucket] = (tokens - 1 if allowed else tokens, now)
+        if allowed:
+            return 0
+        return (1 - tokens) / rate if rate > 0 else 60
+
+    async def _take_leased_token(self, bucket: str, rate: float, burst: float) -> float:
+        # одновременные запросы корзины ждут одну аренду, а не идут в БД каждый
+        async with self._lease_locks.setdefault(bucket, asyncio.Lock()):
+            held, retry_at = self._leases.get(bucket, (0, 0.0))
+            if held == 0:
+                now = time.monotonic()
+                if now < retry_at:
+                    return retry_at - now
+                if self._engine is None:
+                    # свои соединения: лимитер не занимает пул, который он защищает
+                    self._engine = create_engine(shard_urls()[0], pool_size=1, max_overflow=1, pool_pre_ping=True)
+                lease = int(min(burst, max(1, rate * self.lease_seconds)))
+                held, tokens = await run_in_threadpool(self._lease_tokens_db, bucket, rate, burst, lease)
+                if held == 0:
+                    wait = (1 - tokens) / rate if rate > 0 else 60
+                    self._leases[bucket] = (0, now + wait)
+                    return wait
+            self._leases[bucket] = (held - 1, 0.0)
+            return 0
+
+    def _lease_tokens_db(self, bucket: str, rate: float, burst: float, lease: int):
+        with self._engine.begin() as conn:
+            row = conn.execute(_LEASE_TOKENS_SQL, {
+                "key": bucket, "rate": rate, "burst": burst, "lease": lease}).one()
+        return row.granted, row.tokens
+
+    def dispose(self):
+        """Закрывает соединения аренды токенов (при остановке приложения)."""
+        if self._engine is not None:
+            self._engine.dispose()
+            self._engine = None
+
+    def stats(self) -> list:
+        """Счетчики пропущенных и отклоненных запросов по корзинам."""
+        return [
+            {"bucket": bucket, "in_flight": self._in_flight.get(bucket, 0), **metrics}
+            for bucket, metrics in sorted(self._metrics.items())
+        ]
+
+
+admission = AdmissionControl(settings.RATE_LIMIT_RULES, settings.CONCURRENCY_LIMIT_RULES,
+                             settings.WEB_WORKERS, settings.RATE_LIMIT_USE_DB,
+                             settings.RATE_LIMIT_DB_LEASE_SECONDS)
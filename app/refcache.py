@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from config import settings
+from app.auth import get_current_db_role
+from app.database import session_source
+from app.models import Account, Category
+
+
+class ReferenceCache:
+    """
+    LRU-кэш в памяти процесса для полей, которые почти не меняются:
+    владельцы категорий и счетов. Ключ включает шард (или реплику) и
+    роль БД, поэтому значение, прочитанное одной ролью, другой не отдается.
+    Маршруты записи категорий и счетов вызывают invalidate_*; счетчик
+    поколений не дает чтению, начатому до инвалидации, положить в кэш
+    старое значение. Другие процессы видят изменение не позже ttl_seconds.
+    Тип категории не кэшируется: от него зависит знак операции в балансе,
+    и он читается в транзакции записи. Отсутствующие записи не кэшируются.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # (вид, id) -> {(база, роль): (значение, срок)}; порядок - LRU
+        self._entries: "OrderedDict[Tuple[str, int], Dict[Tuple[str, str], Tuple[object, float]]]" = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _lookup(self, db: Session, kind: str, entity_id: int, load: Callable):
+        source = (session_source(db), get_current_db_role(db) or "unknown")
+        key = (kind, entity_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, {}).get(source)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                return entry[0]
+            generation = self._generation
+        value = load()
+        if value is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries.setdefault(key, {})[source] = (value, now + self.ttl_seconds)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+        return value
+
+    def category_owner(self, db: Session, category_id: int) -> Optional[int]:
+        return self._lookup(db, "category", category_id, lambda: db.query(
+            Category.user_id).filter(Category.id == category_id).scalar())
+
+    def account_owner(self, db: Session, account_id: int) -> Optional[int]:
+        return self._lookup(db, "account", account_id, lambda: db.query(
+            Account.user_id).filter(Account.id == account_id).scalar())
+
+    def _invalidate(self, kind: str, entity_id: int):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop((kind, entity_id), None)
+
+    def invalidate_category(self, category_id: int):
+        self._invalidate("category", category_id)
+
+    def invalidate_account(self, account_id: int):
+        self._invalidate("account", account_id)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+reference_cache = ReferenceCache(
+    settings.REFERENCE_CACHE_MAX_ENTRIES, settings.REFERENCE_CACHE_TTL_SECONDS)
@@ -1,23 +1,114 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
+from sqlalchemy import Integer, case, func, literal, select, union_all
 from typing import List, Optional
-from app.database import get_db
-from app.models import Account, Transaction, TransactionBA, User
-from app.schemas import AccountCreate, AccountResponse, AccountUpdate
+from datetime import date
+from app.database import get_db, get_read_db, scatter_gather
+from app.models import Account, Category, Transaction, TransactionBA, User
+from app.schemas import AccountCreate, AccountResponse, AccountUpdate, StatementEntryResponse
 from app.auth import require_permission
-from decimal import Decimal
+from app.idempotency import IdempotentRoute
+from app.refcache import reference_cache
+from app.analytics import analytics_cache
+from app.concurrency import check_version, compare_and_swap, if_match_version, set_etag
+from app.periods import closed_through, ensure_no_closed_entries, open_entries
+from app.fields import parse_fields, render_fields, select_fields
 
-router = APIRouter(prefix="/accounts", tags=["accounts"])
+router = APIRouter(prefix="/accounts", tags=["accounts"], route_class=IdempotentRoute)
 
 
 @router.get("/", response_model=List[AccountResponse])
-async def get_accounts(request: Request, user_id: Optional[int] = None, db: Session = Depends(get_db)):
+async def get_accounts(request: Request, user_id: Optional[int] = None, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
+    """fields=id,name,... - выбрать из БД и вернуть только эти поля."""
     require_permission(db, request, "accounts", "view")
-    query = db.query(Account)
+    names = parse_fields(fields, AccountResponse)
+    entities = select_fields(Account, names, "id")
     if user_id:
-        query = query.filter(Account.user_id == user_id)
-    accounts = query.all()
-    return accounts
+        rows = db.query(*entities).filter(Account.user_id == user_id).all()
+        return render_fields(AccountResponse, names, rows)
+    # без пользователя - счета всех шардов
+    rows = scatter_gather(lambda s, n: s.query(*entities).order_by(Account.id).limit(n).all(),
+                          key=lambda a: a.id)
+    return render_fields(AccountResponse, names, rows)
+
+
+@router.get("/{account_id}/statement", response_model=List[StatementEntryResponse])
+async def get_account_statement(
+    account_id: int,
+    request: Request,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    offset: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Выписка по счету: транзакции и переводы в обе стороны одним потоком
+    по дате, с суммой со знаком и балансом после каждой операции.
+    Баланс считается оконной функцией от текущего баланса счета; если выписка
+    начинается после закрытого периода, его операции не читаются.
+    """
+    require_permission(db, request, "transactions", "view")
+    account = db.query(Account).filter(Account.id == account_id).first()
+    if not account:
+        raise HTTPException(status_code=404, detail="Account not found")
+    cutoff = closed_through(db)
+    if not (start_date and cutoff and start_date > cutoff):
+        cutoff = None
+
+    entries = union_all(
+        select(
+            literal("transaction").label("entry_type"),
+            Transaction.id.label("entry_id"),
+            Transaction.transaction_date,
+            Transaction.description,
+            Transaction.category_id,
+            literal(None, Integer).label("counterparty_account_id"),
+            case((Category.type == 'income', Transaction.amount),
+                 else_=-Transaction.amount).label("amount"),
+        ).join(Category, Category.id == Transaction.category_id
+               ).where(Transaction.account_id == account_id,
+                       open_entries(Transaction.transaction_date, cutoff)),
+        select(
+            literal("transfer_out"),
+            TransactionBA.id,
+            TransactionBA.transaction_date,
+            TransactionBA.description,
+            literal(None, Integer),
+            TransactionBA.account_id_to,
+            -TransactionBA.amount,
+        ).where(TransactionBA.account_id_from == account_id,
+                open_entries(TransactionBA.transaction_date, cutoff)),
+        select(
+            literal("transfer_in"),
+            TransactionBA.id,
+            TransactionBA.transaction_date,
+            TransactionBA.description,
+            literal(None, Integer),
+            TransactionBA.account_id_from,
+            TransactionBA.amount,
+        ).where(TransactionBA.account_id_to == account_id,
+                open_entries(TransactionBA.transaction_date, cutoff)),
+    ).subquery()
+
+    ordering = (entries.c.transaction_date,
+                entries.c.entry_type, entries.c.entry_id)
+    # баланс после операции = начальный баланс + накопленная сумма,
+    # начальный баланс = текущий баланс - сумма всех операций
+    ledger = select(
+        entries,
+        (account.balance - func.sum(entries.c.amount).over()
+         + func.sum(entries.c.amount).over(order_by=ordering, rows=(None, 0))).label("balance"),
+    ).subquery()
+
+    query = select(ledger)
+    if start_date:
+        query = query.where(ledger.c.transaction_date >= start_date)
+    if end_date:
+        query = query.where(ledger.c.transaction_date <= end_date)
+    query = query.order_by(ledger.c.transaction_date, ledger.c.entry_type,
+                           ledger.c.entry_id).offset(offset).limit(limit)
+    return db.execute(query).mappings().all()
 
 
 @router.post("/", response_model=AccountResponse)
@@ -28,6 +119,9 @@ async def create_account(account: AccountCreate, request: Request, db: Session =
             status_code=400, detail="Account balance cannot be negative")
     if not account.name:
         raise HTTPException(status_code=400, detail="Account name is required")
+    if len(account.currency) != 3 or not account.currency.isalpha():
+        raise HTTPException(
+            status_code=400, detail="Currency must be a 3-letter ISO code")
     user = db.query(User).filter(User.id == account.user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -36,7 +130,8 @@ async def create_account(account: AccountCreate, request: Request, db: Session =
         user_id=account.user_id,
         name=account.name,
         type=account.type,
-        balance=account.balance
+        balance=account.balance,
+        currency=account.currency.upper()
     )
     db.add(db_account)
     db.commit()
@@ -45,43 +140,58 @@ async def create_account(account: AccountCreate, request: Request, db: Session =
 
 
 @router.put("/{account_id}", response_model=AccountResponse)
-async def update_account(account_id: int, payload: AccountUpdate, request: Request, db: Session = Depends(get_db)):
+async def update_account(account_id: int, payload: AccountUpdate, request: Request, response: Response, db: Session = Depends(get_db)):
+    """
+    Изменение счета одним UPDATE с проверкой версии из If-Match (412 при
+    расхождении). Версия меняется только здесь, движения по балансу ее не трогают,
+    поэтому balance с If-Match не принимается: версия не защитила бы его
+    от перезаписи операций, проведенных после чтения счета.
+    """
     require_permission(db, request, "accounts", "update")
-    account = db.query(Account).filter(Account.id == account_id).first()
-    if not account:
-        raise HTTPException(status_code=404, detail="Account not found")
+    expected_version = if_match_version(request)
+    if payload.balance is not None and expected_version is not None:
+        raise HTTPException(
+            status_code=400, detail="Account balance cannot be set with If-Match; it is changed by transactions")
+    values = {}
     if payload.user_id:
         user = db.query(User).filter(User.id == payload.user_id).first()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        account.user_id = payload.user_id
+        values["user_id"] = payload.user_id
     if payload.name is not None:
         if not payload.name:
             raise HTTPException(
                 status_code=400, detail="Account name is required")
-        account.name = payload.name
+        values["name"] = payload.name
     if payload.type is not None:
-        account.type = payload.type
+        values["type"] = payload.type
     if payload.balance is not None:
         if payload.balance < 0:
             raise HTTPException(
                 status_code=400, detail="Account balance cannot be negative")
-        account.balance = payload.balance
-    db.commit()
-    db.refresh(account)
+        values["balance"] = payload.balance
+    account = compare_and_swap(db, Account, account_id, expected_version, values,
+                               not_found="Account not found")
+    reference_cache.invalidate_account(account_id)
+    set_etag(response, account["version"])
     return account
 
 
 @router.delete("/{account_id}")
 async def delete_account(account_id: int, request: Request, db: Session = Depends(get_db)):
     require_permission(db, request, "accounts", "delete")
-    account = db.query(Account).filter(Account.id == account_id).first()
+    account = db.query(Account).filter(Account.id == account_id).with_for_update().first()
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
+    check_version(account.version, if_match_version(request))
+    # закрытые периоды не трогаем: в них операций счета быть не должно
+    cutoff = closed_through(db)
+    ensure_no_closed_entries(db, [account_id], cutoff)
 
     transfers = db.query(TransactionBA).filter(
         (TransactionBA.account_id_from == account_id) | (
-            TransactionBA.account_id_to == account_id)
+            TransactionBA.account_id_to == account_id),
+        open_entries(TransactionBA.transaction_date, cutoff)
     ).all()
     for t in transfers:
         a_from = db.query(Account).filter(
@@ -89,21 +199,25 @@ async def delete_account(account_id: int, request: Request, db: Session = Depend
         a_to = db.query(Account).filter(
             Account.id == t.account_id_to).with_for_update().first()
         if a_from and a_to:
-            amt = Decimal(str(t.amount))
+            amt = t.amount
             if account_id == t.account_id_from:
-                if Decimal(a_to.balance) - amt < 0:
+                if a_to.balance - amt < 0:
                     raise HTTPException(
                         status_code=400, detail="Cannot delete account: transfer rollback would cause negative balance")
-                a_from.balance = Decimal(a_from.balance) + amt
-                a_to.balance = Decimal(a_to.balance) - amt
+                a_from.balance = a_from.balance + amt
+                a_to.balance = a_to.balance - amt
             else:
-                a_from.balance = Decimal(a_from.balance) + amt
-                a_to.balance = Decimal(a_to.balance) - amt
+                a_from.balance = a_from.balance + amt
+                a_to.balance = a_to.balance - amt
         db.delete(t)
 
-    db.query(Transaction).filter(Transaction.account_id ==
-                                 account_id).delete(synchronize_session=False)
+    db.query(Transaction).filter(Transaction.account_id == account_id,
+                                 open_entries(Transaction.transaction_date, cutoff)
+                                 ).delete(synchronize_session=False)
 
+    user_id = account.user_id
     db.delete(account)
     db.commit()
+    reference_cache.invalidate_account(account_id)
+    analytics_cache.invalidate_user(user_id)
     return {"message": "Account deleted successfully"}
@@ -1,22 +1,91 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
+from sqlalchemy import and_, case, func
 from typing import List, Optional
-from app.database import get_db
-from app.models import Budget, Category, User
-from app.schemas import BudgetCreate, BudgetResponse, BudgetUpdate
+from datetime import date
+from decimal import Decimal
+from app.database import get_db, get_read_db, scatter_gather
+from app.models import Budget, User, Transaction
+from app.schemas import BudgetCreate, BudgetResponse, BudgetUpdate, BudgetStatusResponse
 from app.auth import require_permission
+from app.idempotency import IdempotentRoute
+from app.refcache import reference_cache
+from app.concurrency import check_version, compare_and_swap, if_match_version, set_etag
 
-router = APIRouter(prefix="/budgets", tags=["budgets"])
+router = APIRouter(prefix="/budgets", tags=["budgets"], route_class=IdempotentRoute)
 
 
 @router.get("/", response_model=List[BudgetResponse])
-async def get_budgets(request: Request, user_id: Optional[int] = None, db: Session = Depends(get_db)):
+async def get_budgets(request: Request, user_id: Optional[int] = None, db: Session = Depends(get_read_db)):
     require_permission(db, request, "budgets", "view")
-    query = db.query(Budget)
     if user_id:
-        query = query.filter(Budget.user_id == user_id)
-    budgets = query.all()
-    return budgets
+        return db.query(Budget).filter(Budget.user_id == user_id).all()
+    # без пользователя - бюджеты всех шардов
+    return scatter_gather(lambda s, n: s.query(Budget).order_by(Budget.id).limit(n).all(),
+                          key=lambda b: b.id)
+
+
+def _status_query(db: Session, on_date: date):
+    """Активные на on_date бюджеты с суммой трат за период (одним запросом)."""
+    return db.query(
+        Budget.id,
+        Budget.category_id,
+        Budget.amount_limit,
+        Budget.period_start,
+        Budget.period_end,
+        func.coalesce(func.sum(Transaction.amount), 0).label('spent'),
+        func.coalesce(func.sum(case(
+            (Transaction.transaction_date <= on_date, Transaction.amount), else_=0)), 0).label('spent_to_date'),
+    ).outerjoin(Transaction, and_(
+        Transaction.category_id == Budget.category_id,
+        Transaction.transaction_date >= Budget.period_start,
+        Transaction.transaction_date <= Budget.period_end,
+    )).filter(
+        Budget.period_start <= on_date,
+        Budget.period_end >= on_date,
+    ).group_by(Budget.id)
+
+
+@router.get("/status", response_model=List[BudgetStatusResponse])
+async def get_budgets_status(request: Request, user_id: Optional[int] = None, on_date: Optional[date] = None, db: Session = Depends(get_read_db)):
+    """
+    Исполнение активных бюджетов одним сгруппированным запросом:
+    потрачено, остаток, процент и прогноз трат на конец периода
+    по среднему дневному расходу с начала периода.
+    """
+    require_permission(db, request, "budgets", "view")
+    on_date = on_date or date.today()
+
+    def fetch(s: Session, n: Optional[int]):
+        query = _status_query(s, on_date)
+        if user_id:
+            query = query.filter(Budget.user_id == user_id)
+        return query.order_by(Budget.period_end, Budget.id).limit(n).all()
+
+    if user_id:
+        rows = fetch(db, None)
+    else:
+        rows = scatter_gather(fetch, key=lambda r: (r.period_end, r.id))
+
+    result = []
+    for r in rows:
+        elapsed_days = (on_date - r.period_start).days + 1
+        total_days = (r.period_end - r.period_start).days + 1
+        # прогноз: уже потраченное + средний дневной расход на оставшиеся дни
+        projected = r.spent + r.spent_to_date / elapsed_days * (total_days - elapsed_days)
+        result.append({
+            "budget_id": r.id,
+            "category_id": r.category_id,
+            "amount_limit": r.amount_limit,
+            "period_start": r.period_start,
+            "period_end": r.period_end,
+            "spent": r.spent,
+            "remaining": r.amount_limit - r.spent,
+            "percent": float(r.spent / r.amount_limit * 100),
+            "projected_spent": projected.quantize(Decimal("0.01")),
+            "projected_over_limit": projected > r.amount_limit,
+        })
+    return result
 
 
 @router.post("/", response_model=BudgetResponse)
@@ -29,13 +98,16 @@ async def create_budget(budget: BudgetCreate, request: Request, db: Session = De
     if budget.period_start > budget.period_end:
         raise HTTPException(
             status_code=400, detail="Budget period_start must be before period_end")
-    user = db.query(User).filter(User.id == budget.user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    cat = db.query(Category).filter(Category.id == budget.category_id).first()
-    if not cat:
+    # владелец категории существует (внешний ключ), так что пользователя
+    # проверяем запросом, только если категория не его
+    category_owner = reference_cache.category_owner(db, budget.category_id)
+    if category_owner != budget.user_id:
+        user = db.query(User).filter(User.id == budget.user_id).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+    if category_owner is None:
         raise HTTPException(status_code=404, detail="Category not found")
-    if cat.user_id != budget.user_id:
+    if category_owner != budget.user_id:
         raise HTTPException(
             status_code=400, detail="Category belongs to another user")
     db_budget = Budget(
@@ -52,48 +124,66 @@ async def create_budget(budget: BudgetCreate, request: Request, db: Session = De
 
 
 @router.put("/{budget_id}", response_model=BudgetResponse)
-async def update_budget(budget_id: int, payload: BudgetUpdate, request: Request, db: Session = Depends(get_db)):
+async def update_budget(budget_id: int, payload: BudgetUpdate, request: Request, response: Response, db: Session = Depends(get_db)):
+    """
+    Изменение бюджета одним UPDATE с проверкой версии из If-Match. Проверки,
+    зависящие от текущих значений (владелец категории, порядок дат периода),
+    выполняются в том же UPDATE.
+    """
     require_permission(db, request, "budgets", "update")
-    budget = db.query(Budget).filter(Budget.id == budget_id).first()
-    if not budget:
-        raise HTTPException(status_code=404, detail="Budget not found")
+    values = {}
+    checks = []
     if payload.user_id:
         user = db.query(User).filter(User.id == payload.user_id).first()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        budget.user_id = payload.user_id
+        values["user_id"] = payload.user_id
     if payload.category_id:
-        cat = db.query(Category).filter(
-            Category.id == payload.category_id).first()
-        if not cat:
+        category_owner = reference_cache.category_owner(db, payload.category_id)
+        if category_owner is None:
             raise HTTPException(status_code=404, detail="Category not found")
-        if budget.user_id and cat.user_id != budget.user_id:
-            raise HTTPException(
-                status_code=400, detail="Category belongs to another user")
-        budget.category_id = payload.category_id
+        if payload.user_id:
+            if category_owner != payload.user_id:
+                raise HTTPException(
+                    status_code=400, detail="Category belongs to another user")
+        else:
+            checks.append((Budget.user_id == category_owner, "Category belongs to another user"))
+        values["category_id"] = payload.category_id
     if payload.amount_limit is not None:
         if payload.amount_limit <= 0:
             raise HTTPException(
                 status_code=400, detail="Budget amount_limit must be greater than zero")
-        budget.amount_limit = payload.amount_limit
+        values["amount_limit"] = payload.amount_limit
+    period_error = "Budget period_start must be before period_end"
+    if payload.period_start and payload.period_end:
+        if payload.period_start > payload.period_end:
+            raise HTTPException(status_code=400, detail=period_error)
+    elif payload.period_start:
+        checks.append((Budget.period_end >= payload.period_start, period_error))
+    elif payload.period_end:
+        checks.append((Budget.period_start <= payload.period_end, period_error))
     if payload.period_start:
-        budget.period_start = payload.period_start
+        values["period_start"] = payload.period_start
     if payload.period_end:
-        budget.period_end = payload.period_end
-    if budget.period_start > budget.period_end:
-        raise HTTPException(
-            status_code=400, detail="Budget period_start must be before period_end")
-    db.commit()
-    db.refresh(budget)
+        values["period_end"] = payload.period_end
+    budget = compare_and_swap(db, Budget, budget_id, if_match_version(request), values,
+                              checks=checks, not_found="Budget not found")
+    set_etag(response, budget["version"])
     return budget
 
 
 @router.delete("/{budget_id}")
 async def delete_budget(budget_id: int, request: Request, db: Session = Depends(get_db)):
     require_permission(db, request, "budgets", "delete")
-    budget = db.query(Budget).filter(Budget.id == budget_id).first()
-    if not budget:
-        raise HTTPException(status_code=404, detail="Budget not found")
-    db.delete(budget)
+    expected = if_match_version(request)
+    query = db.query(Budget).filter(Budget.id == budget_id)
+    if expected is not None:
+        query = query.filter(Budget.version == expected)
+    # один DELETE; причину, если строка не удалилась, выясняем отдельно
+    if not query.delete(synchronize_session=False):
+        current = db.query(Budget.version).filter(Budget.id == budget_id).scalar()
+        if current is None:
+            raise HTTPException(status_code=404, detail="Budget not found")
+        check_version(current, expected)
     db.commit()
     return {"message": "Budget deleted successfully"}
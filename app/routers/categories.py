@@ -1,22 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from app.database import get_db
+from app.database import get_db, get_read_db, scatter_gather
 from app.models import Category, Transaction, Budget, User
 from app.schemas import CategoryCreate, CategoryResponse, CategoryUpdate
 from app.auth import require_permission
+from app.idempotency import IdempotentRoute
+from app.refcache import reference_cache
+from app.analytics import analytics_cache
+from app.periods import closed_through
+from app.concurrency import check_version, compare_and_swap, if_match_version, set_etag
 
-router = APIRouter(prefix="/categories", tags=["categories"])
+router = APIRouter(prefix="/categories", tags=["categories"], route_class=IdempotentRoute)
 
 
 @router.get("/", response_model=List[CategoryResponse])
-async def get_categories(request: Request, user_id: Optional[int] = None, db: Session = Depends(get_db)):
+async def get_categories(request: Request, user_id: Optional[int] = None, db: Session = Depends(get_read_db)):
     require_permission(db, request, "categories", "view")
-    query = db.query(Category)
     if user_id:
-        query = query.filter(Category.user_id == user_id)
-    categories = query.all()
-    return categories
+        return db.query(Category).filter(Category.user_id == user_id).all()
+    # без пользователя - категории всех шардов
+    return scatter_gather(lambda s, n: s.query(Category).order_by(Category.id).limit(n).all(),
+                          key=lambda c: c.id)
 
 
 @router.post("/", response_model=CategoryResponse)
@@ -43,42 +48,58 @@ async def create_category(category: CategoryCreate, request: Request, db: Sessio
 
 
 @router.put("/{category_id}", response_model=CategoryResponse)
-async def update_category(category_id: int, payload: CategoryUpdate, request: Request, db: Session = Depends(get_db)):
+async def update_category(category_id: int, payload: CategoryUpdate, request: Request, response: Response, db: Session = Depends(get_db)):
+    """Изменение категории одним UPDATE с проверкой версии из If-Match."""
     require_permission(db, request, "categories", "update")
-    category = db.query(Category).filter(Category.id == category_id).first()
-    if not category:
-        raise HTTPException(status_code=404, detail="Category not found")
+    values = {}
     if payload.user_id:
         user = db.query(User).filter(User.id == payload.user_id).first()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        category.user_id = payload.user_id
+        values["user_id"] = payload.user_id
     if payload.name is not None:
         if not payload.name:
             raise HTTPException(
                 status_code=400, detail="Category name is required")
-        category.name = payload.name
+        values["name"] = payload.name
     if payload.type is not None:
         if payload.type not in ('income', 'expense'):
             raise HTTPException(
                 status_code=400, detail="Category type must be 'income' or 'expense'")
-        category.type = payload.type
-    db.commit()
-    db.refresh(category)
+        values["type"] = payload.type
+    category = compare_and_swap(db, Category, category_id, if_match_version(request), values,
+                                not_found="Category not found")
+    reference_cache.invalidate_category(category_id)
+    if "user_id" in values:
+        # операции категории перешли к другому пользователю
+        analytics_cache.clear()
+    else:
+        analytics_cache.invalidate_user(category["user_id"])
+    set_etag(response, category["version"])
     return category
 
 
 @router.delete("/{category_id}")
 async def delete_category(category_id: int, request: Request, db: Session = Depends(get_db)):
     require_permission(db, request, "categories", "delete")
-    category = db.query(Category).filter(Category.id == category_id).first()
+    category = db.query(Category).filter(Category.id == category_id).with_for_update().first()
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
+    check_version(category.version, if_match_version(request))
+    # операции закрытых периодов удалить нельзя (их сначала переносят в архив)
+    cutoff = closed_through(db)
+    if cutoff and db.query(Transaction.id).filter(
+            Transaction.category_id == category_id, Transaction.transaction_date <= cutoff).first():
+        raise HTTPException(
+            status_code=409, detail=f"Category has entries in periods closed through {cutoff}; archive them first")
 
     db.query(Transaction).filter(Transaction.category_id ==
                                  category_id).delete(synchronize_session=False)
     db.query(Budget).filter(Budget.category_id ==
                             category_id).delete(synchronize_session=False)
+    user_id = category.user_id
     db.delete(category)
     db.commit()
+    reference_cache.invalidate_category(category_id)
+    analytics_cache.invalidate_user(user_id)
     return {"message": "Category deleted successfully"}
@@ -0,0 +1,85 @@
+import time
+from fastapi import APIRouter, HTTPException, Request
+from sqlalchemy import func, tuple_
+from typing import Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+from app.database import SessionLocal, request_shard
+from app.models import Log
+from app.schemas import ChangesPage
+from app.auth import require_permission
+from app.changes import change_notifier
+from config import settings
+
+router = APIRouter(prefix="/changes", tags=["changes"])
+
+CHANGES_MAX_LIMIT = 1000
+
+
+def _position(db, since: Optional[str]) -> Tuple[int, int]:
+    """
+    Позиция в ленте - (txid, log_id). since - курсор "txid:log_id" из прошлого
+    ответа или просто log_id (тогда txid берется из этой записи логов).
+    """
+    if not since:
+        return 0, 0
+    try:
+        if ":" in since:
+            txid, log_id = since.split(":")
+            return int(txid), int(log_id)
+        log_id = int(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    txid = db.query(Log.txid).filter(Log.log_id == log_id).scalar()
+    if txid is None:
+        raise HTTPException(status_code=404, detail="Log entry not found")
+    return txid, log_id
+
+
+def _fetch_changes(request: Request, shard: int, since: Optional[str], table_name: Optional[str], limit: int) -> dict:
+    # своя короткая сессия: long-poll не держит соединение из пула, пока ждет
+    with SessionLocal(shard) as db:
+        require_permission(db, request, "logs", "view")
+        txid, log_id = _position(db, since)
+        # Only rows of transactions older than every running one: a transaction
+        # still in progress may later commit rows with lower log_id, so ordering
+        # by (txid, log_id) below the snapshot xmin never skips a change.
+        query = db.query(Log).filter(
+            Log.txid < func.txid_snapshot_xmin(func.txid_current_snapshot()),
+            tuple_(Log.txid, Log.log_id) > tuple_(txid, log_id))
+        if table_name:
+            query = query.filter(Log.table_name == table_name)
+        changes = query.order_by(Log.txid, Log.log_id).limit(limit + 1).all()
+
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if changes:
+        txid, log_id = changes[-1].txid, changes[-1].log_id
+    return {"changes": changes, "cursor": f"{txid}:{log_id}", "has_more": has_more}
+
+
+@router.get("/", response_model=ChangesPage)
+async def get_changes(
+    request: Request,
+    since: Optional[str] = None,
+    table_name: Optional[str] = None,
+    limit: int = 500,
+    wait: float = 0
+):
+    """
+    Лента изменений по таблице logs, начиная после курсора since.
+    Чтобы продолжить, передайте cursor из ответа; has_more - есть следующая
+    порция. При wait > 0 и отсутствии изменений запрос ждет их до wait секунд
+    (long-poll, не больше CHANGES_MAX_WAIT). При нескольких шардах лента
+    у каждого своя, шард выбирается параметром shard.
+    """
+    limit = min(max(limit, 1), CHANGES_MAX_LIMIT)
+    shard = await request_shard(request)
+    deadline = time.monotonic() + min(max(wait, 0), settings.CHANGES_MAX_WAIT)
+    page = await run_in_threadpool(_fetch_changes, request, shard, since, table_name, limit)
+    while not page["changes"]:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        await change_notifier.wait(min(remaining, settings.CHANGES_POLL_INTERVAL), shard)
+        page = await run_in_threadpool(_fetch_changes, request, shard, page["cursor"], table_name, limit)
+    return page
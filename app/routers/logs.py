@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from app.database import get_db
+from app.database import get_db, get_read_db, scatter_gather
 from app.models import Log
 from app.schemas import LogResponse
 from app.auth import require_permission, get_current_db_role
+from app.fields import parse_fields, render_fields, select_fields
 
 router = APIRouter(prefix="/logs", tags=["logs"])
 
@@ -14,18 +15,26 @@ async def get_logs(
     request: Request,
     table_name: Optional[str] = None,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db)
 ):
-    """Получить логи. Требуются права на просмотр логов."""
+    """
+    Получить логи. Требуются права на просмотр логов. fields=log_id,action,...
+    - выбрать только эти поля (например, без old_data/new_data).
+    """
     require_permission(db, request, "logs", "view")
-    
-    query = db.query(Log)
-    
-    if table_name:
-        query = query.filter(Log.table_name == table_name)
-    
-    logs = query.order_by(Log.action_date.desc()).limit(limit).all()
-    return logs
+    names = parse_fields(fields, LogResponse)
+    entities = select_fields(Log, names, "action_date")
+
+    def fetch(s: Session, n: int):
+        query = s.query(*entities)
+        if table_name:
+            query = query.filter(Log.table_name == table_name)
+        return query.order_by(Log.action_date.desc()).limit(n).all()
+
+    # логи всех шардов, самые новые первыми
+    rows = scatter_gather(fetch, key=lambda log: log.action_date, limit=limit, reverse=True)
+    return render_fields(LogResponse, names, rows)
 
 
 @router.get("/current-role")
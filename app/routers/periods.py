@@ -0,0 +1,133 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.orm import Session
+from sqlalchemy import case, func, insert, text
+from typing import List, Optional
+from datetime import date, timedelta
+from starlette.concurrency import run_in_threadpool
+from app.database import SessionLocal, get_db, get_read_db, scatter_gather, shard_count
+from app.models import Account, Category, ClosedPeriod, PeriodAccountBalance, PeriodCategoryTotal, Transaction, TransactionBA
+from app.schemas import PeriodClose, ClosedPeriodResponse
+from app.auth import require_permission
+from app.idempotency import IdempotentRoute
+from app.periods import closed_through
+from app.analytics import analytics_cache
+
+router = APIRouter(prefix="/periods", tags=["periods"], route_class=IdempotentRoute)
+
+
+@router.get("/", response_model=List[ClosedPeriodResponse])
+async def get_closed_periods(request: Request, db: Session = Depends(get_read_db)):
+    require_permission(db, request, "closed_periods", "view")
+    # периоды закрываются на всех шардах; период, закрытый не везде
+    # (прерванное закрытие), показывается по первому шарду, где он есть
+    periods = {}
+    for period in scatter_gather(lambda s, n: s.query(ClosedPeriod).order_by(ClosedPeriod.period_end).all(),
+                                 key=lambda p: p.period_end):
+        periods.setdefault(period.period_end, period)
+    return list(periods.values())
+
+
+def _close_shard(db: Session, payload: PeriodClose) -> Optional[ClosedPeriod]:
+    """
+    Снимок периода на одном шарде в транзакции db (без commit). None - на
+    этом шарде период уже закрыт (повтор после прерванного закрытия).
+    """
+    previous_end = closed_through(db)
+    if previous_end and payload.period_end <= previous_end:
+        return None
+
+    # Lock every account in id order: writers lock the account row first,
+    # so nothing changes balances while the snapshot is taken.
+    balances = {row.id: row.balance for row in db.query(Account.id, Account.balance).order_by(
+        Account.id).with_for_update()}
+
+    # остаток на конец периода = текущий баланс - движение после period_end
+    after = payload.period_end
+    signed = case((Category.type == 'income', Transaction.amount), else_=-Transaction.amount)
+    movements = db.query(Transaction.account_id, func.sum(signed)).join(
+        Category, Category.id == Transaction.category_id).filter(
+        Transaction.transaction_date > after).group_by(Transaction.account_id).all()
+    movements += db.query(TransactionBA.account_id_from, (-func.sum(TransactionBA.amount)).label('amount')).filter(
+        TransactionBA.transaction_date > after).group_by(TransactionBA.account_id_from).all()
+    movements += db.query(TransactionBA.account_id_to, func.sum(TransactionBA.amount)).filter(
+        TransactionBA.transaction_date > after).group_by(TransactionBA.account_id_to).all()
+    for account_id, amount in movements:
+        if account_id in balances:
+            balances[account_id] -= amount
+
+    period = ClosedPeriod(
+        period_start=previous_end + timedelta(days=1) if previous_end else None,
+        period_end=payload.period_end,
+        archived=payload.archive,
+    )
+    db.add(period)
+    db.flush()
+
+    totals = db.query(
+        Transaction.category_id,
+        Transaction.currency,
+        func.count(Transaction.id),
+        func.sum(Transaction.amount),
+    ).filter(Transaction.transaction_date <= payload.period_end)
+    if previous_end:
+        totals = totals.filter(Transaction.transaction_date > previous_end)
+    totals = totals.group_by(Transaction.category_id, Transaction.currency).all()
+
+    if balances:
+        db.execute(insert(PeriodAccountBalance), [
+            {"period_id": period.id, "account_id": account_id, "closing_balance": balance}
+            for account_id, balance in balances.items()])
+    if totals:
+        db.execute(insert(PeriodCategoryTotal), [
+            {"period_id": period.id, "category_id": category_id, "currency": currency,
+             "transaction_count": count, "total_amount": amount}
+            for category_id, currency, count, amount in totals])
+    if payload.archive:
+        db.execute(text("SELECT archive_transactions(:after, :to)"),
+                   {"after": previous_end, "to": payload.period_end})
+    return period
+
+
+def _close_all_shards(payload: PeriodClose) -> Optional[ClosedPeriod]:
+    """
+    Закрывает период на каждом шарде. Снимки всех шардов готовятся до
+    первого commit, поэтому ошибка на любом из них ничего не закрывает;
+    если прервался сам commit, повтор закроет период на оставшихся шардах.
+    Возвращает период первого шарда, где он закрыт сейчас.
+    """
+    sessions = [SessionLocal(shard) for shard in range(shard_count())]
+    try:
+        closed = [(db, _close_shard(db, payload)) for db in sessions]
+        for db, _ in closed:
+            db.commit()
+        for db, period in closed:
+            if period is not None:
+                db.refresh(period)
+                return period
+        return None
+    finally:
+        for db in sessions:
+            db.close()
+
+
+@router.post("/close", response_model=ClosedPeriodResponse)
+async def close_period(payload: PeriodClose, request: Request, db: Session = Depends(get_db)):
+    """
+    Закрыть период по period_end включительно (от конца предыдущего закрытого)
+    на всех шардах. Сохраняет остатки счетов на конец периода и итоги по
+    категориям за период, после чего операции с датой <= period_end нельзя
+    создать, изменить или удалить. С archive=true операции периода
+    переносятся в архивные таблицы.
+    """
+    require_permission(db, request, "closed_periods", "create")
+    if payload.period_end >= date.today():
+        raise HTTPException(
+            status_code=400, detail="Only a period that has already ended can be closed")
+    period = await run_in_threadpool(_close_all_shards, payload)
+    if period is None:
+        raise HTTPException(
+            status_code=400, detail=f"Period is already closed through {payload.period_end} or later")
+    if payload.archive:
+        # операции периода ушли из transactions
+        analytics_cache.clear()
+    return period
@@ -0,0 +1,112 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from datetime import date
+from starlette.concurrency import run_in_threadpool
+from app.database import get_db, get_read_db, scatter_gather
+from app.models import RecurringRule, Account
+from app.schemas import RecurringRuleCreate, RecurringRuleResponse, RecurringRuleUpdate
+from app.auth import require_permission
+from app.idempotency import IdempotentRoute
+from app.refcache import reference_cache
+from app.scheduler import FREQUENCIES, materialize_due
+
+router = APIRouter(prefix="/recurring", tags=["recurring"], route_class=IdempotentRoute)
+
+
+@router.get("/", response_model=List[RecurringRuleResponse])
+async def get_recurring_rules(request: Request, user_id: Optional[int] = None, db: Session = Depends(get_read_db)):
+    require_permission(db, request, "recurring_rules", "view")
+    if user_id:
+        return db.query(RecurringRule).join(Account).filter(Account.user_id == user_id).all()
+    # без пользователя - правила всех шардов
+    return scatter_gather(lambda s, n: s.query(RecurringRule).order_by(RecurringRule.id).limit(n).all(),
+                          key=lambda r: r.id)
+
+
+@router.post("/", response_model=RecurringRuleResponse)
+async def create_recurring_rule(rule: RecurringRuleCreate, request: Request, db: Session = Depends(get_db)):
+    require_permission(db, request, "recurring_rules", "create")
+    if rule.amount <= 0:
+        raise HTTPException(
+            status_code=400, detail="Recurring amount must be greater than zero")
+    if rule.frequency not in FREQUENCIES:
+        raise HTTPException(
+            status_code=400, detail="Frequency must be one of: " + ", ".join(FREQUENCIES))
+    if rule.end_date and rule.end_date < rule.start_date:
+        raise HTTPException(
+            status_code=400, detail="end_date must not be before start_date")
+    account_owner = reference_cache.account_owner(db, rule.account_id)
+    if account_owner is None:
+        raise HTTPException(status_code=404, detail="Account not found")
+    category_owner = reference_cache.category_owner(db, rule.category_id)
+    if category_owner is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    if account_owner != category_owner:
+        raise HTTPException(
+            status_code=400, detail="Account and category belong to different users")
+    db_rule = RecurringRule(
+        account_id=rule.account_id,
+        category_id=rule.category_id,
+        amount=rule.amount,
+        description=rule.description,
+        frequency=rule.frequency,
+        start_date=rule.start_date,
+        end_date=rule.end_date,
+        next_run_date=rule.start_date,
+        active=True
+    )
+    db.add(db_rule)
+    db.commit()
+    db.refresh(db_rule)
+    return db_rule
+
+
+@router.put("/{rule_id}", response_model=RecurringRuleResponse)
+async def update_recurring_rule(rule_id: int, payload: RecurringRuleUpdate, request: Request, db: Session = Depends(get_db)):
+    require_permission(db, request, "recurring_rules", "update")
+    rule = db.query(RecurringRule).filter(RecurringRule.id == rule_id).first()
+    if not rule:
+        raise HTTPException(status_code=404, detail="Recurring rule not found")
+    if payload.amount is not None:
+        if payload.amount <= 0:
+            raise HTTPException(
+                status_code=400, detail="Recurring amount must be greater than zero")
+        rule.amount = payload.amount
+    if payload.description is not None:
+        rule.description = payload.description
+    if payload.end_date is not None:
+        if payload.end_date < rule.start_date:
+            raise HTTPException(
+                status_code=400, detail="end_date must not be before start_date")
+        rule.end_date = payload.end_date
+    if payload.active is not None:
+        rule.active = payload.active
+    db.commit()
+    db.refresh(rule)
+    return rule
+
+
+@router.delete("/{rule_id}")
+async def delete_recurring_rule(rule_id: int, request: Request, db: Session = Depends(get_db)):
+    require_permission(db, request, "recurring_rules", "delete")
+    rule = db.query(RecurringRule).filter(RecurringRule.id == rule_id).first()
+    if not rule:
+        raise HTTPException(status_code=404, detail="Recurring rule not found")
+    db.delete(rule)
+    db.commit()
+    return {"message": "Recurring rule deleted successfully"}
+
+
+@router.post("/run")
+async def run_recurring(request: Request, on_date: Optional[date] = None, db: Session = Depends(get_db)):
+    """
+    Провести наступившие платежи сейчас, не дожидаясь планировщика.
+    on_date - провести по эту дату (не позже сегодняшней).
+    """
+    require_permission(db, request, "transactions", "create")
+    if on_date and on_date > date.today():
+        # будущие платежи списали бы деньги раньше срока
+        raise HTTPException(status_code=400, detail="on_date must not be in the future")
+    created = await run_in_threadpool(materialize_due, on_date)
+    return {"created": created}
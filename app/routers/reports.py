@@ -1,18 +1,24 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import Optional
+from sqlalchemy import case, func, null
+from typing import List, Optional
 from datetime import date
-from app.database import get_db
-from app.models import Transaction, Category, Account
-from app.auth import require_permission
+from itertools import islice
+from app.database import get_db, get_read_db, merge_shards, scatter_gather, shard_for_id
+from app.models import Transaction, Category, Account, Log, ClosedPeriod, PeriodCategoryTotal
+from app.schemas import TransactionResponse, CategoryReportResponse, ReportJobCreate, ReportJobResponse, AnalyticsResponse
+from app.auth import require_permission, get_current_db_role
+from app.jobs import job_runner
+from app.fx import fx_rates, FxRateMissing
+from app.periods import closed_through, open_entries
+from app.analytics import analytics_cache
+from config import settings
 
 router = APIRouter(prefix="/reports", tags=["reports"])
 
 
-@router.get("/transactions")
-async def get_transaction_report(request: Request, start_date: Optional[date] = None, end_date: Optional[date] = None, user_id: Optional[int] = None, db: Session = Depends(get_db)):
-    require_permission(db, request, "reports", "view")
+def _transaction_report_query(db: Session, start_date: Optional[date], end_date: Optional[date], user_id: Optional[int]):
     query = db.query(Transaction)
     if user_id:
         query = query.join(Account).filter(Account.user_id == user_id)
@@ -20,22 +26,199 @@ async def get_transaction_report(request: Request, start_date: Optional[date] =
         query = query.filter(Transaction.transaction_date >= start_date)
     if end_date:
         query = query.filter(Transaction.transaction_date <= end_date)
-
-    transactions = query.all()
-    return transactions
+    return query
 
 
-@router.get("/categories")
-async def get_category_report(request: Request, user_id: Optional[int] = None, db: Session = Depends(get_db)):
-    require_permission(db, request, "reports", "view")
+def _category_rows(db: Session, user_id: Optional[int], currency: str) -> list:
+    """
+    Суммы по категориям шарда db, упорядоченные по id категории. Суммы в
+    валюте currency группируются только по категории, остальные - еще и по
+    валюте и дате (для курса). Закрытые периоды берутся из итогов закрытия
+    (курс - на конец периода), а транзакции читаются только после
+    последнего закрытого периода.
+    """
+    cutoff = closed_through(db)
+    # для сумм в целевой валюте дата не нужна - одна группа на категорию
+    group_date = case((Transaction.currency == currency, null()),
+                      else_=Transaction.transaction_date)
     query = db.query(
+        Category.id,
         Category.name,
         Category.type,
+        Transaction.currency,
+        group_date.label('rate_date'),
         func.sum(Transaction.amount).label('total_amount'),
         func.count(Transaction.id).label('transaction_count')
-    ).join(Transaction)
+    ).join(Transaction).filter(open_entries(Transaction.transaction_date, cutoff))
     if user_id:
         query = query.filter(Category.user_id == user_id)
-    result = query.group_by(Category.id, Category.name, Category.type).all()
+    rows = query.group_by(Category.id, Category.name, Category.type,
+                          Transaction.currency, group_date).all()
+
+    if cutoff:
+        closed_date = case((PeriodCategoryTotal.currency == currency, null()),
+                           else_=ClosedPeriod.period_end)
+        closed = db.query(
+            Category.id,
+            Category.name,
+            Category.type,
+            PeriodCategoryTotal.currency,
+            closed_date.label('rate_date'),
+            func.sum(PeriodCategoryTotal.total_amount).label('total_amount'),
+            func.sum(PeriodCategoryTotal.transaction_count).label('transaction_count')
+        ).join(PeriodCategoryTotal, PeriodCategoryTotal.category_id == Category.id
+               ).join(ClosedPeriod, ClosedPeriod.id == PeriodCategoryTotal.period_id)
+        if user_id:
+            closed = closed.filter(Category.user_id == user_id)
+        rows += closed.group_by(Category.id, Category.name, Category.type,
+                                PeriodCategoryTotal.currency, closed_date).all()
+    rows.sort(key=lambda r: r.id)
+    return rows
+
+
+def _category_report(db: Session, user_id: Optional[int], currency: str) -> List[dict]:
+    """
+    Суммы по категориям в валюте currency: строки шарда пользователя или,
+    без user_id, всех шардов переводятся по курсу на дату одним проходом
+    по столбцу.
+    """
+    if user_id:
+        rows = _category_rows(db, user_id, currency)
+    else:
+        rows = scatter_gather(lambda s, n: _category_rows(s, None, currency), key=lambda r: r.id)
+
+    try:
+        converted = fx_rates.convert_column(
+            [r.total_amount for r in rows], [r.currency for r in rows],
+            [r.rate_date for r in rows], currency)
+    except FxRateMissing as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    report = {}
+    for r, amount in zip(rows, converted):
+        item = report.setdefault(r.id, {"category": r.name, "type": r.type, "total_amount": 0,
+                                        "currency": currency, "count": 0})
+        item["total_amount"] += amount
+        item["count"] += r.transaction_count
+    return list(report.values())
+
+
+@router.get("/transactions", response_model=List[TransactionResponse])
+async def get_transaction_report(request: Request, start_date: Optional[date] = None, end_date: Optional[date] = None, user_id: Optional[int] = None, db: Session = Depends(get_read_db)):
+    require_permission(db, request, "reports", "view")
+    if user_id:
+        return _transaction_report_query(db, start_date, end_date, user_id).all()
+    # без пользователя - операции всех шардов по id
+    return scatter_gather(lambda s, n: _transaction_report_query(
+        s, start_date, end_date, None).order_by(Transaction.id).limit(n).all(), key=lambda t: t.id)
+
+
+@router.get("/categories", response_model=List[CategoryReportResponse])
+async def get_category_report(request: Request, user_id: Optional[int] = None, currency: Optional[str] = None, db: Session = Depends(get_read_db)):
+    require_permission(db, request, "reports", "view")
+    return _category_report(db, user_id, (currency or settings.BASE_CURRENCY).upper())
+
+
+ANALYTICS_MAX_MONTHS = 120
+
+
+@router.get("/analytics", response_model=AnalyticsResponse)
+async def get_spending_analytics(
+    request: Request,
+    user_id: List[int] = Query(...),
+    months: int = 12,
+    currency: Optional[str] = None,
+    outlier_z: float = 3.0,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Аналитика расходов пользователя (или группы: user_id можно повторить)
+    за последние months месяцев: помесячная динамика, доли категорий и
+    необычно крупные расходы (больше среднего по категории на outlier_z
+    стандартных отклонений). Результат кэшируется до следующей записи
+    операций этих пользователей.
+    """
+    require_permission(db, request, "reports", "view")
+    if not 1 <= months <= ANALYTICS_MAX_MONTHS:
+        raise HTTPException(
+            status_code=400, detail=f"months must be between 1 and {ANALYTICS_MAX_MONTHS}")
+    if outlier_z <= 0:
+        raise HTTPException(
+            status_code=400, detail="outlier_z must be greater than zero")
+    return analytics_cache.get_or_compute(
+        db, user_id, months, (currency or settings.BASE_CURRENCY).upper(), outlier_z)
+
+
+def _columns(obj) -> dict:
+    return {c.name: getattr(obj, c.name) for c in obj.__table__.columns}
+
+
+def _report_job(params: ReportJobCreate):
+    """Функция задачи: по сессии БД выдает строки отчета порциями."""
+    if params.kind == "transactions":
+        def run(db: Session):
+            if params.user_id:
+                rows = _transaction_report_query(
+                    db, params.start_date, params.end_date, params.user_id).yield_per(1000)
+            else:
+                rows = merge_shards(lambda s: _transaction_report_query(
+                    s, params.start_date, params.end_date, None).order_by(Transaction.id).yield_per(1000),
+                    key=lambda t: t.id)
+            for t in rows:
+                yield _columns(t)
+    elif params.kind == "categories":
+        def run(db: Session):
+            return _category_report(db, params.user_id, (params.currency or settings.BASE_CURRENCY).upper())
+    else:
+        def fetch(db: Session):
+            query = db.query(Log)
+            if params.table_name:
+                query = query.filter(Log.table_name == params.table_name)
+            query = query.order_by(Log.action_date.desc())
+            if params.limit:
+                query = query.limit(params.limit)
+            return query.yield_per(1000)
+
+        def run(db: Session):
+            # логи всех шардов, самые новые первыми
+            logs = merge_shards(fetch, key=lambda log: log.action_date, reverse=True)
+            for log in islice(logs, params.limit or None):
+                yield _columns(log)
+    return run
+
+
+@router.post("/jobs", response_model=ReportJobResponse)
+async def create_report_job(params: ReportJobCreate, request: Request, db: Session = Depends(get_db)):
+    """Запустить тяжелый отчет или выгрузку логов в фоне. Возвращает id задачи."""
+    if params.kind not in ("transactions", "categories", "logs"):
+        raise HTTPException(
+            status_code=400, detail="Report kind must be 'transactions', 'categories' or 'logs'")
+    require_permission(db, request, "logs" if params.kind ==
+                       "logs" else "reports", "view")
+    role = get_current_db_role(db) or "unknown"
+    shard = shard_for_id(params.user_id) if params.user_id else 0
+    return job_runner.submit(params.kind, role, _report_job(params), shard)
+
+
+def _get_job(job_id: str, db: Session):
+    job = job_runner.get(job_id)
+    # задачи других ролей не видны
+    if not job or job.role != (get_current_db_role(db) or "unknown"):
+        raise HTTPException(status_code=404, detail="Report job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}", response_model=ReportJobResponse)
+async def get_report_job(job_id: str, db: Session = Depends(get_db)):
+    return _get_job(job_id, db)
+
 
-    return [{"category": r.name, "type": r.type, "total_amount": float(r.total_amount), "count": r.transaction_count} for r in result]
+@router.get("/jobs/{job_id}/result")
+async def get_report_job_result(job_id: str, db: Session = Depends(get_db)):
+    job = _get_job(job_id, db)
+    if job.status == "failed":
+        raise HTTPException(
+            status_code=409, detail=f"Report job failed: {job.error}")
+    if job.status != "done":
+        raise HTTPException(
+            status_code=409, detail="Report job is not finished yet")
+    return FileResponse(job.result_path, media_type="application/json", filename=f"report_{job.kind}_{job.id}.json")
@@ -0,0 +1,103 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.orm import Session
+from sqlalchemy import select
+from typing import List, Optional
+from datetime import date
+from starlette.concurrency import run_in_threadpool
+from app.database import get_db, get_read_db, scatter_gather
+from app.models import user_accounts_summary, category_transactions_report
+from app.schemas import UserAccountsSummaryResponse, CategoryTransactionsReportResponse
+from app.auth import require_permission
+from app.fx import fx_rates, FxRateMissing
+from app.matviews import matview_refresher
+
+router = APIRouter(prefix="/summaries", tags=["summaries"])
+
+SUMMARY_MAX_LIMIT = 1000
+
+
+def _nulls_last(value) -> tuple:
+    """Ключ сортировки как у ORDER BY ... ASC в PostgreSQL: NULL после значений."""
+    return (value is None, value or "")
+
+
+def _page(db: Session, query, user_id: Optional[int], offset: int, limit: int, key) -> list:
+    """
+    Страница представления: у пользователя - с его шарда (db), без
+    пользователя - со всех шардов, слитая по key (порядку query).
+    """
+    limit = min(limit, SUMMARY_MAX_LIMIT)
+    if user_id:
+        return db.execute(query.offset(offset).limit(limit)).mappings().all()
+    return scatter_gather(lambda s, n: s.execute(query.limit(n)).mappings().all(),
+                          key=key, offset=offset, limit=limit)
+
+
+@router.get("/accounts", response_model=List[UserAccountsSummaryResponse])
+async def get_user_accounts_summary(
+    request: Request,
+    user_id: Optional[int] = None,
+    currency: Optional[str] = None,
+    convert_to: Optional[str] = None,
+    offset: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Сводка по счетам пользователей (материализованное представление
+    user_accounts_summary): строка на пользователя и валюту.
+    С convert_to баланс дополнительно переводится по сегодняшнему курсу.
+    """
+    require_permission(db, request, "user_accounts_summary", "view")
+    v = user_accounts_summary.c
+    query = select(user_accounts_summary)
+    if user_id:
+        query = query.where(v.user_id == user_id)
+    if currency:
+        query = query.where(v.currency == currency.upper())
+    query = query.order_by(v.user_id, v.currency)
+    rows = [dict(r) for r in _page(db, query, user_id, offset, limit,
+                                   key=lambda r: (r["user_id"], *_nulls_last(r["currency"])))]
+
+    if convert_to:
+        target = convert_to.upper()
+        # у пользователей без счетов валюты нет, баланс 0
+        currencies = [r["currency"] or target for r in rows]
+        try:
+            converted = fx_rates.convert_column(
+                [r["total_balance"] for r in rows], currencies, [date.today()] * len(rows), target)
+        except FxRateMissing as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        for r, amount in zip(rows, converted):
+            r["converted_balance"] = amount
+    return rows
+
+
+@router.get("/categories", response_model=List[CategoryTransactionsReportResponse])
+async def get_category_transactions_report(
+    request: Request,
+    user_id: Optional[int] = None,
+    category_type: Optional[str] = None,
+    offset: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_read_db)
+):
+    """Отчет по категориям (материализованное представление category_transactions_report)."""
+    require_permission(db, request, "category_transactions_report", "view")
+    v = category_transactions_report.c
+    query = select(category_transactions_report)
+    if user_id:
+        query = query.where(v.user_id == user_id)
+    if category_type:
+        query = query.where(v.category_type == category_type)
+    query = query.order_by(v.category_id, v.currency)
+    return _page(db, query, user_id, offset, limit,
+                 key=lambda r: (r["category_id"], *_nulls_last(r["currency"])))
+
+
+@router.post("/refresh")
+async def refresh_summaries(request: Request, db: Session = Depends(get_db)):
+    """Обновить представления сейчас, не дожидаясь планировщика."""
+    require_permission(db, request, "user_accounts_summary", "update")
+    refreshed = await run_in_threadpool(matview_refresher.refresh)
+    return {"refreshed": refreshed}
@@ -2,40 +2,151 @@ from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import date
-from app.database import get_db
-from sqlalchemy import func
-from app.models import Transaction, TransactionBA, Account, Category, Budget
-from app.auth import require_permission
 from decimal import Decimal
-from app.schemas import TransactionCreate, TransactionResponse, TransactionBACreate, TransactionBAResponse
+import base64
+import json
+from app.database import get_db, get_read_db, scatter_gather
+from sqlalchemy import REAL, cast, func, literal, tuple_
+from app.models import Transaction, TransactionBA, Account, Budget
+from app.auth import require_permission
+from app.schemas import TransactionCreate, TransactionResponse, TransactionBACreate, TransactionBAResponse, TransactionSearchResponse
+from app.idempotency import IdempotentRoute
+from app.write_batcher import lock_account_with_categories, transaction_batcher
+from app.analytics import analytics_cache
+from app.periods import ensure_open
+from app.budget_limits import BudgetLimits
+from app.fields import parse_fields, render_fields, select_fields
 
-router = APIRouter(prefix="/transactions", tags=["transactions"])
+router = APIRouter(prefix="/transactions", tags=["transactions"], route_class=IdempotentRoute)
 
 
 @router.get("/", response_model=List[TransactionResponse])
-async def get_transactions(request: Request, user_id: Optional[int] = None, db: Session = Depends(get_db)):
+async def get_transactions(request: Request, user_id: Optional[int] = None, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
+    """fields=id,amount,... - only these columns are selected and returned."""
+    require_permission(db, request, "transactions", "view")
+    names = parse_fields(fields, TransactionResponse)
+    entities = select_fields(Transaction, names, "id")
+    if user_id:
+        rows = db.query(*entities).join(Account, Account.id == Transaction.account_id).filter(
+            Account.user_id == user_id).all()
+        return render_fields(TransactionResponse, names, rows)
+    # without a user: gather from every shard
+    rows = scatter_gather(lambda s, n: s.query(*entities).order_by(Transaction.id).limit(n).all(),
+                          key=lambda t: t.id)
+    return render_fields(TransactionResponse, names, rows)
+
+
+# must match the expression of idx_transactions_description_fts in bd.sql
+description_tsvector = func.to_tsvector(
+    'russian', func.coalesce(Transaction.description, ''))
+
+SEARCH_MAX_LIMIT = 500
+
+
+def _encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _decode_cursor(cursor: str, ranked: bool):
+    """Returns (sort key, id) of the last row of the previous page."""
+    try:
+        last_key, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not ranked:
+            last_key = date.fromisoformat(last_key)
+        return last_key, int(last_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/search", response_model=TransactionSearchResponse)
+async def search_transactions(
+    request: Request,
+    q: Optional[str] = None,
+    user_id: Optional[int] = None,
+    account_id: Optional[int] = None,
+    category_id: Optional[int] = None,
+    min_amount: Optional[Decimal] = None,
+    max_amount: Optional[Decimal] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Search transactions with combinable filters. With q, results are ranked
+    by full-text relevance of the description; otherwise newest first.
+    Pass next_cursor from the response to get the following page.
+    """
     require_permission(db, request, "transactions", "view")
-    query = db.query(Transaction)
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    if q:
+        ts_query = func.websearch_to_tsquery('russian', q)
+        sort_key = func.ts_rank(description_tsvector, ts_query)
+    else:
+        sort_key = Transaction.transaction_date
+    last = _decode_cursor(cursor, ranked=bool(q)) if cursor else None
+    if last and q:
+        # ts_rank is REAL but the cursor carries a double: compare at REAL
+        # precision, or the last row of the page never equals its own bound
+        last = (cast(literal(last[0]), REAL), last[1])
+
+    def fetch(s: Session, n: int):
+        query = s.query(Transaction)
+        if user_id:
+            query = query.join(Account).filter(Account.user_id == user_id)
+        if account_id:
+            query = query.filter(Transaction.account_id == account_id)
+        if category_id:
+            query = query.filter(Transaction.category_id == category_id)
+        if min_amount is not None:
+            query = query.filter(Transaction.amount >= min_amount)
+        if max_amount is not None:
+            query = query.filter(Transaction.amount <= max_amount)
+        if start_date:
+            query = query.filter(Transaction.transaction_date >= start_date)
+        if end_date:
+            query = query.filter(Transaction.transaction_date <= end_date)
+        if q:
+            query = query.filter(description_tsvector.op('@@')(ts_query))
+        if last:
+            query = query.filter(tuple_(sort_key, Transaction.id) < tuple_(*last))
+        return query.add_columns(sort_key).order_by(
+            sort_key.desc(), Transaction.id.desc()).limit(n).all()
+
     if user_id:
-        query = query.join(Account).filter(Account.user_id == user_id)
-    transactions = query.all()
-    return transactions
+        rows = fetch(db, limit + 1)
+    else:
+        # without a user: merge the best matches of every shard
+        rows = scatter_gather(fetch, key=lambda row: (row[1], row[0].id),
+                              limit=limit + 1, reverse=True)
+    items = [row[0] for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last_transaction, last_key = rows[limit - 1]
+        next_cursor = _encode_cursor(
+            [last_key if q else last_key.isoformat(), last_transaction.id])
+    return {"items": items, "next_cursor": next_cursor}
 
 
 @router.get("/ba", response_model=List[TransactionBAResponse])
-async def get_transfers(request: Request, user_id: Optional[int] = None, db: Session = Depends(get_db)):
+async def get_transfers(request: Request, user_id: Optional[int] = None, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
+    """fields=id,amount,... - only these columns are selected and returned."""
     require_permission(db, request, "transactions", "view")
-    query = db.query(TransactionBA)
+    names = parse_fields(fields, TransactionBAResponse)
+    entities = select_fields(TransactionBA, names, "id")
     if user_id:
         account_ids = [row.id for row in db.query(
             Account.id).filter(Account.user_id == user_id).all()]
-        if account_ids:
-            query = query.filter((TransactionBA.account_id_from.in_(account_ids)) | (
-                TransactionBA.account_id_to.in_(account_ids)))
-        else:
+        if not account_ids:
             return []
-    transfers = query.all()
-    return transfers
+        transfers = db.query(*entities).filter((TransactionBA.account_id_from.in_(account_ids)) | (
+            TransactionBA.account_id_to.in_(account_ids))).all()
+        return render_fields(TransactionBAResponse, names, transfers)
+    # without a user: gather from every shard
+    transfers = scatter_gather(lambda s, n: s.query(*entities).order_by(TransactionBA.id).limit(n).all(),
+                               key=lambda t: t.id)
+    return render_fields(TransactionBAResponse, names, transfers)
 
 
 @router.get("/ba/{transfer_id}", response_model=TransactionBAResponse)
@@ -57,6 +168,7 @@ async def create_transfer(transfer: TransactionBACreate, request: Request, db: S
     if transfer.amount <= 0:
         raise HTTPException(
             status_code=400, detail="Transfer amount must be greater than zero")
+    ensure_open(db, transfer.transaction_date or date.today())
 
     # Ensure accounts exist
     a_from = db.query(Account).filter(
@@ -68,6 +180,9 @@ async def create_transfer(transfer: TransactionBACreate, request: Request, db: S
     if a_from.user_id != a_to.user_id:
         raise HTTPException(
             status_code=400, detail="Accounts belong to different users")
+    if a_from.currency != a_to.currency:
+        raise HTTPException(
+            status_code=400, detail="Accounts have different currencies")
     db_transfer = TransactionBA(
         account_id_from=transfer.account_id_from,
         account_id_to=transfer.account_id_to,
@@ -76,14 +191,13 @@ async def create_transfer(transfer: TransactionBACreate, request: Request, db: S
         transaction_date=transfer.transaction_date or date.today()
     )
     # apply balance change
-    # convert to Decimal for safety
-    delta = Decimal(str(transfer.amount))
+    delta = transfer.amount
     # optional: prevent overdraft
-    if Decimal(a_from.balance) - delta < 0:
+    if a_from.balance - delta < 0:
         raise HTTPException(
             status_code=400, detail="Insufficient funds in source account")
-    a_from.balance = Decimal(a_from.balance) - delta
-    a_to.balance = Decimal(a_to.balance) + delta
+    a_from.balance = a_from.balance - delta
+    a_to.balance = a_to.balance + delta
     db.add(db_transfer)
     db.commit()
     db.refresh(db_transfer)
@@ -103,6 +217,8 @@ async def update_transfer(transfer_id: int, transfer: TransactionBACreate, reque
     if transfer.amount <= 0:
         raise HTTPException(
             status_code=400, detail="Transfer amount must be greater than zero")
+    ensure_open(db, db_transfer.transaction_date,
+                transfer.transaction_date or date.today())
 
     # lock accounts
     a_old_from = db.query(Account).filter(
@@ -120,16 +236,19 @@ async def update_transfer(transfer_id: int, transfer: TransactionBACreate, reque
     if a_new_from.user_id != a_new_to.user_id:
         raise HTTPException(
             status_code=400, detail="Accounts belong to different users")
+    if a_new_from.currency != a_new_to.currency:
+        raise HTTPException(
+            status_code=400, detail="Accounts have different currencies")
 
-    old_amount = Decimal(str(db_transfer.amount))
-    new_amount = Decimal(str(transfer.amount))
+    old_amount = db_transfer.amount
+    new_amount = transfer.amount
 
     # compute hypothetical final balances to ensure no overdrafts
     # start from current balances
-    b_old_from = Decimal(a_old_from.balance)
-    b_old_to = Decimal(a_old_to.balance)
-    b_new_from = Decimal(a_new_from.balance)
-    b_new_to = Decimal(a_new_to.balance)
+    b_old_from = a_old_from.balance
+    b_old_to = a_old_to.balance
+    b_new_from = a_new_from.balance
+    b_new_to = a_new_to.balance
 
     # compute final balances after reversal and new apply
     # reverse old
@@ -153,8 +272,8 @@ async def update_transfer(transfer_id: int, transfer: TransactionBACreate, reque
     # apply reversal and new amounts to actual account objects
     a_old_from.balance = b_old_from_after
     a_old_to.balance = b_old_to_after
-    a_new_from.balance = Decimal(a_new_from.balance) - new_amount
-    a_new_to.balance = Decimal(a_new_to.balance) + new_amount
+    a_new_from.balance = a_new_from.balance - new_amount
+    a_new_to.balance = a_new_to.balance + new_amount
 
     db_transfer.account_id_from = transfer.account_id_from
     db_transfer.account_id_to = transfer.account_id_to
@@ -174,18 +293,19 @@ async def delete_transfer(transfer_id: int, request: Request, db: Session = Depe
         TransactionBA.id == transfer_id).first()
     if not db_transfer:
         raise HTTPException(status_code=404, detail="Transfer not found")
+    ensure_open(db, db_transfer.transaction_date)
     # reverse balances
     a_from = db.query(Account).filter(
         Account.id == db_transfer.account_id_from).with_for_update().first()
     a_to = db.query(Account).filter(
         Account.id == db_transfer.account_id_to).with_for_update().first()
     if a_from and a_to:
-        amt = Decimal(str(db_transfer.amount))
-        if Decimal(a_to.balance) - amt < 0:
+        amt = db_transfer.amount
+        if a_to.balance - amt < 0:
             raise HTTPException(
                 status_code=400, detail="Cannot delete transfer: would cause negative balance on destination account")
-        a_from.balance = Decimal(a_from.balance) + amt
-        a_to.balance = Decimal(a_to.balance) - amt
+        a_from.balance = a_from.balance + amt
+        a_to.balance = a_to.balance - amt
 
     db.delete(db_transfer)
     db.commit()
@@ -204,15 +324,19 @@ async def get_transaction(transaction_id: int, db: Session = Depends(get_db)):
 @router.post("/", response_model=TransactionResponse)
 async def create_transaction(transaction: TransactionCreate, request: Request, db: Session = Depends(get_db)):
     require_permission(db, request, "transactions", "create")
+    if transaction_batcher.enabled:
+        # hot accounts: coalesce concurrent creates into one DB transaction.
+        # The batch runs in its own session, so give the request connection
+        # back to the pool instead of holding it for the whole batch wait.
+        db.close()
+        return await transaction_batcher.submit(transaction)
     # validation
     if transaction.amount <= 0:
         raise HTTPException(
             status_code=400, detail="Transaction amount must be greater than zero")
-    # fetch account and category, lock account for update
-    acc = db.query(Account).filter(
-        Account.id == transaction.account_id).with_for_update().first()
-    cat = db.query(Category).filter(
-        Category.id == transaction.category_id).first()
+    # lock the account and read the category in one statement
+    acc, categories = lock_account_with_categories(db, transaction.account_id, [transaction.category_id])
+    cat = categories.get(transaction.category_id)
     if not acc:
         raise HTTPException(status_code=404, detail="Account not found")
     if not cat:
@@ -220,44 +344,38 @@ async def create_transaction(transaction: TransactionCreate, request: Request, d
     if acc.user_id != cat.user_id:
         raise HTTPException(
             status_code=400, detail="Account and category belong to different users")
+    if transaction.currency and transaction.currency.upper() != acc.currency:
+        raise HTTPException(
+            status_code=400, detail="Transaction currency must match account currency")
 
     # compute delta
-    amt = Decimal(str(transaction.amount))
+    amt = transaction.amount
     trans_date = transaction.transaction_date or date.today()
+    ensure_open(db, trans_date)
     # Budget checks: if this is an expense category, ensure budget limits are not exceeded
     if cat.type == 'expense':
-        budgets = db.query(Budget).filter(
-            Budget.category_id == transaction.category_id,
-            Budget.period_start <= trans_date,
-            Budget.period_end >= trans_date,
-        ).all()
-        for b in budgets:
-            # sum existing spending in this budget period for the category
-            spent = db.query(func.coalesce(func.sum(Transaction.amount), 0)).filter(
-                Transaction.category_id == transaction.category_id,
-                Transaction.transaction_date >= b.period_start,
-                Transaction.transaction_date <= b.period_end,
-            ).scalar() or 0
-            new_spent = Decimal(str(spent)) + amt
-            if new_spent > Decimal(str(b.amount_limit)):
-                raise HTTPException(
-                    status_code=400, detail=f"Budget exceeded for category during period {b.period_start} - {b.period_end}")
+        b = BudgetLimits(db, [cat.id]).exceeded(cat.id, trans_date, amt)
+        if b is not None:
+            raise HTTPException(
+                status_code=400, detail=f"Budget exceeded for category during period {b.period_start} - {b.period_end}")
     delta = amt if cat.type == 'income' else -amt
     # optional check: ensure expense doesn't create negative balance
-    if cat.type == 'expense' and Decimal(acc.balance) + delta < 0:
+    if cat.type == 'expense' and acc.balance + delta < 0:
         raise HTTPException(status_code=400, detail="Insufficient funds")
     # apply balance change
-    acc.balance = Decimal(acc.balance) + delta
+    acc.balance = acc.balance + delta
 
     db_transaction = Transaction(
         account_id=transaction.account_id,
         category_id=transaction.category_id,
         amount=transaction.amount,
+        currency=acc.currency,
         description=transaction.description,
         transaction_date=trans_date
     )
     db.add(db_transaction)
     db.commit()
+    analytics_cache.invalidate_user(acc.user_id)
     db.refresh(db_transaction)
     return db_transaction
 
@@ -269,25 +387,27 @@ async def update_transaction(transaction_id: int, transaction: TransactionCreate
         Transaction.id == transaction_id).first()
     if not db_transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
+    ensure_open(db, db_transaction.transaction_date,
+                transaction.transaction_date or date.today())
 
     # fetch involved accounts and categories with locks
-    old_acc = db.query(Account).filter(
-        Account.id == db_transaction.account_id).with_for_update().first()
-    old_cat = db.query(Category).filter(
-        Category.id == db_transaction.category_id).first()
-    new_acc = db.query(Account).filter(
-        Account.id == transaction.account_id).with_for_update().first()
-    new_cat = db.query(Category).filter(
-        Category.id == transaction.category_id).first()
+    old_acc, categories = lock_account_with_categories(
+        db, db_transaction.account_id, [db_transaction.category_id])
+    old_cat = categories.get(db_transaction.category_id)
+    new_acc, categories = lock_account_with_categories(db, transaction.account_id, [transaction.category_id])
+    new_cat = categories.get(transaction.category_id)
     if not new_acc or not new_cat:
         raise HTTPException(
             status_code=404, detail="Account or category not found")
     if new_acc.user_id != new_cat.user_id:
         raise HTTPException(
             status_code=400, detail="Account and category belong to different users")
+    if transaction.currency and transaction.currency.upper() != new_acc.currency:
+        raise HTTPException(
+            status_code=400, detail="Transaction currency must match account currency")
 
-    old_amt = Decimal(str(db_transaction.amount))
-    new_amt = Decimal(str(transaction.amount))
+    old_amt = db_transaction.amount
+    new_amt = transaction.amount
     old_delta = old_amt if old_cat.type == 'income' else -old_amt
     new_delta = new_amt if new_cat.type == 'income' else -new_amt
 
@@ -307,36 +427,38 @@ async def update_transaction(transaction_id: int, transaction: TransactionCreate
                 Transaction.transaction_date <= b.period_end,
                 Transaction.id != db_transaction.id,
             ).scalar() or 0
-            new_spent = Decimal(str(spent)) + new_amt
-            if new_spent > Decimal(str(b.amount_limit)):
+            new_spent = spent + new_amt
+            if new_spent > b.amount_limit:
                 raise HTTPException(
                     status_code=400, detail=f"Budget exceeded for category during period {b.period_start} - {b.period_end}")
 
     # reverse old effect
     # compute hypothetical new balances for safety checks
     if old_acc.id == new_acc.id:
-        hypothetical = Decimal(old_acc.balance) - old_delta + new_delta
+        hypothetical = old_acc.balance - old_delta + new_delta
         if hypothetical < 0:
             raise HTTPException(status_code=400, detail="Insufficient funds")
     else:
-        if Decimal(old_acc.balance) - old_delta < 0:
+        if old_acc.balance - old_delta < 0:
             raise HTTPException(
                 status_code=400, detail="Insufficient funds on old account for reversal")
-        if Decimal(new_acc.balance) + new_delta < 0:
+        if new_acc.balance + new_delta < 0:
             raise HTTPException(
                 status_code=400, detail="Insufficient funds on new account")
 
-    old_acc.balance = Decimal(old_acc.balance) - old_delta
+    old_acc.balance = old_acc.balance - old_delta
     # apply new effect
-    new_acc.balance = Decimal(new_acc.balance) + new_delta
+    new_acc.balance = new_acc.balance + new_delta
 
     db_transaction.account_id = transaction.account_id
     db_transaction.category_id = transaction.category_id
     db_transaction.amount = transaction.amount
+    db_transaction.currency = new_acc.currency
     db_transaction.description = transaction.description
     db_transaction.transaction_date = new_trans_date
 
     db.commit()
+    analytics_cache.invalidate_user(old_cat.user_id, new_cat.user_id)
     db.refresh(db_transaction)
     return db_transaction
 
@@ -348,21 +470,23 @@ async def delete_transaction(transaction_id: int, request: Request, db: Session
         Transaction.id == transaction_id).first()
     if not db_transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
+    ensure_open(db, db_transaction.transaction_date)
 
     # reverse the transaction's effect on the account
-    acc = db.query(Account).filter(
-        Account.id == db_transaction.account_id).with_for_update().first()
-    cat = db.query(Category).filter(
-        Category.id == db_transaction.category_id).first()
+    acc, categories = lock_account_with_categories(
+        db, db_transaction.account_id, [db_transaction.category_id])
+    cat = categories.get(db_transaction.category_id)
     if acc and cat:
-        amt = Decimal(str(db_transaction.amount))
+        amt = db_transaction.amount
         delta = amt if cat.type == 'income' else -amt
         # ensure deletion won't make balance negative
-        if Decimal(acc.balance) - delta < 0:
+        if acc.balance - delta < 0:
             raise HTTPException(
                 status_code=400, detail="Cannot delete transaction: would cause negative balance on account")
         # reverse effect -> subtract delta
-        acc.balance = Decimal(acc.balance) - delta
+        acc.balance = acc.balance - delta
     db.delete(db_transaction)
     db.commit()
+    if cat:
+        analytics_cache.invalidate_user(cat.user_id)
     return {"message": "Transaction deleted successfully"}
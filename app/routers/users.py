@@ -1,18 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-from app.database import get_db
+from typing import List, Optional
+from starlette.concurrency import run_in_threadpool
+from app.database import SessionLocal, get_db, request_shard, scatter_gather, shard_count, shard_for_id, shard_for_new_user
 from app.models import User, Account, Transaction, TransactionBA, Category, Budget
-from decimal import Decimal
-from app.schemas import UserCreate, UserResponse, UserUpdate
+from app.schemas import UserCreate, UserImportResult, UserLogin, UserResponse, UserUpdate
+from app.auth import require_permission
+from app.idempotency import IdempotentRoute
+from app.passwords import hash_password, verify_password
+from app.periods import closed_through, ensure_no_closed_entries, open_entries
+from app.refcache import reference_cache
+from app.analytics import analytics_cache
+from app.user_archive import ARCHIVE_FORMATS, export_archive, import_archive
 
-router = APIRouter(prefix="/users", tags=["users"])
+router = APIRouter(prefix="/users", tags=["users"], route_class=IdempotentRoute)
+
+
+def _email_taken(db: Session, email: str, exclude_user_id: Optional[int] = None) -> bool:
+    """
+    Email может быть на любом шарде, поэтому проверяется на всех (имя
+    пользователя проверять так не нужно - его шард определяется по имени).
+    """
+    def fetch(session, n):
+        query = session.query(User.id).filter(User.email == email)
+        if exclude_user_id is not None:
+            query = query.filter(User.id != exclude_user_id)
+        return query.limit(n).all()
+    if shard_count() == 1:
+        return bool(fetch(db, 1))
+    return bool(scatter_gather(fetch, key=lambda r: r.id, limit=1, primary=True))
 
 
 @router.get("/", response_model=List[UserResponse])
-async def get_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
-    return users
+async def get_users(offset: int = 0, limit: Optional[int] = None):
+    # пользователи всех шардов по id
+    return scatter_gather(lambda db, n: db.query(User).order_by(User.id).limit(n).all(),
+                          key=lambda u: u.id, offset=offset, limit=limit)
 
 
 @router.post("/", response_model=UserResponse)
@@ -21,16 +45,15 @@ async def create_user(user: UserCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Username is required")
     if not user.email:
         raise HTTPException(status_code=400, detail="Email is required")
-    # check uniqueness
-    existing = db.query(User).filter(
-        (User.username == user.username) | (User.email == user.email)).first()
-    if existing:
+    # check uniqueness: username - на шарде запроса, куда попадет и новый пользователь
+    existing = db.query(User.id).filter(User.username == user.username).first()
+    if existing or _email_taken(db, user.email):
         raise HTTPException(
             status_code=400, detail="User with same username or email already exists")
     db_user = User(
         username=user.username,
         email=user.email,
-        password_hash=user.password
+        password_hash=await hash_password(user.password)
     )
     db.add(db_user)
     db.commit()
@@ -38,12 +61,32 @@ async def create_user(user: UserCreate, db: Session = Depends(get_db)):
     return db_user
 
 
+@router.post("/login", response_model=UserResponse)
+async def login(credentials: UserLogin, db: Session = Depends(get_db)):
+    user = db.query(User).filter(User.username == credentials.username).first()
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    valid, new_hash = await verify_password(credentials.password, user.password_hash)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    if new_hash:
+        # стоимость bcrypt изменилась (или пароль хранился открытым текстом)
+        user.password_hash = new_hash
+        db.commit()
+        db.refresh(user)
+    return user
+
+
 @router.put("/{user_id}", response_model=UserResponse)
 async def update_user(user_id: int, payload: UserUpdate, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if payload.username and payload.username != user.username:
+        # вход и проверка уникальности ищут пользователя на шарде его имени
+        if shard_for_new_user(payload.username) != shard_for_id(user_id):
+            raise HTTPException(
+                status_code=400, detail="Username cannot be changed to one stored on another shard")
         exists = db.query(User).filter(
             User.username == payload.username, User.id != user_id).first()
         if exists:
@@ -51,13 +94,11 @@ async def update_user(user_id: int, payload: UserUpdate, db: Session = Depends(g
                 status_code=400, detail="Username already used")
         user.username = payload.username
     if payload.email and payload.email != user.email:
-        exists = db.query(User).filter(
-            User.email == payload.email, User.id != user_id).first()
-        if exists:
+        if _email_taken(db, payload.email, exclude_user_id=user_id):
             raise HTTPException(status_code=400, detail="Email already used")
         user.email = payload.email
     if payload.password:
-        user.password_hash = payload.password
+        user.password_hash = await hash_password(payload.password)
     db.commit()
     db.refresh(user)
     return user
@@ -72,9 +113,13 @@ async def delete_user(user_id: int, db: Session = Depends(get_db)):
     accounts = db.query(Account).filter(Account.user_id == user_id).all()
     account_ids = [a.id for a in accounts]
 
+    cutoff = closed_through(db)
+    ensure_no_closed_entries(db, account_ids, cutoff)
+
     transfers = db.query(TransactionBA).filter(
         (TransactionBA.account_id_from.in_(account_ids)) | (
-            TransactionBA.account_id_to.in_(account_ids))
+            TransactionBA.account_id_to.in_(account_ids)),
+        open_entries(TransactionBA.transaction_date, cutoff)
     ).all()
     for t in transfers:
         a_from = db.query(Account).filter(
@@ -82,16 +127,17 @@ async def delete_user(user_id: int, db: Session = Depends(get_db)):
         a_to = db.query(Account).filter(
             Account.id == t.account_id_to).with_for_update().first()
         if a_from and a_to:
-            amt = Decimal(str(t.amount))
-            if Decimal(a_to.balance) - amt < 0:
+            amt = t.amount
+            if a_to.balance - amt < 0:
                 raise HTTPException(
                     status_code=400, detail="Cannot delete user: transfer rollback would cause negative balance")
-            a_from.balance = Decimal(a_from.balance) + amt
-            a_to.balance = Decimal(a_to.balance) - amt
+            a_from.balance = a_from.balance + amt
+            a_to.balance = a_to.balance - amt
         db.delete(t)
 
     db.query(Transaction).filter(Transaction.account_id.in_(
-        account_ids)).delete(synchronize_session=False)
+        account_ids), open_entries(Transaction.transaction_date, cutoff)
+    ).delete(synchronize_session=False)
 
     category_ids = [c.id for c in db.query(
         Category.id).filter(Category.user_id == user_id).all()]
@@ -105,4 +151,46 @@ async def delete_user(user_id: int, db: Session = Depends(get_db)):
 
     db.delete(user)
     db.commit()
+    # удалены счета и категории пользователя
+    reference_cache.clear()
+    analytics_cache.invalidate_user(user_id)
     return {"message": "User deleted successfully"}
+
+
+@router.get("/{user_id}/export")
+async def export_user(user_id: int, request: Request, format: str = "ndjson",
+                      shard: int = Depends(request_shard)):
+    """
+    Все данные пользователя (счета, категории, транзакции, переводы, бюджеты)
+    zip-архивом с файлом на таблицу в формате ndjson или csv. Архив
+    формируется на лету, по мере чтения из БД.
+    """
+    # проверки - в своей сессии, которая закрывается до начала отдачи:
+    # пока клиент читает архив, занято одно соединение export_archive, а не два
+    with SessionLocal(shard) as db:
+        require_permission(db, request, "transactions", "view")
+        if format not in ARCHIVE_FORMATS:
+            raise HTTPException(
+                status_code=400, detail="Format must be one of: " + ", ".join(ARCHIVE_FORMATS))
+        if not db.query(User.id).filter(User.id == user_id).first():
+            raise HTTPException(status_code=404, detail="User not found")
+    return StreamingResponse(
+        export_archive(shard, user_id, format), media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="user_{user_id}.zip"'})
+
+
+@router.post("/{user_id}/import", response_model=UserImportResult)
+async def import_user(user_id: int, request: Request, archive: UploadFile = File(...),
+                      shard: int = Depends(request_shard)):
+    """
+    Загрузить архив из GET /users/{id}/export в данные пользователя user_id
+    (того же или другого) одной транзакцией. Записи получают новые id,
+    категории с совпадающим именем не дублируются.
+    """
+    # как и при выгрузке: проверочная сессия закрывается до загрузки,
+    # которая идет в собственной сессии import_archive
+    with SessionLocal(shard) as db:
+        require_permission(db, request, "transactions", "create")
+    counts = await run_in_threadpool(import_archive, shard, user_id, archive.file)
+    analytics_cache.invalidate_user(user_id)
+    return counts
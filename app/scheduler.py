@@ -0,0 +1,144 @@
+import asyncio
+import calendar
+import logging
+from datetime import date, timedelta
+from typing import List, Optional
+
+from sqlalchemy import insert, or_, update
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+from app.database import SessionLocal, shard_count
+from app.models import Account, Category, RecurringRule, Transaction
+from app.periods import closed_through
+from app.budget_limits import BudgetLimits
+from app.analytics import analytics_cache
+
+logger = logging.getLogger("uvicorn.error")
+
+FREQUENCIES = ("daily", "weekly", "monthly", "yearly")
+
+
+def _add_months(d: date, months: int, anchor_day: int) -> date:
+    """Сдвиг на months месяцев; день - anchor_day, но не больше длины месяца (31.01 -> 29.02 -> 31.03)."""
+    month_index = d.month - 1 + months
+    year, month = d.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(anchor_day, calendar.monthrange(year, month)[1]))
+
+
+def next_occurrence(rule: RecurringRule, current: date) -> date:
+    if rule.frequency == "daily":
+        return current + timedelta(days=1)
+    if rule.frequency == "weekly":
+        return current + timedelta(weeks=1)
+    months = 1 if rule.frequency == "monthly" else 12
+    return _add_months(current, months, rule.start_date.day)
+
+
+def _due_filter(today: date):
+    return (
+        RecurringRule.active.is_(True),
+        RecurringRule.next_run_date <= today,
+        or_(RecurringRule.end_date.is_(None),
+            RecurringRule.next_run_date <= RecurringRule.end_date),
+    )
+
+
+def materialize_due(today: Optional[date] = None, accounts_per_batch: Optional[int] = None) -> int:
+    """
+    Проводит все наступившие регулярные платежи, включая пропущенные за время
+    простоя периоды. Счета обрабатываются пачками: на пачку - одна транзакция БД,
+    одна блокировка строк счетов, многострочная вставка и пакетное обновление
+    балансов. Возвращает число созданных транзакций.
+    """
+    today = today or date.today()
+    accounts_per_batch = accounts_per_batch or settings.RECURRING_ACCOUNTS_PER_BATCH
+    created = 0
+    for shard in range(shard_count()):
+        with SessionLocal(shard) as db:
+            account_ids = [row.account_id for row in db.query(RecurringRule.account_id).filter(
+                *_due_filter(today)).distinct().order_by(RecurringRule.account_id)]
+            cutoff = closed_through(db)
+        for i in range(0, len(account_ids), accounts_per_batch):
+            created += _materialize_batch(shard, account_ids[i:i + accounts_per_batch], today, cutoff)
+    return created
+
+
+def _materialize_batch(shard: int, account_ids: List[int], today: date, cutoff: Optional[date] = None) -> int:
+    with SessionLocal(shard) as db:
+        # блокируем счета пачки одним запросом, в порядке id - без взаимных блокировок
+        locked = db.query(Account.id, Account.user_id, Account.balance, Account.currency).filter(
+            Account.id.in_(account_ids)).order_by(Account.id).with_for_update().all()
+        balances = {row.id: row.balance for row in locked}
+        currencies = {row.id: row.currency for row in locked}
+        owners = {row.id: row.user_id for row in locked}
+        # правила, которые уже обрабатывает другой процесс, пропускаем
+        rules = db.query(RecurringRule, Category.type).join(
+            Category, Category.id == RecurringRule.category_id
+        ).filter(
+            RecurringRule.account_id.in_(account_ids), *_due_filter(today)
+        ).order_by(RecurringRule.account_id, RecurringRule.id).with_for_update(
+            of=RecurringRule, skip_locked=True).all()
+
+        limits = BudgetLimits(db, {rule.category_id for rule, category_type in rules
+                                   if category_type == 'expense'})
+        rows = []
+        changed = set()
+        for rule, category_type in rules:
+            if rule.account_id not in balances:
+                continue
+            delta = rule.amount if category_type == 'income' else -rule.amount
+            current = rule.next_run_date
+            while current <= today and (rule.end_date is None or current <= rule.end_date):
+                if cutoff and current <= cutoff:
+                    # период уже закрыт - платеж в нем провести нельзя
+                    logger.warning("recurring rule %s: skipping %s in closed period", rule.id, current)
+                    current = next_occurrence(rule, current)
+                    continue
+                if balances[rule.account_id] + delta < 0:
+                    # не хватает средств - остальные периоды проведем в следующий раз
+                    logger.warning("recurring rule %s: insufficient funds on account %s for %s",
+                                   rule.id, rule.account_id, current)
+                    break
+                exceeded = category_type == 'expense' and limits.exceeded(rule.category_id, current, rule.amount)
+                if exceeded:
+                    # лимит бюджета исчерпан - как и при нехватке средств, ждем следующего запуска
+                    logger.warning("recurring rule %s: budget %s exceeded for %s",
+                                   rule.id, exceeded.id, current)
+                    break
+                balances[rule.account_id] += delta
+                if category_type == 'expense':
+                    limits.add(rule.category_id, current, rule.amount)
+                changed.add(rule.account_id)
+                rows.append({
+                    "account_id": rule.account_id,
+                    "category_id": rule.category_id,
+                    "amount": rule.amount,
+                    "currency": currencies[rule.account_id],
+                    "description": rule.description,
+                    "transaction_date": current,
+                })
+                current = next_occurrence(rule, current)
+            rule.next_run_date = current
+            if rule.end_date is not None and current > rule.end_date:
+                rule.active = False
+
+        if rows:
+            db.execute(insert(Transaction), rows)
+            db.execute(update(Account), [
+                {"id": account_id, "balance": balances[account_id]} for account_id in changed])
+        db.commit()
+        analytics_cache.invalidate_user(*{owners[account_id] for account_id in changed})
+        return len(rows)
+
+
+async def run_periodically(interval: float):
+    """Фоновая задача приложения: раз в interval секунд проводит наступившие платежи."""
+    while True:
+        try:
+            created = await run_in_threadpool(materialize_due)
+            if created:
+                logger.info("recurring: %s transactions created", created)
+        except Exception:
+            logger.exception("recurring: materialization failed")
+        await asyncio.sleep(interval)
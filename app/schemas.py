@@ -1,6 +1,10 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, condecimal
 from typing import List, Optional
 from datetime import datetime, date
+from decimal import Decimal
+
+# Денежные суммы: точный Decimal с той же точностью, что и DECIMAL(12, 2) в БД
+Money = condecimal(max_digits=12, decimal_places=2)
 
 
 class UserCreate(BaseModel):
@@ -16,6 +20,11 @@ class UserResponse(BaseModel):
     created_at: datetime
 
 
+class UserLogin(BaseModel):
+    username: str
+    password: str
+
+
 class UserUpdate(BaseModel):
     username: Optional[str] = None
     email: Optional[str] = None
@@ -26,7 +35,8 @@ class AccountCreate(BaseModel):
     user_id: int
     name: str
     type: str
-    balance: float = 0.0
+    balance: Money = Decimal('0.00')
+    currency: str = "RUB"
 
 
 class AccountResponse(BaseModel):
@@ -34,15 +44,28 @@ class AccountResponse(BaseModel):
     user_id: int
     name: str
     type: str
-    balance: float
+    balance: Money
+    currency: str
     created_at: datetime
+    version: int
 
 
 class AccountUpdate(BaseModel):
     user_id: Optional[int] = None
     name: Optional[str] = None
     type: Optional[str] = None
-    balance: Optional[float] = None
+    balance: Optional[Money] = None
+
+
+class StatementEntryResponse(BaseModel):
+    entry_type: str  # transaction, transfer_in, transfer_out
+    entry_id: int
+    transaction_date: date
+    description: Optional[str]
+    category_id: Optional[int]
+    counterparty_account_id: Optional[int]
+    amount: Decimal  # со знаком: приход > 0, расход < 0
+    balance: Decimal  # баланс счета после операции
 
 
 class CategoryCreate(BaseModel):
@@ -56,6 +79,7 @@ class CategoryResponse(BaseModel):
     user_id: int
     name: str
     type: str
+    version: int
 
 
 class CategoryUpdate(BaseModel):
@@ -67,7 +91,8 @@ class CategoryUpdate(BaseModel):
 class TransactionCreate(BaseModel):
     account_id: int
     category_id: int
-    amount: float
+    amount: Money
+    currency: Optional[str] = None  # по умолчанию - валюта счета
     description: Optional[str] = None
     transaction_date: Optional[date] = None
 
@@ -76,15 +101,21 @@ class TransactionResponse(BaseModel):
     id: int
     account_id: int
     category_id: int
-    amount: float
+    amount: Money
+    currency: str
     description: Optional[str]
     transaction_date: date
 
 
+class TransactionSearchResponse(BaseModel):
+    items: List[TransactionResponse]
+    next_cursor: Optional[str] = None
+
+
 class TransactionBACreate(BaseModel):
     account_id_from: int
     account_id_to: int
-    amount: float
+    amount: Money
     description: Optional[str] = None
     transaction_date: Optional[date] = None
 
@@ -93,7 +124,7 @@ class TransactionBAResponse(BaseModel):
     id: int
     account_id_from: int
     account_id_to: int
-    amount: float
+    amount: Money
     description: Optional[str]
     transaction_date: date
 
@@ -101,7 +132,7 @@ class TransactionBAResponse(BaseModel):
 class BudgetCreate(BaseModel):
     user_id: int
     category_id: int
-    amount_limit: float
+    amount_limit: Money
     period_start: date
     period_end: date
 
@@ -110,19 +141,128 @@ class BudgetResponse(BaseModel):
     id: int
     user_id: int
     category_id: int
-    amount_limit: float
+    amount_limit: Money
     period_start: date
     period_end: date
+    version: int
 
 
 class BudgetUpdate(BaseModel):
     user_id: Optional[int] = None
     category_id: Optional[int] = None
-    amount_limit: Optional[float] = None
+    amount_limit: Optional[Money] = None
     period_start: Optional[date] = None
     period_end: Optional[date] = None
 
 
+class CategoryReportResponse(BaseModel):
+    category: str
+    type: str
+    total_amount: Decimal
+    currency: str
+    count: int
+
+
+class ReportJobCreate(BaseModel):
+    kind: str  # transactions, categories, logs
+    user_id: Optional[int] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    table_name: Optional[str] = None
+    limit: Optional[int] = None
+    currency: Optional[str] = None
+
+
+class ReportJobResponse(BaseModel):
+    id: str
+    kind: str
+    status: str
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+class BudgetStatusResponse(BaseModel):
+    budget_id: int
+    category_id: int
+    amount_limit: Money
+    period_start: date
+    period_end: date
+    spent: Decimal
+    remaining: Decimal
+    percent: float
+    projected_spent: Decimal
+    projected_over_limit: bool
+
+
+class RecurringRuleCreate(BaseModel):
+    account_id: int
+    category_id: int
+    amount: Money
+    description: Optional[str] = None
+    frequency: str  # daily, weekly, monthly, yearly
+    start_date: date
+    end_date: Optional[date] = None
+
+
+class RecurringRuleResponse(BaseModel):
+    id: int
+    account_id: int
+    category_id: int
+    amount: Money
+    description: Optional[str]
+    frequency: str
+    start_date: date
+    end_date: Optional[date]
+    next_run_date: date
+    active: bool
+
+
+class RecurringRuleUpdate(BaseModel):
+    amount: Optional[Money] = None
+    description: Optional[str] = None
+    end_date: Optional[date] = None
+    active: Optional[bool] = None
+
+
+class UserAccountsSummaryResponse(BaseModel):
+    user_id: int
+    username: str
+    email: str
+    currency: Optional[str]
+    total_accounts: int
+    total_balance: Decimal
+    first_account_created: Optional[datetime]
+    converted_balance: Optional[Decimal] = None
+
+
+class CategoryTransactionsReportResponse(BaseModel):
+    category_id: int
+    category_name: str
+    category_type: str
+    user_id: int
+    username: str
+    currency: Optional[str]
+    transaction_count: int
+    total_amount: Decimal
+    average_amount: Decimal
+    first_transaction_date: Optional[date]
+    last_transaction_date: Optional[date]
+
+
+class PeriodClose(BaseModel):
+    period_end: date
+    archive: bool = False
+
+
+class ClosedPeriodResponse(BaseModel):
+    id: int
+    period_start: Optional[date]
+    period_end: date
+    closed_at: datetime
+    archived: bool
+
+
 class LogResponse(BaseModel):
     log_id: int
     table_name: str
@@ -130,4 +270,56 @@ class LogResponse(BaseModel):
     action: str
     action_date: datetime
     old_data: Optional[dict] = None
-    new_data: Optional[dict] = None
\ No newline at end of file
+    new_data: Optional[dict] = None
+
+class ChangeResponse(LogResponse):
+    txid: int
+
+
+class ChangesPage(BaseModel):
+    changes: List[ChangeResponse]
+    cursor: str
+    has_more: bool
+
+
+class AnalyticsMonth(BaseModel):
+    month: date
+    income: Decimal
+    expense: Decimal
+    expense_delta: Optional[Decimal] = None
+    expense_delta_percent: Optional[float] = None
+
+
+class AnalyticsCategoryShare(BaseModel):
+    category_id: int
+    category: str
+    total_amount: Decimal
+    share: float
+
+
+class AnalyticsOutlier(BaseModel):
+    transaction_id: int
+    category_id: int
+    amount: Money
+    currency: str
+    transaction_date: date
+    z_score: float
+
+
+class AnalyticsResponse(BaseModel):
+    user_ids: List[int]
+    currency: str
+    start_date: date
+    # месяцы до этой даты включительно перенесены в архив и не учитываются
+    archived_through: Optional[date] = None
+    months: List[AnalyticsMonth]
+    categories: List[AnalyticsCategoryShare]
+    outliers: List[AnalyticsOutlier]
+
+
+class UserImportResult(BaseModel):
+    categories: int
+    accounts: int
+    transactions: int
+    transfers: int
+    budgets: int
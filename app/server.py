@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import os
+
+from config import settings
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class WorkerStats:
+    """Счетчик запросов процесса-воркера; периодически пишет пропускную способность в лог."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.requests = 0
+        self._task = None
+
+    def start(self):
+        pool_size, max_overflow = settings.db_pool_limits()
+        logger.info("worker pid=%s started, DB pool %s + %s overflow (budget %s for %s workers)",
+                    os.getpid(), pool_size, max_overflow, settings.DB_MAX_CONNECTIONS, settings.WEB_WORKERS)
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._report())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        logger.info("worker pid=%s stopped, %s requests total",
+                    os.getpid(), self.requests)
+
+    async def _report(self):
+        while True:
+            before = self.requests
+            await asyncio.sleep(self.interval)
+            logger.info("worker pid=%s: %.1f req/s, %s requests total",
+                        os.getpid(), (self.requests - before) / self.interval, self.requests)
+
+
+worker_stats = WorkerStats(settings.WEB_STATS_INTERVAL)
+
+
+def run_production(workers: int):
+    """
+    Запуск нескольких процессов uvicorn. Число воркеров передается им через
+    WEB_WORKERS, чтобы каждый взял свою долю DB_MAX_CONNECTIONS. По SIGTERM/SIGINT
+    воркеры перестают принимать соединения и до WEB_GRACEFUL_TIMEOUT секунд
+    дорабатывают текущие запросы, после чего закрывают пулы соединений.
+    """
+    import uvicorn
+
+    os.environ["WEB_WORKERS"] = str(workers)
+    uvicorn.run(
+        "main:app",
+        host=settings.WEB_HOST,
+        port=settings.WEB_PORT,
+        workers=workers,
+        loop=settings.WEB_LOOP,
+        http=settings.WEB_HTTP,
+        timeout_graceful_shutdown=settings.WEB_GRACEFUL_TIMEOUT,
+        proxy_headers=True,
+    )
@@ -0,0 +1,254 @@
+import io
+import json
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+import psycopg2
+from fastapi import HTTPException
+from sqlalchemy import case, func, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import Account, Budget, Category, Transaction, TransactionBA, User
+from app.periods import ensure_open
+
+ARCHIVE_FORMATS = ("ndjson", "csv")
+
+# Файлы архива и их столбцы (с типами промежуточных таблиц импорта).
+# opening_balance счета - баланс без учета операций архива: при импорте
+# баланс пересчитывается как opening_balance + операции архива.
+ARCHIVE_TABLES: List[Tuple[str, List[Tuple[str, str]]]] = [
+    ("categories", [("id", "int"), ("name", "varchar(100)"), ("type", "text")]),
+    ("accounts", [("id", "int"), ("name", "varchar(100)"), ("type", "text"), ("currency", "char(3)"),
+                  ("created_at", "timestamp"), ("balance", "numeric(12, 2)"),
+                  ("opening_balance", "numeric(12, 2)")]),
+    ("transactions", [("id", "int"), ("account_id", "int"), ("category_id", "int"),
+                      ("amount", "numeric(12, 2)"), ("currency", "char(3)"), ("description", "text"),
+                      ("transaction_date", "date")]),
+    ("transfers", [("id", "int"), ("account_id_from", "int"), ("account_id_to", "int"),
+                   ("amount", "numeric(12, 2)"), ("description", "text"), ("transaction_date", "date")]),
+    ("budgets", [("id", "int"), ("category_id", "int"), ("amount_limit", "numeric(12, 2)"),
+                 ("period_start", "date"), ("period_end", "date")]),
+]
+
+EXPORT_BATCH_ROWS = 1000
+# сколько сжатых байт копить перед отправкой клиенту
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def _export_queries(user_id: int) -> Dict[str, object]:
+    account_ids = select(Account.id).where(Account.user_id == user_id)
+    signed = case((Category.type == 'income', Transaction.amount), else_=-Transaction.amount)
+    net_transactions = select(func.coalesce(func.sum(signed), 0)).select_from(Transaction).join(
+        Category, Category.id == Transaction.category_id).where(
+        Transaction.account_id == Account.id).scalar_subquery()
+    transfers_in = select(func.coalesce(func.sum(TransactionBA.amount), 0)).where(
+        TransactionBA.account_id_to == Account.id).scalar_subquery()
+    transfers_out = select(func.coalesce(func.sum(TransactionBA.amount), 0)).where(
+        TransactionBA.account_id_from == Account.id).scalar_subquery()
+    return {
+        "user": select(User.id, User.username, User.email, User.created_at).where(User.id == user_id),
+        "categories": select(Category.id, Category.name, Category.type).where(
+            Category.user_id == user_id).order_by(Category.id),
+        "accounts": select(
+            Account.id, Account.name, Account.type, Account.currency, Account.created_at, Account.balance,
+            (Account.balance - net_transactions - transfers_in + transfers_out).label("opening_balance"),
+        ).where(Account.user_id == user_id).order_by(Account.id),
+        "transactions": select(
+            Transaction.id, Transaction.account_id, Transaction.category_id, Transaction.amount,
+            Transaction.currency, Transaction.description, Transaction.transaction_date,
+        ).where(Transaction.account_id.in_(account_ids)),
+        "transfers": select(
+            TransactionBA.id, TransactionBA.account_id_from, TransactionBA.account_id_to, TransactionBA.amount,
+            TransactionBA.description, TransactionBA.transaction_date,
+        ).where(TransactionBA.account_id_from.in_(account_ids) | TransactionBA.account_id_to.in_(account_ids)),
+        "budgets": select(
+            Budget.id, Budget.category_id, Budget.amount_limit, Budget.period_start, Budget.period_end,
+        ).where(Budget.user_id == user_id).order_by(Budget.id),
+    }
+
+
+def _json_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _csv_field(value) -> str:
+    # NULL - пустое поле без кавычек, любое значение - в кавычках, как читает COPY ... CSV
+    if value is None:
+        return ""
+    return '"' + str(_json_value(value)).replace('"', '""') + '"'
+
+
+def _format_rows(fmt: str, columns: List[str], rows) -> str:
+    if fmt == "csv":
+        return "".join(",".join(_csv_field(v) for v in row) + "\n" for row in rows)
+    return "".join(json.dumps({c: _json_value(v) for c, v in zip(columns, row)}, ensure_ascii=False) + "\n"
+                   for row in rows)
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Неперематываемый приемник для ZipFile: сжатые байты забираются drain()."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.size = 0
+        return data
+
+
+def export_archive(shard: int, user_id: int, fmt: str) -> Iterator[bytes]:
+    """
+    Zip-архив данных пользователя: по файлу на таблицу (<таблица>.ndjson или
+    .csv). Строки читаются курсором на сервере порциями по EXPORT_BATCH_ROWS и
+    сразу сжимаются и отдаются, так что память не зависит от объема данных.
+    Все таблицы читаются из одного снимка (REPEATABLE READ).
+    """
+    buffer = _ChunkBuffer()
+    with SessionLocal(shard) as db:
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, query in _export_queries(user_id).items():
+                result = db.execute(query.execution_options(yield_per=EXPORT_BATCH_ROWS))
+                columns = list(result.keys())
+                with archive.open(f"{name}.{fmt}", "w", force_zip64=True) as member:
+                    if fmt == "csv":
+                        member.write((",".join(columns) + "\n").encode("utf-8"))
+                    for rows in result.partitions():
+                        member.write(_format_rows(fmt, columns, rows).encode("utf-8"))
+                        if buffer.size >= EXPORT_CHUNK_BYTES:
+                            yield buffer.drain()
+        db.commit()
+    yield buffer.drain()
+
+
+# Перенос из промежуточных таблиц: новые id, владелец - пользователь импорта.
+# Категории с тем же именем у пользователя уже могут быть - тогда используются они
+# (import_archive заранее отклоняет архив, если тип такой категории другой).
+_IMPORT_STATEMENTS = [
+    ("categories", """
+        INSERT INTO categories (user_id, name, type)
+        SELECT :user_id, name, type::type_of_c FROM import_categories
+        ON CONFLICT (user_id, name) DO NOTHING"""),
+    (None, """
+        UPDATE import_categories ic SET new_id = c.id
+        FROM categories c WHERE c.user_id = :user_id AND c.name = ic.name"""),
+    (None, "UPDATE import_accounts SET new_id = nextval(pg_get_serial_sequence('accounts', 'id'))"),
+    ("accounts", """
+        INSERT INTO accounts (id, user_id, name, type, balance, currency, created_at)
+        SELECT new_id, :user_id, name, type::type_of_p, 0, currency, coalesce(created_at, current_timestamp)
+        FROM import_accounts"""),
+    ("transactions", """
+        INSERT INTO transactions (account_id, category_id, amount, currency, description, transaction_date)
+        SELECT a.new_id, c.new_id, t.amount, coalesce(t.currency, a.currency), t.description, t.transaction_date
+        FROM import_transactions t
+        JOIN import_accounts a ON a.id = t.account_id
+        JOIN import_categories c ON c.id = t.category_id"""),
+    ("transfers", """
+        INSERT INTO transactions_b_a (account_id_from, account_id_to, amount, description, transaction_date)
+        SELECT a_from.new_id, a_to.new_id, t.amount, t.description, t.transaction_date
+        FROM import_transfers t
+        JOIN import_accounts a_from ON a_from.id = t.account_id_from
+        JOIN import_accounts a_to ON a_to.id = t.account_id_to"""),
+    ("budgets", """
+        INSERT INTO budgets (user_id, category_id, amount_limit, period_start, period_end)
+        SELECT :user_id, c.new_id, b.amount_limit, b.period_start, b.period_end
+        FROM import_budgets b JOIN import_categories c ON c.id = b.category_id
+        ON CONFLICT (user_id, category_id, period_start) DO NOTHING"""),
+    # балансы - один раз в конце, по всем загруженным операциям
+    (None, """
+        UPDATE accounts a SET balance = coalesce(ia.opening_balance, 0)
+            + coalesce((SELECT sum(CASE WHEN c.type = 'income' THEN t.amount ELSE -t.amount END)
+                        FROM transactions t JOIN categories c ON c.id = t.category_id
+                        WHERE t.account_id = a.id), 0)
+            + coalesce((SELECT sum(amount) FROM transactions_b_a WHERE account_id_to = a.id), 0)
+            - coalesce((SELECT sum(amount) FROM transactions_b_a WHERE account_id_from = a.id), 0)
+        FROM import_accounts ia WHERE a.id = ia.new_id"""),
+]
+
+
+def _copy_member(db: Session, archive: zipfile.ZipFile, name: str, columns: List[Tuple[str, str]]):
+    """COPY файла таблицы из архива в промежуточную таблицу import_<name>."""
+    names = ", ".join(column for column, _ in columns)
+    cursor = db.connection().connection.cursor()
+    try:
+        if f"{name}.csv" in archive.namelist():
+            with archive.open(f"{name}.csv") as member:
+                cursor.copy_expert(
+                    f"COPY import_{name} ({names}) FROM STDIN WITH (FORMAT csv, HEADER true)", member)
+        elif f"{name}.ndjson" in archive.namelist():
+            # строка JSON целиком в одно поле jsonb: разделитель и кавычка,
+            # которых в JSON не бывает
+            with archive.open(f"{name}.ndjson") as member:
+                cursor.copy_expert(
+                    "COPY import_lines FROM STDIN WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')", member)
+            cursor.execute(
+                f"INSERT INTO import_{name} ({names}) SELECT {', '.join('r.' + c for c, _ in columns)} "
+                f"FROM import_lines, jsonb_populate_record(NULL::import_{name}, line) r")
+            cursor.execute("TRUNCATE import_lines")
+    finally:
+        cursor.close()
+
+
+def import_archive(shard: int, user_id: int, file: BinaryIO) -> Dict[str, int]:
+    """
+    Загружает архив export_archive в данные пользователя user_id одной
+    транзакцией: файлы копируются COPY в временные таблицы, затем переносятся
+    несколькими INSERT ... SELECT с новыми id, балансы счетов пересчитываются
+    одним UPDATE в конце. Возвращает число добавленных строк по таблицам.
+    """
+    try:
+        archive = zipfile.ZipFile(file)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Archive must be a zip file")
+    counts = {name: 0 for name, _ in ARCHIVE_TABLES}
+    with archive, SessionLocal(shard) as db:
+        if not db.query(User.id).filter(User.id == user_id).first():
+            raise HTTPException(status_code=404, detail="User not found")
+        try:
+            db.execute(text("CREATE TEMP TABLE import_lines (line jsonb) ON COMMIT DROP"))
+            for name, columns in ARCHIVE_TABLES:
+                definition = ", ".join(f"{column} {type_}" for column, type_ in columns)
+                extra = ", new_id int" if name in ("categories", "accounts") else ""
+                db.execute(text(f"CREATE TEMP TABLE import_{name} ({definition}{extra}) ON COMMIT DROP"))
+                _copy_member(db, archive, name, columns)
+            # категория с тем же именем, но другим типом перевернула бы знак операций
+            conflicts = db.execute(text("""
+                SELECT ic.name FROM import_categories ic
+                JOIN categories c ON c.user_id = :user_id AND c.name = ic.name
+                WHERE c.type::text <> ic.type ORDER BY ic.name"""), {"user_id": user_id}).scalars().all()
+            if conflicts:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Categories already exist with a different type: " + ", ".join(conflicts))
+            ensure_open(db, db.execute(text(
+                "SELECT least((SELECT min(transaction_date) FROM import_transactions), "
+                "(SELECT min(transaction_date) FROM import_transfers))")).scalar())
+            for name, statement in _IMPORT_STATEMENTS:
+                result = db.execute(text(statement), {"user_id": user_id})
+                if name:
+                    counts[name] = result.rowcount
+            db.commit()
+        except (DBAPIError, psycopg2.Error, zipfile.BadZipFile) as exc:
+            db.rollback()
+            message = str(getattr(exc, "orig", exc)).strip().splitlines()[0]
+            raise HTTPException(status_code=400, detail=f"Invalid archive: {message}")
+    return counts
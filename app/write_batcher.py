@@ -0,0 +1,172 @@
+import asyncio
+from datetime import date
+from typing import Dict, Iterable, List
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+from app.database import SessionLocal, shard_for_id
+from app.models import Account, Category, Transaction
+from app.budget_limits import BudgetLimits
+from app.schemas import TransactionCreate
+from app.periods import closed_through
+from app.analytics import analytics_cache
+
+# Сколько секунд воркер счёта ждёт новых записей, прежде чем завершиться
+_IDLE_TIMEOUT = 5.0
+
+
+class TransactionBatcher:
+    """
+    Склеивает одновременные создания транзакций по одному счёту: запросы
+    копятся в очереди счёта несколько миллисекунд и применяются в одной
+    транзакции БД - одна блокировка счёта, одно обновление баланса и
+    многострочная вставка. Каждый вызывающий получает свой результат или ошибку.
+    """
+
+    def __init__(self, window_ms: int, max_batch: int):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def submit(self, transaction: TransactionCreate) -> Transaction:
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(transaction.account_id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._queues[transaction.account_id] = queue
+            self._workers[transaction.account_id] = asyncio.create_task(
+                self._worker(transaction.account_id, queue))
+        queue.put_nowait((transaction, future))
+        return await future
+
+    async def _worker(self, account_id: int, queue: asyncio.Queue):
+        while True:
+            try:
+                first = await asyncio.wait_for(queue.get(), timeout=_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    del self._queues[account_id]
+                    del self._workers[account_id]
+                    return
+                continue
+            batch = [first]
+            await asyncio.sleep(self.window)
+            while not queue.empty() and len(batch) < self.max_batch:
+                batch.append(queue.get_nowait())
+
+            try:
+                results = await run_in_threadpool(
+                    apply_transactions, account_id, [t for t, _ in batch])
+            except Exception as exc:
+                results = [exc] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+def lock_account_with_categories(db: Session, account_id: int, category_ids: Iterable[int]):
+    """
+    Одним запросом блокирует счет и читает тип и владельца категорий
+    (LEFT JOIN: счет возвращается, даже если категорий нет). Тип читается
+    в транзакции записи, поэтому знак операции всегда актуален.
+    Возвращает (счет или None, {id категории: строка с id, type, user_id}).
+    """
+    rows = db.query(Account, Category.id, Category.type, Category.user_id).outerjoin(
+        Category, Category.id.in_(set(category_ids))).filter(
+        Account.id == account_id).with_for_update(of=Account).all()
+    if not rows:
+        return None, {}
+    return rows[0].Account, {row.id: row for row in rows if row.id is not None}
+
+
+def apply_transactions(account_id: int, items: List[TransactionCreate]) -> list:
+    """
+    Применяет пачку транзакций одного счёта в одной транзакции БД.
+    Возвращает список той же длины: созданная Transaction или HTTPException
+    для позиций, не прошедших проверки (остальные всё равно применяются).
+    """
+    results: list = [None] * len(items)
+    with SessionLocal(shard_for_id(account_id), expire_on_commit=False) as db:
+        acc, categories = lock_account_with_categories(db, account_id, (t.category_id for t in items))
+        if not acc:
+            return [HTTPException(status_code=404, detail="Account not found")] * len(items)
+
+        # потраченное по бюджетам учитывает уже принятые позиции пачки
+        limits = BudgetLimits(db, (c.id for c in categories.values() if c.type == 'expense'))
+
+        cutoff = closed_through(db)
+        balance = acc.balance
+        pending = []
+        for i, transaction in enumerate(items):
+            if transaction.amount <= 0:
+                results[i] = HTTPException(
+                    status_code=400, detail="Transaction amount must be greater than zero")
+                continue
+            cat = categories.get(transaction.category_id)
+            if not cat:
+                results[i] = HTTPException(
+                    status_code=404, detail="Category not found")
+                continue
+            if acc.user_id != cat.user_id:
+                results[i] = HTTPException(
+                    status_code=400, detail="Account and category belong to different users")
+                continue
+            if transaction.currency and transaction.currency.upper() != acc.currency:
+                results[i] = HTTPException(
+                    status_code=400, detail="Transaction currency must match account currency")
+                continue
+
+            amt = transaction.amount
+            trans_date = transaction.transaction_date or date.today()
+            if cutoff and trans_date <= cutoff:
+                results[i] = HTTPException(
+                    status_code=409, detail=f"Period is closed through {cutoff}")
+                continue
+            if cat.type == 'expense':
+                exceeded = limits.exceeded(cat.id, trans_date, amt)
+                if exceeded is not None:
+                    results[i] = HTTPException(
+                        status_code=400, detail=f"Budget exceeded for category during period {exceeded.period_start} - {exceeded.period_end}")
+                    continue
+            delta = amt if cat.type == 'income' else -amt
+            if cat.type == 'expense' and balance + delta < 0:
+                results[i] = HTTPException(
+                    status_code=400, detail="Insufficient funds")
+                continue
+
+            balance += delta
+            if cat.type == 'expense':
+                limits.add(cat.id, trans_date, amt)
+            pending.append((i, Transaction(
+                account_id=account_id,
+                category_id=transaction.category_id,
+                amount=amt,
+                currency=acc.currency,
+                description=transaction.description,
+                transaction_date=trans_date
+            )))
+
+        if pending:
+            acc.balance = balance
+            db.add_all([obj for _, obj in pending])
+            db.commit()
+            analytics_cache.invalidate_user(acc.user_id)
+            for i, obj in pending:
+                results[i] = obj
+    return results
+
+
+transaction_batcher = TransactionBatcher(
+    settings.TRANSACTION_BATCH_WINDOW_MS, settings.TRANSACTION_BATCH_MAX_SIZE)
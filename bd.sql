@@ -3,6 +3,12 @@ create type type_of_p as enum ('cash', 'card', 'deposit');
 create type type_of_c as enum ('income', 'expense');
 
 --drop tables
+drop table if exists period_category_totals cascade;
+drop table if exists period_account_balances cascade;
+drop table if exists closed_periods cascade;
+drop table if exists transactions_b_a_archive cascade;
+drop table if exists transactions_archive cascade;
+drop table if exists recurring_rules cascade;
 drop table if exists transactions_b_a cascade;
 drop table if exists transactions cascade;
 drop table if exists budgets cascade;
@@ -10,6 +16,8 @@ drop table if exists categories cascade;
 drop table if exists accounts cascade;
 drop table if exists users cascade;
 drop table if exists logs cascade;
+drop table if exists idempotency_keys cascade;
+drop table if exists rate_limit_buckets cascade;
 
 --tables
 create table users (
@@ -27,7 +35,10 @@ create table accounts (
     name varchar(100) not null,
     type type_of_p not null,
     balance decimal(12, 2) not null default 0.00,
-    created_at timestamp default current_timestamp
+    currency char(3) not null default 'RUB',
+    created_at timestamp default current_timestamp,
+    -- версия для If-Match; растет при PUT, но не при движениях по балансу
+    version int not null default 1
 );
 
 
@@ -36,28 +47,34 @@ create table categories (
     user_id int not null references users(id) on delete cascade,
     name varchar(100) not null,
     type type_of_c not null,
+    version int not null default 1,
     unique (user_id, name)
 );
 
 
+-- секционирована по месяцам transaction_date (см. create_month_partitions),
+-- поэтому ключ секционирования входит в первичный ключ
 create table transactions (
-    id serial primary key,
+    id serial,
     account_id int not null references accounts(id) on delete restrict,
     category_id int not null references categories(id) on delete restrict,
     amount decimal(12, 2) not null check (amount > 0),
+    currency char(3) not null default 'RUB',
     description text,
-    transaction_date date not null default current_date
-);
+    transaction_date date not null default current_date,
+    primary key (id, transaction_date)
+) partition by range (transaction_date);
 
 
 create table transactions_b_a (
-    id serial primary key,
+    id serial,
     account_id_from int not null references accounts(id),
     account_id_to int not null references accounts(id),
     amount decimal(12, 2) not null check (amount > 0),
     description text,
-    transaction_date date not null default current_date
-);
+    transaction_date date not null default current_date,
+    primary key (id, transaction_date)
+) partition by range (transaction_date);
 
 
 create table budgets (
@@ -67,9 +84,64 @@ create table budgets (
     amount_limit decimal(12, 2) not null check (amount_limit > 0),
     period_start date not null,
     period_end date not null check (period_end >= period_start),
+    version int not null default 1,
     unique (user_id, category_id, period_start)
 );
 
+create table recurring_rules (
+    id serial primary key,
+    account_id int not null references accounts(id) on delete cascade,
+    category_id int not null references categories(id) on delete cascade,
+    amount decimal(12, 2) not null check (amount > 0),
+    description text,
+    frequency varchar(10) not null check (frequency in ('daily', 'weekly', 'monthly', 'yearly')),
+    start_date date not null,
+    end_date date check (end_date >= start_date),
+    next_run_date date not null,
+    active boolean not null default true
+);
+
+-- планировщик выбирает только активные наступившие правила
+create index idx_recurring_rules_due on recurring_rules (next_run_date, account_id) where active;
+
+-- закрытые периоды: операции с датой <= period_end менять нельзя
+create table closed_periods (
+    id serial primary key,
+    period_start date,
+    period_end date not null unique,
+    closed_at timestamp not null default current_timestamp,
+    archived boolean not null default false,
+    check (period_start is null or period_start <= period_end)
+);
+
+-- остатки счетов на конец закрытого периода
+create table period_account_balances (
+    period_id int not null references closed_periods(id) on delete cascade,
+    account_id int not null references accounts(id) on delete cascade,
+    closing_balance decimal(12, 2) not null,
+    primary key (period_id, account_id)
+);
+
+-- итоги по категориям за закрытый период (без предыдущих периодов)
+create table period_category_totals (
+    period_id int not null references closed_periods(id) on delete cascade,
+    category_id int not null references categories(id) on delete cascade,
+    currency char(3) not null,
+    transaction_count int not null,
+    total_amount decimal(14, 2) not null,
+    primary key (period_id, category_id, currency)
+);
+
+create index idx_period_category_totals_category on period_category_totals (category_id);
+
+-- архив операций закрытых периодов (archive_transactions): без внешних
+-- ключей, чтобы счета с архивной историей можно было удалять
+create table transactions_archive (like transactions);
+create table transactions_b_a_archive (like transactions_b_a);
+
+create index idx_transactions_archive_account_date on transactions_archive (account_id, transaction_date);
+create index idx_transactions_b_a_archive_date on transactions_b_a_archive (transaction_date);
+
 create table logs (
     log_id serial primary key,
     table_name text not null,
@@ -77,47 +149,259 @@ create table logs (
     action varchar(10) not null check (action in ('insert', 'UPDATE', 'DELETE')),
     action_date timestamp not null default current_timestamp,
     old_data jsonb,
-    new_data jsonb
+    new_data jsonb,
+    -- транзакция, записавшая строку: лента /changes отдает только завершенные
+    txid bigint not null default txid_current()
 );
 
+create index idx_logs_txid on logs (txid, log_id);
+
+create index idx_transactions_category_date on transactions (category_id, transaction_date);
+create index idx_transactions_account_date on transactions (account_id, transaction_date);
+create index idx_transactions_b_a_from_date on transactions_b_a (account_id_from, transaction_date);
+create index idx_transactions_b_a_to_date on transactions_b_a (account_id_to, transaction_date);
+create index idx_transactions_description_fts on transactions
+    using gin (to_tsvector('russian', coalesce(description, '')));
+
+create table idempotency_keys (
+    key varchar(300) primary key,
+    fingerprint varchar(64) not null,
+    status_code int,
+    response_body text,
+    created_at timestamp not null default current_timestamp
+);
+
+create index idx_idempotency_keys_created_at on idempotency_keys (created_at);
+
+-- общие для всех процессов корзины ограничения частоты запросов (RATE_LIMIT_USE_DB=1)
+create table rate_limit_buckets (
+    key varchar(300) primary key,
+    tokens double precision not null,
+    -- сколько токенов выдано процессу последним запросом (аренда)
+    granted integer not null default 0,
+    updated_at timestamp not null default current_timestamp
+);
+
+--partitions
+-- Месячные секции p_table_YYYY_MM для месяцев с p_from по p_to; существующие
+-- пропускаются. Строки вне созданных месяцев попадают в секцию _default.
+create or replace function create_month_partitions(p_table text, p_from date, p_to date)
+returns int as $$
+declare
+    m date := date_trunc('month', p_from)::date;
+    part text;
+    created int := 0;
+begin
+    while m <= p_to loop
+        part := format('%s_%s', p_table, to_char(m, 'YYYY_MM'));
+        if to_regclass(part) is null then
+            begin
+                execute format('create table %I partition of %I for values from (%L) to (%L)',
+                               part, p_table, m, (m + interval '1 month')::date);
+                created := created + 1;
+            exception when check_violation then
+                -- в _default уже есть строки этого месяца: их нужно перенести вручную
+                raise warning 'partition % skipped: rows for this month are in %_default', part, p_table;
+            end;
+        end if;
+        m := (m + interval '1 month')::date;
+    end loop;
+    return created;
+end;
+$$ language plpgsql security definer set search_path = public;
+
+-- вызывается приложением периодически (PARTITION_CHECK_INTERVAL): секции
+-- на текущий и p_months_ahead следующих месяцев
+create or replace function ensure_transaction_partitions(p_months_ahead int default 3)
+returns int as $$
+declare
+    horizon date := (current_date + make_interval(months => p_months_ahead))::date;
+begin
+    return create_month_partitions('transactions', current_date, horizon)
+         + create_month_partitions('transactions_b_a', current_date, horizon);
+end;
+$$ language plpgsql security definer set search_path = public;
+
+-- Отсоединяет секции месяцев раньше p_before: они остаются отдельными таблицами
+-- (архив), из запросов к transactions пропадают. Без блокировки записи то же
+-- делает вручную alter table ... detach partition ... concurrently.
+create or replace function detach_transaction_partitions(p_before date)
+returns setof text as $$
+declare
+    part record;
+begin
+    for part in
+        select c.relname, p.relname as parent
+        from pg_inherits i
+        join pg_class c on c.oid = i.inhrelid
+        join pg_class p on p.oid = i.inhparent
+        where p.relname in ('transactions', 'transactions_b_a')
+          and c.relname ~ '_\d{4}_\d{2}$'
+          and to_date(right(c.relname, 7), 'YYYY_MM') < date_trunc('month', p_before)
+        order by c.relname
+    loop
+        execute format('alter table %I detach partition %I', part.parent, part.relname);
+        return next part.relname;
+    end loop;
+end;
+$$ language plpgsql security definer set search_path = public;
+
+-- Шардирование (DATABASE_SHARD_URLS): на шарде p_index из p_count все
+-- последовательности выдают id с (id - 1) % p_count = p_index, поэтому id
+-- уникальны между шардами и по id понятно, на каком шарде запись.
+-- Выполняется владельцем схемы на каждом шарде после создания таблиц; строки
+-- с id другого шарда (например, из bd_seed.sql) - ошибка.
+create or replace function configure_shard_sequences(p_index int, p_count int)
+returns void as $$
+declare
+    seq record;
+    tbl text;
+    misplaced boolean;
+    next_id bigint;
+begin
+    foreach tbl in array array['users', 'accounts', 'categories', 'transactions',
+                               'transactions_b_a', 'budgets', 'recurring_rules']
+    loop
+        execute format('select exists (select 1 from %I where (id - 1) %% %s <> %s)',
+                       tbl, p_count, p_index) into misplaced;
+        if misplaced then
+            raise exception 'таблица % содержит id не из шарда % (из %)', tbl, p_index, p_count;
+        end if;
+    end loop;
+    for seq in
+        select sequencename, coalesce(last_value, 0) as last_value
+        from pg_sequences where schemaname = 'public'
+    loop
+        next_id := seq.last_value + 1;
+        next_id := next_id + ((p_index - (next_id - 1) % p_count) + p_count) % p_count;
+        execute format('alter sequence %I increment by %s restart with %s',
+                       seq.sequencename, p_count, next_id);
+    end loop;
+end;
+$$ language plpgsql;
+
+create table transactions_default partition of transactions default;
+create table transactions_b_a_default partition of transactions_b_a default;
+select create_month_partitions('transactions', '2024-01-01', (current_date + interval '3 months')::date);
+select create_month_partitions('transactions_b_a', '2024-01-01', (current_date + interval '3 months')::date);
+
 --trigger function
 create or replace function log_trg_func()
 returns trigger as $$
 declare
     pk_name text := TG_ARGV[0];
+    -- у секционированных таблиц TG_TABLE_NAME - имя секции, поэтому имя передается явно
+    log_table text := coalesce(TG_ARGV[1], TG_TABLE_NAME);
     record_id int;
 begin
-    if (TG_OP = 'insert') then
+    if (TG_OP = 'INSERT') then
         record_id := (to_jsonb(NEW)->>pk_name)::int;
 
         insert into logs(table_name, record_id, action, action_date, new_data)
-        values (TG_TABLE_NAME, record_id, 'insert', current_timestamp, to_jsonb(NEW));
+        values (log_table, record_id, 'insert', current_timestamp, to_jsonb(NEW));
 
+        -- уведомление доставляется после commit, будит ожидающих GET /changes
+        perform pg_notify('log_changes', log_table);
         return NEW;
 
     elsif (TG_OP = 'UPDATE') then
         record_id := (to_jsonb(NEW)->>pk_name)::int;
 
         insert into logs(table_name, record_id, action, action_date, old_data, new_data)
-        values (TG_TABLE_NAME, record_id, 'UPDATE', current_timestamp, to_jsonb(OLD), to_jsonb(NEW));
+        values (log_table, record_id, 'UPDATE', current_timestamp, to_jsonb(OLD), to_jsonb(NEW));
 
+        perform pg_notify('log_changes', log_table);
         return NEW;
 
     elsif (TG_OP = 'DELETE') then
         record_id := (to_jsonb(OLD)->>pk_name)::int;
 
         insert into logs(table_name, record_id, action, action_date, old_data)
-        values (TG_TABLE_NAME, record_id, 'DELETE', current_timestamp, to_jsonb(OLD));
+        values (log_table, record_id, 'DELETE', current_timestamp, to_jsonb(OLD));
 
+        perform pg_notify('log_changes', log_table);
         return OLD;
     end if;
 
     return null;
 end;
+-- logs доступна ролям приложения только для чтения, запись - с правами владельца
+$$ language plpgsql security definer set search_path = public;
+
+
+-- запрет изменений операций в закрытых периодах (перенос в архив отключает триггер)
+create or replace function reject_closed_period_changes()
+returns trigger as $$
+declare
+    closed date := (select max(period_end) from closed_periods);
+begin
+    if closed is null then
+        return coalesce(NEW, OLD);
+    end if;
+    if (TG_OP <> 'INSERT' and OLD.transaction_date <= closed)
+        or (TG_OP <> 'DELETE' and NEW.transaction_date <= closed) then
+        raise exception 'period is closed through %', closed using errcode = 'check_violation';
+    end if;
+    return coalesce(NEW, OLD);
+end;
 $$ language plpgsql;
 
+-- Переносит операции с датой в (p_after, p_to] в архивные таблицы.
+-- p_after NULL - с начала учета. Возвращает число перенесенных строк.
+create or replace function archive_transactions(p_after date, p_to date)
+returns int as $$
+declare
+    moved int;
+    moved_ba int;
+begin
+    -- Перенос не изменяет учет: запрет изменений в закрытых периодах и аудит
+    -- на время переноса отключаются. ALTER TABLE держит блокировку до конца
+    -- транзакции, поэтому другие сессии отключенных триггеров не видят, а
+    -- роли приложения (не владельцы таблиц) отключить их сами не могут.
+    alter table transactions
+        disable trigger transactions_closed_period_trigger,
+        disable trigger transactions_audit_trigger;
+    alter table transactions_b_a
+        disable trigger transactions_b_a_closed_period_trigger,
+        disable trigger transactions_b_a_audit_trigger;
+    with rows as (
+        delete from transactions
+        where transaction_date > coalesce(p_after, '-infinity'::date) and transaction_date <= p_to
+        returning *
+    )
+    insert into transactions_archive select * from rows;
+    get diagnostics moved = row_count;
+    with rows as (
+        delete from transactions_b_a
+        where transaction_date > coalesce(p_after, '-infinity'::date) and transaction_date <= p_to
+        returning *
+    )
+    insert into transactions_b_a_archive select * from rows;
+    get diagnostics moved_ba = row_count;
+    alter table transactions
+        enable trigger transactions_closed_period_trigger,
+        enable trigger transactions_audit_trigger;
+    alter table transactions_b_a
+        enable trigger transactions_b_a_closed_period_trigger,
+        enable trigger transactions_b_a_audit_trigger;
+    return moved + moved_ba;
+end;
+$$ language plpgsql security definer set search_path = public;
+
 
 --triggers
+create trigger transactions_closed_period_trigger
+before insert or update or delete on transactions
+for each row execute function reject_closed_period_changes();
+
+create trigger transactions_b_a_closed_period_trigger
+before insert or update or delete on transactions_b_a
+for each row execute function reject_closed_period_changes();
+
+create trigger closed_periods_audit_trigger
+after insert or update or delete on closed_periods
+for each row execute function log_trg_func('id');
+
 create trigger accounts_audit_trigger
 after insert or update or delete on accounts
 for each row execute function log_trg_func('id');
@@ -128,7 +412,7 @@ for each row execute function log_trg_func('id');
 
 create trigger transactions_audit_trigger
 after insert or update or delete on transactions
-for each row execute function log_trg_func('id');
+for each row execute function log_trg_func('id', 'transactions');
 
 create trigger budgets_audit_trigger
 after insert or update or delete on budgets
@@ -136,141 +420,11 @@ for each row execute function log_trg_func('id');
 
 create trigger transactions_b_a_audit_trigger
 after insert or update or delete on transactions_b_a
-for each row execute function log_trg_func('id');
-
-
---roles
-drop role if exists db_admin;
-drop role if exists app_user;
-drop role if exists audit_user;
-
-create role db_admin with login password '123' createdb;
-create role app_user with login password '123';
-create role audit_user with login password '123';
-
-grant all privileges on database finance_db to db_admin;
+for each row execute function log_trg_func('id', 'transactions_b_a');
 
-grant usage on schema public to app_user, audit_user;
-grant usage on type type_of_p to app_user;
-grant usage on type type_of_c to app_user;
-grant usage, select on all sequences in schema public to app_user;
-grant select, insert, update, delete on users to app_user;
-grant select, insert, update, delete on accounts to app_user;
-grant select, insert, update, delete on categories to app_user;
-grant select, insert, update, delete on transactions to app_user;
-grant select, insert, update, delete on transactions_b_a to app_user;
-grant select, insert, update, delete on budgets to app_user;
-grant select on logs to app_user, audit_user;
-grant execute on function get_user_total_balance(int) to app_user;
-grant execute on function get_category_transactions_sum(int, date, date) to app_user;
-grant execute on procedure add_transaction(int, int, decimal, text, date) to app_user;
-grant execute on procedure transfer_between_accounts(int, int, decimal, text, date) to app_user;
-grant select on user_accounts_summary to app_user, audit_user;
-grant select on category_transactions_report to app_user, audit_user;
-
-alter default privileges in schema public grant usage, select on sequences to app_user;
-alter default privileges in schema public grant select, insert, update, delete on tables to app_user;
-alter default privileges in schema public grant select on tables to audit_user;
-alter default privileges in schema public grant usage on types to app_user;
-
-
---data
-
-insert into users (username, email, password_hash, created_at) VALUES
-('ivanov', 'ivanov@example.com', '$2a$10$N9qo8uLOickgx2ZMRZoMyeIjZAgcfl7p92ldGxad68LJZdL17lhWy', '2024-01-15 10:30:00'),
-('petrov', 'petrov@example.com', '$2a$10$N9qo8uLOickgx2ZMRZoMyeIjZAgcfl7p92ldGxad68LJZdL17lhWy', '2024-01-20 14:15:00'),
-('sidorov', 'sidorov@example.com', '$2a$10$N9qo8uLOickgx2ZMRZoMyeIjZAgcfl7p92ldGxad68LJZdL17lhWy', '2024-02-01 09:00:00'),
-('smirnov', 'smirnov@example.com', '$2a$10$N9qo8uLOickgx2ZMRZoMyeIjZAgcfl7p92ldGxad68LJZdL17lhWy', '2024-02-10 16:45:00'),
-('kozlov', 'kozlov@example.com', '$2a$10$N9qo8uLOickgx2ZMRZoMyeIjZAgcfl7p92ldGxad68LJZdL17lhWy', '2024-02-15 11:20:00');
-
-insert into accounts (user_id, name, type, balance, created_at) VALUES
-(1, 'Основной кошелек', 'cash', 15000.00, '2024-01-15 10:35:00'),
-(1, 'Банковская карта', 'card', 50000.00, '2024-01-15 10:36:00'),
-(1, 'Депозитный счет', 'deposit', 100000.00, '2024-01-15 10:37:00'),
-(2, 'Наличные', 'cash', 8000.00, '2024-01-20 14:20:00'),
-(2, 'Кредитная карта', 'card', 25000.00, '2024-01-20 14:21:00'),
-(3, 'Кошелек', 'cash', 12000.00, '2024-02-01 09:05:00'),
-(3, 'Дебетовая карта', 'card', 35000.00, '2024-02-01 09:06:00'),
-(4, 'Наличка', 'cash', 5000.00, '2024-02-10 16:50:00'),
-(4, 'Карта зарплатная', 'card', 60000.00, '2024-02-10 16:51:00'),
-(5, 'Деньги дома', 'cash', 3000.00, '2024-02-15 11:25:00'),
-(5, 'Основная карта', 'card', 40000.00, '2024-02-15 11:26:00'),
-(5, 'Накопительный счет', 'deposit', 200000.00, '2024-02-15 11:27:00');
-
-insert into categories (user_id, name, type) VALUES
-(1, 'Зарплата', 'income'),
-(1, 'Премия', 'income'),
-(1, 'Подарки', 'income'),
-(1, 'Продукты', 'expense'),
-(1, 'Транспорт', 'expense'),
-(1, 'Развлечения', 'expense'),
-(1, 'Коммунальные услуги', 'expense'),
-(2, 'Зарплата', 'income'),
-(2, 'Подработка', 'income'),
-(2, 'Еда', 'expense'),
-(2, 'Одежда', 'expense'),
-(2, 'Медицина', 'expense'),
-(3, 'Доход от бизнеса', 'income'),
-(3, 'Инвестиции', 'income'),
-(3, 'Рестораны', 'expense'),
-(3, 'Путешествия', 'expense'),
-(4, 'Зарплата', 'income'),
-(4, 'Аренда', 'expense'),
-(4, 'Интернет и связь', 'expense'),
-(5, 'Зарплата', 'income'),
-(5, 'Дивиденды', 'income'),
-(5, 'Образование', 'expense'),
-(5, 'Спорт', 'expense');
-
-insert into transactions (account_id, category_id, amount, description, transaction_date) VALUES
-(1, 1, 50000.00, 'Зарплата за январь', '2024-01-31'),
-(1, 4, 3500.00, 'Покупка продуктов в супермаркете', '2024-02-05'),
-(2, 1, 50000.00, 'Зарплата на карту', '2024-01-31'),
-(2, 5, 1200.00, 'Проездной на месяц', '2024-02-01'),
-(2, 6, 2500.00, 'Поход в кино', '2024-02-10'),
-(2, 7, 3500.00, 'Оплата коммунальных услуг', '2024-02-15'),
-(4, 8, 45000.00, 'Зарплата', '2024-01-31'),
-(4, 10, 2800.00, 'Обед в кафе', '2024-02-08'),
-(5, 8, 45000.00, 'Зарплата', '2024-01-31'),
-(5, 11, 5000.00, 'Покупка куртки', '2024-02-12'),
-(6, 13, 80000.00, 'Доход от продажи', '2024-02-05'),
-(6, 15, 4500.00, 'Ужин в ресторане', '2024-02-14'),
-(7, 13, 80000.00, 'Доход от бизнеса', '2024-02-05'),
-(7, 16, 15000.00, 'Билеты на отпуск', '2024-02-20'),
-(8, 17, 55000.00, 'Зарплата', '2024-01-31'),
-(8, 18, 20000.00, 'Аренда квартиры', '2024-02-01'),
-(9, 17, 55000.00, 'Зарплата', '2024-01-31'),
-(9, 19, 1500.00, 'Оплата интернета и мобильной связи', '2024-02-05'),
-(10, 20, 60000.00, 'Зарплата', '2024-01-31'),
-(10, 21, 5000.00, 'Дивиденды по акциям', '2024-02-10'),
-(11, 20, 60000.00, 'Зарплата', '2024-01-31'),
-(11, 22, 8000.00, 'Оплата курсов', '2024-02-15'),
-(12, 20, 60000.00, 'Зарплата', '2024-01-31'),
-(12, 23, 3000.00, 'Абонемент в спортзал', '2024-02-01');
-
-insert into transactions_b_a (account_id_from, account_id_to, amount, description, transaction_date) VALUES
-(1, 2, 10000.00, 'Перевод с кошелька на карту', '2024-02-01'),
-(2, 3, 20000.00, 'Пополнение депозита', '2024-02-05'),
-(4, 5, 5000.00, 'Перевод между счетами', '2024-02-10'),
-(6, 7, 15000.00, 'Перевод на карту', '2024-02-08'),
-(8, 9, 10000.00, 'Перевод с наличных на карту', '2024-02-12'),
-(10, 11, 8000.00, 'Перевод между картами', '2024-02-15'),
-(10, 12, 50000.00, 'Пополнение накопительного счета', '2024-02-20');
-
-insert into budgets (user_id, category_id, amount_limit, period_start, period_end) VALUES
-(1, 4, 10000.00, '2024-02-01', '2024-02-29'),
-(1, 5, 5000.00, '2024-02-01', '2024-02-29'),
-(1, 6, 8000.00, '2024-02-01', '2024-02-29'),
-(1, 7, 5000.00, '2024-02-01', '2024-02-29'),
-(2, 10, 8000.00, '2024-02-01', '2024-02-29'),
-(2, 11, 10000.00, '2024-02-01', '2024-02-29'),
-(2, 12, 5000.00, '2024-02-01', '2024-02-29'),
-(3, 15, 12000.00, '2024-02-01', '2024-02-29'),
-(3, 16, 30000.00, '2024-02-01', '2024-02-29'),
-(4, 18, 20000.00, '2024-02-01', '2024-02-29'),
-(4, 19, 2000.00, '2024-02-01', '2024-02-29'),
-(5, 22, 10000.00, '2024-02-01', '2024-02-29'),
-(5, 23, 5000.00, '2024-02-01', '2024-02-29');
+create trigger recurring_rules_audit_trigger
+after insert or update or delete on recurring_rules
+for each row execute function log_trg_func('id');
 
 
 --functions
@@ -303,20 +457,6 @@ begin
 end;
 $$ language plpgsql;
 
---queries with functions
-select 
-    u.username,
-    get_user_total_balance(u.id) as total_balance
-from users u
-where u.id = 1;
-
-select 
-    c.name as category_name,
-    get_category_transactions_sum(c.id, '2024-02-01', '2024-02-29') as total_sum
-from categories c
-where c.id = 4;
-
-
 --procedure
 create or replace procedure add_transaction(
     p_account_id int,
@@ -391,25 +531,34 @@ $$;
 
 
 
-create or replace view user_accounts_summary as
+-- материализованные представления: читаются API (/summaries) без полного join
+-- на каждый запрос, обновляются функцией refresh_report_views()
+drop materialized view if exists user_accounts_summary;
+drop materialized view if exists category_transactions_report;
+
+create materialized view user_accounts_summary as
 select 
     u.id as user_id,
     u.username,
     u.email,
+    a.currency,
     count(a.id) as total_accounts,
     coalesce(sum(a.balance), 0.00) as total_balance,
     min(a.created_at) as first_account_created
 from users u
 left join accounts a on u.id = a.user_id
-group by u.id, u.username, u.email;
+group by u.id, u.username, u.email, a.currency;
 
-create or replace view category_transactions_report as
+create unique index idx_user_accounts_summary_key on user_accounts_summary (user_id, currency);
+
+create materialized view category_transactions_report as
 select 
     c.id as category_id,
     c.name as category_name,
     c.type as category_type,
     u.id as user_id,
     u.username,
+    t.currency,
     count(t.id) as transaction_count,
     coalesce(sum(t.amount), 0.00) as total_amount,
     coalesce(avg(t.amount), 0.00) as average_amount,
@@ -418,7 +567,74 @@ select
 from categories c
 join users u on c.user_id = u.id
 left join transactions t on c.id = t.category_id
-group by c.id, c.name, c.type, u.id, u.username;
+group by c.id, c.name, c.type, u.id, u.username, t.currency;
+
+create unique index idx_category_transactions_report_key on category_transactions_report (category_id, currency);
+create index idx_category_transactions_report_user on category_transactions_report (user_id);
 
+-- обновление без блокировки чтения; выполняется с правами владельца,
+-- одновременно работает только одно обновление
+create or replace function refresh_report_views()
+returns boolean as $$
+begin
+    if not pg_try_advisory_xact_lock(hashtext('refresh_report_views')) then
+        return false;
+    end if;
+    refresh materialized view concurrently user_accounts_summary;
+    refresh materialized view concurrently category_transactions_report;
+    return true;
+end;
+$$ language plpgsql security definer set search_path = public;
 
 
+--roles
+-- роли общие для всего сервера: создаются при первом выполнении скрипта,
+-- в следующих базах (шарды, копии для проверок) только выдаются права
+do $$
+begin
+    if not exists (select 1 from pg_roles where rolname = 'db_admin') then
+        create role db_admin with login password '123' createdb;
+    end if;
+    if not exists (select 1 from pg_roles where rolname = 'app_user') then
+        create role app_user with login password '123';
+    end if;
+    if not exists (select 1 from pg_roles where rolname = 'audit_user') then
+        create role audit_user with login password '123';
+    end if;
+    execute format('grant all privileges on database %I to db_admin', current_database());
+end;
+$$;
+
+grant usage on schema public to app_user, audit_user;
+grant usage on type type_of_p to app_user;
+grant usage on type type_of_c to app_user;
+grant usage, select on all sequences in schema public to app_user;
+grant select, insert, update, delete on users to app_user;
+grant select, insert, update, delete on accounts to app_user;
+grant select, insert, update, delete on categories to app_user;
+grant select, insert, update, delete on transactions to app_user;
+grant select, insert, update, delete on transactions_b_a to app_user;
+grant select, insert, update, delete on budgets to app_user;
+grant select, insert, update, delete on recurring_rules to app_user;
+grant select on logs to app_user, audit_user;
+grant select, insert, update, delete on idempotency_keys to app_user;
+grant select, insert, update, delete on rate_limit_buckets to app_user;
+grant execute on function ensure_transaction_partitions(int) to app_user;
+grant select, insert, update, delete on closed_periods to app_user;
+grant select, insert, update, delete on period_account_balances to app_user;
+grant select, insert, update, delete on period_category_totals to app_user;
+grant select on transactions_archive to app_user;
+grant select on transactions_b_a_archive to app_user;
+grant execute on function archive_transactions(date, date) to app_user;
+grant execute on function get_user_total_balance(int) to app_user;
+grant execute on function get_category_transactions_sum(int, date, date) to app_user;
+grant execute on procedure add_transaction(int, int, decimal, text, date) to app_user;
+grant execute on procedure transfer_between_accounts(int, int, decimal, text, date) to app_user;
+grant select on user_accounts_summary to app_user, audit_user;
+grant select on category_transactions_report to app_user, audit_user;
+grant execute on function refresh_report_views() to app_user;
+
+alter default privileges in schema public grant usage, select on sequences to app_user;
+alter default privileges in schema public grant select, insert, update, delete on tables to app_user;
+alter default privileges in schema public grant select on tables to audit_user;
+alter default privileges in schema public grant usage on types to app_user;
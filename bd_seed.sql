@@ -0,0 +1,122 @@
+-- Тестовые данные для одиночной базы: выполняется после bd.sql.
+-- id заданы последовательностями с 1, поэтому в шарды (configure_shard_sequences)
+-- не загружается - шард записи определяется по id.
+do $$
+begin
+    if exists (select 1 from pg_sequences where schemaname = 'public' and increment_by <> 1) then
+        raise exception 'bd_seed.sql: база настроена как шард, тестовые данные не загружаются';
+    end if;
+end;
+$$;
+
+--data
+
+insert into users (username, email, password_hash, created_at) VALUES
+('ivanov', 'ivanov@example.com', '$2a$10$N9qo8uLOickgx2ZMRZoMyeIjZAgcfl7p92ldGxad68LJZdL17lhWy', '2024-01-15 10:30:00'),
+('petrov', 'petrov@example.com', '$2a$10$N9qo8uLOickgx2ZMRZoMyeIjZAgcfl7p92ldGxad68LJZdL17lhWy', '2024-01-20 14:15:00'),
+('sidorov', 'sidorov@example.com', '$2a$10$N9qo8uLOickgx2ZMRZoMyeIjZAgcfl7p92ldGxad68LJZdL17lhWy', '2024-02-01 09:00:00'),
+('smirnov', 'smirnov@example.com', '$2a$10$N9qo8uLOickgx2ZMRZoMyeIjZAgcfl7p92ldGxad68LJZdL17lhWy', '2024-02-10 16:45:00'),
+('kozlov', 'kozlov@example.com', '$2a$10$N9qo8uLOickgx2ZMRZoMyeIjZAgcfl7p92ldGxad68LJZdL17lhWy', '2024-02-15 11:20:00');
+
+insert into accounts (user_id, name, type, balance, created_at) VALUES
+(1, 'Основной кошелек', 'cash', 15000.00, '2024-01-15 10:35:00'),
+(1, 'Банковская карта', 'card', 50000.00, '2024-01-15 10:36:00'),
+(1, 'Депозитный счет', 'deposit', 100000.00, '2024-01-15 10:37:00'),
+(2, 'Наличные', 'cash', 8000.00, '2024-01-20 14:20:00'),
+(2, 'Кредитная карта', 'card', 25000.00, '2024-01-20 14:21:00'),
+(3, 'Кошелек', 'cash', 12000.00, '2024-02-01 09:05:00'),
+(3, 'Дебетовая карта', 'card', 35000.00, '2024-02-01 09:06:00'),
+(4, 'Наличка', 'cash', 5000.00, '2024-02-10 16:50:00'),
+(4, 'Карта зарплатная', 'card', 60000.00, '2024-02-10 16:51:00'),
+(5, 'Деньги дома', 'cash', 3000.00, '2024-02-15 11:25:00'),
+(5, 'Основная карта', 'card', 40000.00, '2024-02-15 11:26:00'),
+(5, 'Накопительный счет', 'deposit', 200000.00, '2024-02-15 11:27:00');
+
+insert into categories (user_id, name, type) VALUES
+(1, 'Зарплата', 'income'),
+(1, 'Премия', 'income'),
+(1, 'Подарки', 'income'),
+(1, 'Продукты', 'expense'),
+(1, 'Транспорт', 'expense'),
+(1, 'Развлечения', 'expense'),
+(1, 'Коммунальные услуги', 'expense'),
+(2, 'Зарплата', 'income'),
+(2, 'Подработка', 'income'),
+(2, 'Еда', 'expense'),
+(2, 'Одежда', 'expense'),
+(2, 'Медицина', 'expense'),
+(3, 'Доход от бизнеса', 'income'),
+(3, 'Инвестиции', 'income'),
+(3, 'Рестораны', 'expense'),
+(3, 'Путешествия', 'expense'),
+(4, 'Зарплата', 'income'),
+(4, 'Аренда', 'expense'),
+(4, 'Интернет и связь', 'expense'),
+(5, 'Зарплата', 'income'),
+(5, 'Дивиденды', 'income'),
+(5, 'Образование', 'expense'),
+(5, 'Спорт', 'expense');
+
+insert into transactions (account_id, category_id, amount, description, transaction_date) VALUES
+(1, 1, 50000.00, 'Зарплата за январь', '2024-01-31'),
+(1, 4, 3500.00, 'Покупка продуктов в супермаркете', '2024-02-05'),
+(2, 1, 50000.00, 'Зарплата на карту', '2024-01-31'),
+(2, 5, 1200.00, 'Проездной на месяц', '2024-02-01'),
+(2, 6, 2500.00, 'Поход в кино', '2024-02-10'),
+(2, 7, 3500.00, 'Оплата коммунальных услуг', '2024-02-15'),
+(4, 8, 45000.00, 'Зарплата', '2024-01-31'),
+(4, 10, 2800.00, 'Обед в кафе', '2024-02-08'),
+(5, 8, 45000.00, 'Зарплата', '2024-01-31'),
+(5, 11, 5000.00, 'Покупка куртки', '2024-02-12'),
+(6, 13, 80000.00, 'Доход от продажи', '2024-02-05'),
+(6, 15, 4500.00, 'Ужин в ресторане', '2024-02-14'),
+(7, 13, 80000.00, 'Доход от бизнеса', '2024-02-05'),
+(7, 16, 15000.00, 'Билеты на отпуск', '2024-02-20'),
+(8, 17, 55000.00, 'Зарплата', '2024-01-31'),
+(8, 18, 20000.00, 'Аренда квартиры', '2024-02-01'),
+(9, 17, 55000.00, 'Зарплата', '2024-01-31'),
+(9, 19, 1500.00, 'Оплата интернета и мобильной связи', '2024-02-05'),
+(10, 20, 60000.00, 'Зарплата', '2024-01-31'),
+(10, 21, 5000.00, 'Дивиденды по акциям', '2024-02-10'),
+(11, 20, 60000.00, 'Зарплата', '2024-01-31'),
+(11, 22, 8000.00, 'Оплата курсов', '2024-02-15'),
+(12, 20, 60000.00, 'Зарплата', '2024-01-31'),
+(12, 23, 3000.00, 'Абонемент в спортзал', '2024-02-01');
+
+insert into transactions_b_a (account_id_from, account_id_to, amount, description, transaction_date) VALUES
+(1, 2, 10000.00, 'Перевод с кошелька на карту', '2024-02-01'),
+(2, 3, 20000.00, 'Пополнение депозита', '2024-02-05'),
+(4, 5, 5000.00, 'Перевод между счетами', '2024-02-10'),
+(6, 7, 15000.00, 'Перевод на карту', '2024-02-08'),
+(8, 9, 10000.00, 'Перевод с наличных на карту', '2024-02-12'),
+(10, 11, 8000.00, 'Перевод между картами', '2024-02-15'),
+(10, 12, 50000.00, 'Пополнение накопительного счета', '2024-02-20');
+
+insert into budgets (user_id, category_id, amount_limit, period_start, period_end) VALUES
+(1, 4, 10000.00, '2024-02-01', '2024-02-29'),
+(1, 5, 5000.00, '2024-02-01', '2024-02-29'),
+(1, 6, 8000.00, '2024-02-01', '2024-02-29'),
+(1, 7, 5000.00, '2024-02-01', '2024-02-29'),
+(2, 10, 8000.00, '2024-02-01', '2024-02-29'),
+(2, 11, 10000.00, '2024-02-01', '2024-02-29'),
+(2, 12, 5000.00, '2024-02-01', '2024-02-29'),
+(3, 15, 12000.00, '2024-02-01', '2024-02-29'),
+(3, 16, 30000.00, '2024-02-01', '2024-02-29'),
+(4, 18, 20000.00, '2024-02-01', '2024-02-29'),
+(4, 19, 2000.00, '2024-02-01', '2024-02-29'),
+(5, 22, 10000.00, '2024-02-01', '2024-02-29'),
+(5, 23, 5000.00, '2024-02-01', '2024-02-29');
+
+
+--queries with functions
+select 
+    u.username,
+    get_user_total_balance(u.id) as total_balance
+from users u
+where u.id = 1;
+
+select 
+    c.name as category_name,
+    get_category_transactions_sum(c.id, '2024-02-01', '2024-02-29') as total_sum
+from categories c
+where c.id = 4;
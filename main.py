@@ -1,21 +1,61 @@
-from fastapi import FastAPI, HTTPException as FastAPIHTTPException
+import asyncio
+import math
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException as FastAPIHTTPException
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from starlette.requests import Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import FileResponse
 import os
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
-from app.database import SessionLocal
 
-from app.database import engine, Base
-from app.routers import users, accounts, categories, transactions, budgets, reports, logs
-
-# Создание таблиц
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="Finance Management System")
+from sqlalchemy.orm import Session
+
+from config import settings
+from app.database import get_db, get_engine, dispose_engines, create_schema, mark_primary_sticky
+from app.auth import require_permission
+from app.ratelimit import admission, RateLimited
+from app.server import worker_stats, run_production
+from app.scheduler import run_periodically
+from app.matviews import matview_refresher
+from app.partitions import maintain_partitions
+from app.changes import change_notifier
+from app.routers import users, accounts, categories, transactions, budgets, reports, logs, recurring, summaries, changes, periods
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Движок создается здесь, а не при импорте; к БД при этом не подключаемся
+    get_engine()
+    if settings.DB_AUTO_CREATE:
+        create_schema()
+    worker_stats.start()
+    change_notifier.start()
+    recurring_task = None
+    if settings.RECURRING_INTERVAL_SECONDS > 0:
+        recurring_task = asyncio.create_task(
+            run_periodically(settings.RECURRING_INTERVAL_SECONDS))
+    matview_task = None
+    if settings.MATVIEW_REFRESH_INTERVAL > 0:
+        matview_task = asyncio.create_task(matview_refresher.run_periodically(
+            settings.MATVIEW_REFRESH_INTERVAL, settings.MATVIEW_MAX_STALENESS))
+    partition_task = None
+    if settings.PARTITION_CHECK_INTERVAL > 0:
+        partition_task = asyncio.create_task(maintain_partitions(
+            settings.PARTITION_CHECK_INTERVAL, settings.PARTITION_MONTHS_AHEAD))
+    yield
+    # сюда попадаем после того, как uvicorn дождался текущих запросов
+    for task in (recurring_task, matview_task, partition_task):
+        if task:
+            task.cancel()
+    change_notifier.stop()
+    await worker_stats.stop()
+    admission.dispose()
+    dispose_engines()
+
+
+app = FastAPI(title="Finance Management System", lifespan=lifespan)
 
 # CORS for frontend requests (development)
 app.add_middleware(
@@ -26,6 +66,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def worker_stats_middleware(request: Request, call_next):
+    worker_stats.requests += 1
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def read_your_writes_middleware(request: Request, call_next):
+    # после успешного изменения клиент какое-то время читает с основной БД
+    response = await call_next(request)
+    if request.method in ("POST", "PUT", "PATCH", "DELETE") and response.status_code < 400:
+        mark_primary_sticky(response)
+        # данные изменились - сводные представления пора обновить
+        matview_refresher.mark_dirty()
+    return response
+
+
+@app.middleware("http")
+async def admission_middleware(request: Request, call_next):
+    # лимиты проверяются до того, как запрос займет соединение из пула
+    route = admission.route_key(request) if admission.enabled else None
+    if route is None:
+        return await call_next(request)
+    try:
+        bucket = await admission.acquire(await admission.role(), route)
+    except RateLimited as exc:
+        return JSONResponse(
+            status_code=429,
+            content={"message": exc.reason},
+            headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+        )
+    try:
+        return await call_next(request)
+    finally:
+        admission.release(bucket)
+
+
 # Подключение статических файлов
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -37,6 +115,10 @@ app.include_router(transactions.router)
 app.include_router(budgets.router)
 app.include_router(reports.router)
 app.include_router(logs.router)
+app.include_router(recurring.router)
+app.include_router(summaries.router)
+app.include_router(changes.router)
+app.include_router(periods.router)
 
 
 @app.exception_handler(RequestValidationError)
@@ -57,28 +139,37 @@ async def general_exception_handler(request: Request, exc: Exception):
 
 @app.exception_handler(FastAPIHTTPException)
 async def http_exception_handler(request: Request, exc: FastAPIHTTPException):
-    if exc.status_code == 403:
-        try:
-            from app.auth import get_current_db_role
-            db = SessionLocal()
-            role = get_current_db_role(db)
-            db.close()
-        except:
-            pass
-
+    # роль для 403 уже указана в exc.detail (см. require_permission)
     return JSONResponse(
         status_code=exc.status_code,
         content={"message": exc.detail},
     )
 
 
-@app.get("/", response_class=HTMLResponse)
+@app.get("/limits")
+async def get_limits_stats(request: Request, db: Session = Depends(get_db)):
+    """Счетчики ограничения запросов этого процесса по корзинам (роль:маршрут)."""
+    require_permission(db, request, "logs", "view")
+    return admission.stats()
+
+
+@app.get("/", response_class=FileResponse)
 async def read_root():
-    import os
-    html_path = os.path.join("static", "index.html")
-    with open(html_path, "r", encoding="utf-8") as f:
-        return HTMLResponse(content=f.read())
+    return FileResponse(os.path.join("static", "index.html"), media_type="text/html")
+
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+    parser = argparse.ArgumentParser(description="Finance Management System")
+    parser.add_argument("--prod", action="store_true",
+                        help="несколько процессов-воркеров с плавной остановкой")
+    parser.add_argument("--workers", type=int,
+                        default=int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1))),
+                        help="число воркеров для --prod (по умолчанию WEB_WORKERS или число ядер)")
+    args = parser.parse_args()
+    if args.prod:
+        run_production(args.workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
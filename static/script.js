@@ -358,7 +358,7 @@ function displayAccounts(accounts) {
         accountDiv.innerHTML = `
             <h4>${account.name}</h4>
             <p><strong>Тип:</strong> ${account.type}</p>
-            <p><strong>Баланс:</strong> ${account.balance} ₽</p>
+            <p><strong>Баланс:</strong> ${account.balance} ${account.currency || '₽'}</p>
             <p><strong>Пользователь:</strong> ${getUserName(account.user_id)}</p>
             <p><strong>ID:</strong> ${getEntityId(account)}</p>
             <div class="actions">
@@ -1119,7 +1119,7 @@ function displayCategoryReport(report) {
                 </div>
                 <div class="stat">
                     <div class="label">Общая сумма</div>
-                    <div class="value">${item.total_amount.toFixed(2)} ₽</div>
+                    <div class="value">${Number(item.total_amount).toFixed(2)} ₽</div>
                 </div>
             </div>
         `;
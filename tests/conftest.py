@@ -0,0 +1,229 @@
+"""
+Базы для проверок API. Схема (bd.sql и bd_seed.sql) строится один раз в
+базу-шаблон на сервере TEST_DATABASE_URL (роль с правом CREATE DATABASE);
+имя шаблона включает хэш скриптов, поэтому после их изменения шаблон
+пересобирается сам. Каждый процесс pytest-xdist получает свою копию
+шаблона, а каждая проверка по умолчанию работает внутри транзакции,
+которая откатывается в конце (коммиты маршрутов - точки сохранения).
+Для кода, который открывает собственные сессии (scatter_gather,
+фоновые задачи, импорт), есть fresh_database - отдельная копия на проверку,
+а для шардирования - shard_databases: два шарда из шаблона только с bd.sql.
+"""
+import hashlib
+import os
+import uuid
+from pathlib import Path
+
+import psycopg2
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from config import settings
+from app.analytics import analytics_cache
+from app.database import dispose_engines, get_db, get_read_db
+from app.refcache import reference_cache
+
+ROOT = Path(__file__).resolve().parent.parent
+SCHEMA_SCRIPTS = ("bd.sql", "bd_seed.sql")
+# шарды строятся без тестовых данных (их id не из шарда)
+SHARD_SCRIPTS = ("bd.sql",)
+TEMPLATE_PREFIX = "finance_test_template_"
+# ключ pg_advisory_lock: сборка шаблона и копирование идут по одному
+TEMPLATE_LOCK_ID = 4050
+
+ADMIN_URL = make_url(os.getenv(
+    "TEST_DATABASE_URL", "postgresql://postgres@localhost/postgres")).set(drivername="postgresql")
+
+
+def _dsn(database: str, username: str = None, password: str = None) -> str:
+    url = ADMIN_URL.set(database=database)
+    if username:
+        url = url.set(username=username, password=password)
+    return url.render_as_string(hide_password=False)
+
+
+def _admin_connection():
+    conn = psycopg2.connect(_dsn(ADMIN_URL.database))
+    conn.autocommit = True
+    return conn
+
+
+def _template_name(scripts) -> str:
+    digest = hashlib.sha1()
+    for script in scripts:
+        digest.update(script.encode() + (ROOT / script).read_bytes())
+    return TEMPLATE_PREFIX + digest.hexdigest()[:12]
+
+
+def _drop_database(cur, name: str):
+    cur.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+
+
+def _ensure_template(cur, scripts) -> str:
+    """Шаблон из текущих scripts; шаблоны прежних версий скриптов удаляются."""
+    template = _template_name(scripts)
+    cur.execute("SELECT datname FROM pg_database WHERE datname LIKE %s", (TEMPLATE_PREFIX + "%",))
+    existing = {row[0] for row in cur.fetchall()}
+    for stale in existing - {_template_name(SCHEMA_SCRIPTS), _template_name(SHARD_SCRIPTS)}:
+        cur.execute(f'ALTER DATABASE "{stale}" IS_TEMPLATE false')
+        _drop_database(cur, stale)
+    if template in existing:
+        return template
+    # собираем под временным именем: прерванная сборка не станет шаблоном
+    building = template + "_build"
+    _drop_database(cur, building)
+    cur.execute(f'CREATE DATABASE "{building}"')
+    conn = psycopg2.connect(_dsn(building))
+    try:
+        with conn, conn.cursor() as script_cur:
+            for script in scripts:
+                script_cur.execute((ROOT / script).read_text(encoding="utf-8"))
+    finally:
+        conn.close()
+    cur.execute(f'ALTER DATABASE "{building}" RENAME TO "{template}"')
+    cur.execute(f'ALTER DATABASE "{template}" IS_TEMPLATE true')
+    return template
+
+
+def _clone_database(name: str, scripts=SCHEMA_SCRIPTS):
+    conn = _admin_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (TEMPLATE_LOCK_ID,))
+            try:
+                template = _ensure_template(cur, scripts)
+                _drop_database(cur, name)
+                cur.execute(f'CREATE DATABASE "{name}" TEMPLATE "{template}"')
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (TEMPLATE_LOCK_ID,))
+    finally:
+        conn.close()
+
+
+def _remove_database(name: str):
+    conn = _admin_connection()
+    try:
+        with conn.cursor() as cur:
+            _drop_database(cur, name)
+    finally:
+        conn.close()
+
+
+def _app_url(name: str) -> str:
+    """URL базы name для приложения (роль app_user из bd.sql)."""
+    return make_url(_dsn(name, "app_user", "123")).set(
+        drivername="postgresql+psycopg2").render_as_string(hide_password=False)
+
+
+def _use_database(name: str, shards=()) -> str:
+    """Приложение работает с базой name, а если заданы shards - с этими шардами."""
+    dispose_engines()
+    settings.DATABASE_URL = _app_url(name)
+    settings.DATABASE_SHARD_URLS = [_app_url(shard) for shard in shards]
+    settings.DATABASE_READ_URL = None
+    reference_cache.clear()
+    analytics_cache.clear()
+    return settings.DATABASE_URL
+
+
+@pytest.fixture(scope="session")
+def worker_database():
+    """Копия шаблона для процесса pytest (у каждого воркера xdist своя)."""
+    try:
+        _admin_connection().close()
+    except psycopg2.OperationalError as exc:
+        pytest.skip(f"PostgreSQL из TEST_DATABASE_URL недоступен: {exc}")
+    name = "finance_test_" + os.getenv("PYTEST_XDIST_WORKER", "main")
+    _clone_database(name)
+    saved = (settings.DATABASE_URL, settings.DATABASE_SHARD_URLS, settings.DATABASE_READ_URL)
+    url = _use_database(name)
+    yield url
+    dispose_engines()
+    settings.DATABASE_URL, settings.DATABASE_SHARD_URLS, settings.DATABASE_READ_URL = saved
+    _remove_database(name)
+
+
+@pytest.fixture(scope="session")
+def worker_engine(worker_database):
+    engine = create_engine(worker_database)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(worker_engine):
+    """
+    Сессия внутри внешней транзакции, которая откатывается после проверки;
+    commit в коде маршрутов фиксирует только точку сохранения.
+    """
+    connection = worker_engine.connect()
+    outer = connection.begin()
+    session = Session(bind=connection, autoflush=False,
+                      join_transaction_mode="create_savepoint")
+    try:
+        yield session
+    finally:
+        session.close()
+        outer.rollback()
+        connection.close()
+        # в кэшах могли остаться значения из откаченной транзакции
+        reference_cache.clear()
+        analytics_cache.clear()
+
+
+@pytest.fixture
+def client(db):
+    """Клиент API, у которого get_db и get_read_db отдают сессию db."""
+    from main import app
+
+    def override():
+        yield db
+
+    app.dependency_overrides[get_db] = override
+    app.dependency_overrides[get_read_db] = override
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def fresh_database(worker_database):
+    """
+    Отдельная копия шаблона на одну проверку - для кода, который коммитит
+    через собственные сессии. Приложение на время проверки переключается на нее.
+    """
+    name = "finance_test_" + uuid.uuid4().hex[:12]
+    _clone_database(name)
+    try:
+        yield _use_database(name)
+    finally:
+        _use_database(make_url(worker_database).database)
+        _remove_database(name)
+
+
+@pytest.fixture
+def shard_databases(worker_database):
+    """
+    Два шарда - копии шаблона без тестовых данных с настроенными
+    последовательностями; приложение на время проверки работает с ними.
+    """
+    names = [f"finance_test_{uuid.uuid4().hex[:12]}_s{i}" for i in range(2)]
+    for index, name in enumerate(names):
+        _clone_database(name, SHARD_SCRIPTS)
+        conn = psycopg2.connect(_dsn(name))
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute("SELECT configure_shard_sequences(%s, %s)", (index, len(names)))
+        finally:
+            conn.close()
+    try:
+        _use_database(names[0], shards=names)
+        yield [_app_url(name) for name in names]
+    finally:
+        _use_database(make_url(worker_database).database)
+        for name in names:
+            _remove_database(name)
@@ -0,0 +1,37 @@
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+
+def _count(url: str, sql: str) -> int:
+    engine = create_engine(url)
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text(sql)).scalar()
+    finally:
+        engine.dispose()
+
+
+def test_analytics_starts_after_archived_months(fresh_database):
+    from main import app
+
+    client = TestClient(app)
+    before = client.get("/reports/analytics", params={"user_id": 1}).json()
+    assert before["archived_through"] is None and len(before["months"]) == 12
+    # конец позапрошлого месяца
+    period_end = date.today().replace(day=1) - timedelta(days=1)
+    period_end = period_end.replace(day=1) - timedelta(days=1)
+    deletes = "SELECT count(*) FROM logs WHERE table_name = 'transactions' AND action = 'DELETE'"
+    logged = _count(fresh_database, deletes)
+    closed = client.post("/periods/close", json={"period_end": period_end.isoformat(), "archive": True})
+    assert closed.status_code == 200, closed.text
+    # перенос в архив не пишется в аудит
+    assert _count(fresh_database, deletes) == logged
+    assert _count(fresh_database, "SELECT count(*) FROM transactions_archive") > 0
+
+    after = client.get("/reports/analytics", params={"user_id": 1}).json()
+    assert after["archived_through"] == period_end.isoformat()
+    assert after["start_date"] == (period_end + timedelta(days=1)).isoformat()
+    assert [m["month"] for m in after["months"]][0] == after["start_date"]
+    assert len(after["months"]) == 2
@@ -0,0 +1,159 @@
+from decimal import Decimal
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+
+from config import settings
+from app.database import shard_for_id, shard_for_new_user
+from app.models import Account, User
+from app.refcache import reference_cache
+
+
+def test_seed_data_is_loaded(client):
+    usernames = {u["username"] for u in client.get("/users/").json()}
+    assert {"ivanov", "petrov", "sidorov", "smirnov", "kozlov"} <= usernames
+
+
+def test_created_user_is_rolled_back(client, db):
+    response = client.post("/users/", json={
+        "username": "rollback_check", "email": "rollback_check@example.com", "password": "secret"})
+    assert response.status_code == 200, response.text
+    assert db.query(User).filter(User.username == "rollback_check").count() == 1
+
+
+def test_previous_test_left_no_rows(db):
+    assert db.query(User).filter(User.username == "rollback_check").count() == 0
+
+
+def test_expense_decreases_balance(client, db):
+    before = db.query(Account.balance).filter(Account.id == 1).scalar()
+    response = client.post("/transactions/", json={
+        "account_id": 1, "category_id": 4, "amount": "150.25", "description": "test"})
+    assert response.status_code == 200, response.text
+    db.expire_all()
+    assert db.query(Account.balance).filter(Account.id == 1).scalar() == before - Decimal("150.25")
+
+
+def test_fresh_database_is_separate(fresh_database, worker_engine):
+    # без подмены get_db: запись коммитится, scatter_gather видит ее в новой копии
+    from main import app
+
+    client = TestClient(app)
+    created = client.post("/users/", json={
+        "username": "fresh_check", "email": "fresh_check@example.com", "password": "secret"})
+    assert created.status_code == 200, created.text
+    assert "fresh_check" in {u["username"] for u in client.get("/users/").json()}
+    with worker_engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM users WHERE username = 'fresh_check'")).scalar() == 0
+
+
+def test_duplicate_email_is_rejected(client):
+    response = client.post("/users/", json={
+        "username": "email_check", "email": "ivanov@example.com", "password": "secret"})
+    assert response.status_code == 400
+
+
+def test_rename_to_another_shard_is_rejected(client, monkeypatch, worker_database):
+    # две "шарды" на одной базе: важно только, куда указывает имя
+    monkeypatch.setattr(settings, "DATABASE_SHARD_URLS", [worker_database, worker_database])
+    other = next(name for name in (f"renamed_{i}" for i in range(100))
+                 if shard_for_new_user(name) != shard_for_id(1))
+    response = client.put("/users/1", json={"username": other})
+    assert response.status_code == 400
+
+
+def test_search_cursor_pages_through_ranked_results(client):
+    descriptions = ["кофе", "кофе и кофе", "кофе, чай и кофе с молоком", "утренний кофе у дома"]
+    created = set()
+    for description in descriptions:
+        response = client.post("/transactions/", json={
+            "account_id": 1, "category_id": 4, "amount": "1.00", "description": description})
+        assert response.status_code == 200, response.text
+        created.add(response.json()["id"])
+    seen, cursor = [], None
+    while True:
+        params = {"q": "кофе", "user_id": 1, "limit": 1}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/transactions/search", params=params).json()
+        seen += [item["id"] for item in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert sorted(seen) == sorted(created)
+
+
+def test_category_type_changed_elsewhere_applies_immediately(client, db):
+    payload = {"account_id": 1, "category_id": 4, "amount": "10.00"}
+    assert client.post("/transactions/", json=payload).status_code == 200
+    # как если бы тип изменил другой процесс: местный кэш об этом не знает
+    db.execute(text("UPDATE categories SET type = 'income' WHERE id = 4"))
+    before = db.query(Account.balance).filter(Account.id == 1).scalar()
+    assert client.post("/transactions/", json=payload).status_code == 200
+    db.expire_all()
+    assert db.query(Account.balance).filter(Account.id == 1).scalar() == before + Decimal("10.00")
+
+
+def test_transaction_writes_read_category_with_account_lock(client, db):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.get_bind(), "before_cursor_execute", record)
+    try:
+        created = client.post("/transactions/", json={"account_id": 1, "category_id": 4, "amount": "5.00"})
+        assert created.status_code == 200, created.text
+        transaction_id = created.json()["id"]
+        assert client.put(f"/transactions/{transaction_id}", json={
+            "account_id": 1, "category_id": 4, "amount": "7.00"}).status_code == 200
+        assert client.delete(f"/transactions/{transaction_id}").status_code == 200
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", record)
+    category_reads = [s for s in statements if "FROM categories" in s or "JOIN categories" in s]
+    assert category_reads and all("FOR UPDATE OF accounts" in s for s in category_reads)
+
+
+def test_reference_cache_key_has_no_credentials(fresh_database):
+    from main import app
+
+    client = TestClient(app)
+    response = client.post("/budgets/", json={
+        "user_id": 1, "category_id": 4, "amount_limit": "100.00",
+        "period_start": "2030-01-01", "period_end": "2030-01-31"})
+    assert response.status_code == 200, response.text
+    sources = [source for sources in reference_cache._entries.values() for source in sources]
+    assert sources and all(source[0] == "0" for source in sources)
+
+
+def test_category_with_closed_entries_is_not_deleted(client, db):
+    db.execute(text("INSERT INTO transactions (account_id, category_id, amount, currency, transaction_date) "
+                    "SELECT 1, 4, 1.00, currency, '2024-01-15' FROM accounts WHERE id = 1"))
+    db.execute(text("INSERT INTO closed_periods (period_end) VALUES ('2024-01-31')"))
+    assert client.delete("/categories/4").status_code == 409
+
+
+def test_app_role_cannot_bypass_closed_period_trigger(worker_engine):
+    with worker_engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            conn.execute(text("INSERT INTO transactions (account_id, category_id, amount, currency, transaction_date) "
+                              "SELECT 1, 4, 1.00, currency, '2024-01-15' FROM accounts WHERE id = 1"))
+            conn.execute(text("INSERT INTO closed_periods (period_end) VALUES ('2024-01-31')"))
+            # прежний обход через настройку сессии больше не действует
+            conn.execute(text("SET LOCAL app.archiving = on"))
+            with pytest.raises(DBAPIError, match="period is closed"):
+                conn.execute(text("DELETE FROM transactions WHERE transaction_date <= '2024-01-31'"))
+        finally:
+            transaction.rollback()
+
+
+def test_versioned_account_update_rejects_balance(client):
+    [account] = [a for a in client.get("/accounts/", params={"user_id": 1}).json() if a["id"] == 1]
+    headers = {"If-Match": f'"{account["version"]}"'}
+    assert client.put("/accounts/1", json={"balance": "1.00"}, headers=headers).status_code == 400
+    renamed = client.put("/accounts/1", json={"name": "Переименован"}, headers=headers)
+    assert renamed.status_code == 200, renamed.text
+    assert renamed.headers["ETag"] == f'"{account["version"] + 1}"'
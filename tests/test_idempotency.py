@@ -0,0 +1,50 @@
+import asyncio
+import uuid
+
+from sqlalchemy import create_engine, text
+
+from app.idempotency import IdempotencyStore
+
+
+def test_replay_returns_saved_response(client):
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+    body = {"username": "replay_check", "email": "replay_check@example.com", "password": "secret"}
+    first = client.post("/users/", json=body, headers=headers)
+    second = client.post("/users/", json=body, headers=headers)
+    assert first.status_code == second.status_code == 200
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert second.json() == first.json()
+
+
+def test_complete_writes_row_after_eviction(fresh_database):
+    shared = IdempotencyStore(max_keys=1, ttl_seconds=60, use_db=True)
+
+    async def scenario():
+        assert await shared.begin("POST /x a", "f1") is None
+        # другой ключ вытесняет первый из LRU, пока запрос выполняется
+        assert await shared.begin("POST /x b", "f2") is None
+        await shared.complete("POST /x a", "f1", 200, b'{"ok": true}')
+
+    asyncio.run(scenario())
+    engine = create_engine(fresh_database)
+    try:
+        with engine.connect() as conn:
+            row = conn.execute(text(
+                "SELECT status_code, response_body FROM idempotency_keys WHERE key = 'POST /x a'")).one()
+    finally:
+        engine.dispose()
+    assert tuple(row) == (200, '{"ok": true}')
+    # другой процесс (пустой кэш) повторяет сохраненный ответ из таблицы
+    other = IdempotencyStore(max_keys=10, ttl_seconds=60, use_db=True)
+    entry = asyncio.run(other.begin("POST /x a", "f1"))
+    assert (entry.status_code, entry.body) == (200, b'{"ok": true}')
+
+
+def test_same_key_from_different_users_does_not_collide(client):
+    key = uuid.uuid4().hex
+    for user_id in (1, 2):
+        body = {"username": f"scoped_{user_id}_{key[:8]}", "email": f"scoped_{user_id}_{key[:8]}@example.com",
+                "password": "secret"}
+        response = client.post("/users/", json=body, headers={"Idempotency-Key": key, "X-User-Id": str(user_id)})
+        assert response.status_code == 200, response.text
+        assert "Idempotent-Replayed" not in response.headers
@@ -0,0 +1,24 @@
+import time
+
+from config import settings
+from app.jobs import job_runner
+
+
+def test_job_is_visible_to_another_worker(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "REPORT_JOB_DIR", str(tmp_path))
+    created = client.post("/reports/jobs", json={"kind": "categories", "user_id": 1})
+    assert created.status_code == 200, created.text
+    job_id = created.json()["id"]
+    for _ in range(100):
+        if job_runner.get(job_id).status in ("done", "failed"):
+            break
+        time.sleep(0.05)
+    # другой процесс: в его памяти этой задачи нет, только файлы
+    monkeypatch.setattr(job_runner, "_jobs", {})
+    status = client.get(f"/reports/jobs/{job_id}")
+    assert status.status_code == 200, status.text
+    assert status.json()["status"] == "done"
+    result = client.get(f"/reports/jobs/{job_id}/result")
+    assert result.status_code == 200
+    assert isinstance(result.json(), list)
+    assert client.get("/reports/jobs/" + "0" * 32).status_code == 404
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.models import RateLimitBucket
+from app.ratelimit import AdmissionControl, RateLimited
+
+ROUTE = "POST /transactions/"
+
+
+def test_concurrency_rejection_keeps_token():
+    limiter = AdmissionControl({f"*:{ROUTE}": "0.001/2"}, {f"*:{ROUTE}": "1"}, workers=1)
+
+    async def scenario():
+        first = await limiter.acquire("app_user", ROUTE)
+        with pytest.raises(RateLimited, match="concurrent"):
+            await limiter.acquire("app_user", ROUTE)
+        limiter.release(first)
+        # второй токен корзины не потрачен отклоненным запросом
+        limiter.release(await limiter.acquire("app_user", ROUTE))
+
+    asyncio.run(scenario())
+
+
+def test_db_bucket_is_leased_in_batches(fresh_database):
+    limiter = AdmissionControl({f"*:{ROUTE}": "1/3"}, {}, workers=4, use_db=True, lease_seconds=10)
+    leases = []
+    lease_tokens_db = limiter._lease_tokens_db
+
+    def counting(*args):
+        leases.append(args)
+        return lease_tokens_db(*args)
+
+    limiter._lease_tokens_db = counting
+
+    async def scenario():
+        for _ in range(3):
+            await limiter.acquire("app_user", ROUTE)
+        with pytest.raises(RateLimited) as rejected:
+            await limiter.acquire("app_user", ROUTE)
+        # отказ запомнен до появления токена - в БД больше не ходим
+        with pytest.raises(RateLimited):
+            await limiter.acquire("app_user", ROUTE)
+        return rejected.value.retry_after
+
+    try:
+        retry_after = asyncio.run(scenario())
+    finally:
+        limiter.dispose()
+    assert len(leases) == 2
+    assert 0 < retry_after <= 1
+    engine = create_engine(fresh_database)
+    try:
+        with Session(engine) as db:
+            row = db.query(RateLimitBucket).one()
+    finally:
+        engine.dispose()
+    assert row.granted == 0 and row.tokens < 1
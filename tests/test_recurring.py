@@ -0,0 +1,38 @@
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+
+from app.scheduler import materialize_due
+
+
+def test_recurring_expense_stops_at_budget_limit(fresh_database):
+    from main import app
+
+    client = TestClient(app)
+    user = client.post("/users/", json={
+        "username": "recurring_budget", "email": "recurring_budget@example.com", "password": "secret"}).json()
+    category = client.post("/categories/", json={
+        "user_id": user["id"], "name": "Подписки", "type": "expense"}).json()
+    account = client.post("/accounts/", json={
+        "user_id": user["id"], "name": "Карта", "type": "card", "balance": "1000.00"}).json()
+    budget = client.post("/budgets/", json={
+        "user_id": user["id"], "category_id": category["id"], "amount_limit": "25.00",
+        "period_start": "2024-03-01", "period_end": "2024-03-31"})
+    assert budget.status_code == 200, budget.text
+    rule = client.post("/recurring/", json={
+        "account_id": account["id"], "category_id": category["id"], "amount": "10.00",
+        "frequency": "daily", "start_date": "2024-03-01"})
+    assert rule.status_code == 200, rule.text
+
+    assert materialize_due(today=date(2024, 3, 5)) == 2
+    saved = next(r for r in client.get("/recurring/", params={"user_id": user["id"]}).json()
+                 if r["id"] == rule.json()["id"])
+    # третий платеж превысил бы лимит: правило ждет следующего запуска
+    assert saved["next_run_date"] == "2024-03-03"
+    [saved_account] = client.get("/accounts/", params={"user_id": user["id"]}).json()
+    assert saved_account["balance"] == "980.00"
+
+
+def test_run_rejects_future_date(client):
+    future = (date.today() + timedelta(days=1)).isoformat()
+    assert client.post("/recurring/run", params={"on_date": future}).status_code == 400
@@ -0,0 +1,76 @@
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from app.database import shard_for_id, shard_for_new_user
+
+
+@pytest.fixture
+def shard_client(shard_databases):
+    from main import app
+
+    return TestClient(app)
+
+
+def _user_on_shard(client, shard: int) -> dict:
+    username = next(name for name in (f"sharded_{i}" for i in range(100))
+                    if shard_for_new_user(name) == shard)
+    response = client.post("/users/", json={
+        "username": username, "email": f"{username}@example.com", "password": "secret"})
+    assert response.status_code == 200, response.text
+    user = response.json()
+    assert shard_for_id(user["id"]) == shard
+    return user
+
+
+def _count(url: str, sql: str) -> int:
+    engine = create_engine(url)
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text(sql)).scalar()
+    finally:
+        engine.dispose()
+
+
+def test_close_period_closes_every_shard(shard_client, shard_databases):
+    response = shard_client.post("/periods/close", json={"period_end": "2024-01-31"})
+    assert response.status_code == 200, response.text
+    for url in shard_databases:
+        assert _count(url, "SELECT count(*) FROM closed_periods WHERE period_end = '2024-01-31'") == 1
+    assert [p["period_end"] for p in shard_client.get("/periods/").json()] == ["2024-01-31"]
+    again = shard_client.post("/periods/close", json={"period_end": "2024-01-31"})
+    assert again.status_code == 400
+
+
+def test_lists_without_user_gather_every_shard(shard_client):
+    category_ids = []
+    for shard in range(2):
+        user = _user_on_shard(shard_client, shard)
+        category = shard_client.post("/categories/", json={
+            "user_id": user["id"], "name": "Продукты", "type": "expense"})
+        assert category.status_code == 200, category.text
+        category_ids.append(category.json()["id"])
+        account = shard_client.post("/accounts/", json={
+            "user_id": user["id"], "name": "Кошелек", "type": "cash", "balance": "1000.00"})
+        assert account.status_code == 200, account.text
+        spent = shard_client.post("/transactions/", json={
+            "account_id": account.json()["id"], "category_id": category.json()["id"], "amount": "10.00"})
+        assert spent.status_code == 200, spent.text
+        budget = shard_client.post("/budgets/", json={
+            "user_id": user["id"], "category_id": category.json()["id"], "amount_limit": "100.00",
+            "period_start": date.today().replace(day=1).isoformat(), "period_end": date.today().isoformat()})
+        assert budget.status_code == 200, budget.text
+        rule = shard_client.post("/recurring/", json={
+            "account_id": account.json()["id"], "category_id": category.json()["id"], "amount": "5.00",
+            "frequency": "monthly", "start_date": date.today().isoformat()})
+        assert rule.status_code == 200, rule.text
+
+    assert sorted(b["category_id"] for b in shard_client.get("/budgets/").json()) == sorted(category_ids)
+    assert len(shard_client.get("/budgets/status").json()) == 2
+    assert len(shard_client.get("/recurring/").json()) == 2
+    report = shard_client.get("/reports/categories").json()
+    assert [(r["category"], r["count"]) for r in report] == [("Продукты", 1), ("Продукты", 1)]
+    assert len(shard_client.get("/transactions/search", params={"limit": 1}).json()["items"]) == 1
+    assert len(shard_client.get("/reports/transactions").json()) == 2
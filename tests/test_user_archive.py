@@ -0,0 +1,37 @@
+from fastapi.testclient import TestClient
+
+
+def _user_with_category(client, username: str, category_type: str) -> dict:
+    user = client.post("/users/", json={
+        "username": username, "email": f"{username}@example.com", "password": "secret"}).json()
+    category = client.post("/categories/", json={
+        "user_id": user["id"], "name": "Кэшбэк", "type": category_type})
+    assert category.status_code == 200, category.text
+    return user
+
+
+def test_import_rejects_category_with_other_type(fresh_database):
+    from main import app
+
+    client = TestClient(app)
+    source = _user_with_category(client, "archive_source", "income")
+    target = _user_with_category(client, "archive_target", "expense")
+    exported = client.get(f"/users/{source['id']}/export")
+    assert exported.status_code == 200, exported.text
+
+    imported = client.post(f"/users/{target['id']}/import",
+                           files={"archive": ("user.zip", exported.content, "application/zip")})
+    assert imported.status_code == 400
+    assert "Кэшбэк" in imported.json()["message"]
+
+    same_type = _user_with_category(client, "archive_same_type", "income")
+    imported = client.post(f"/users/{same_type['id']}/import",
+                           files={"archive": ("user.zip", exported.content, "application/zip")})
+    assert imported.status_code == 200, imported.text
+    assert imported.json()["categories"] == 0
+
+
+def test_export_of_missing_user_is_404(fresh_database):
+    from main import app
+
+    assert TestClient(app).get("/users/999999/export").status_code == 404
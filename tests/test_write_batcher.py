@@ -0,0 +1,22 @@
+from fastapi.testclient import TestClient
+
+from app.database import get_engine
+from app.write_batcher import transaction_batcher
+
+
+def test_batched_create_releases_request_connection(fresh_database, monkeypatch):
+    from main import app
+
+    monkeypatch.setattr(transaction_batcher, "window", 0.005)
+    submit = transaction_batcher.submit
+    held = []
+
+    async def checking_submit(transaction):
+        held.append(get_engine(0).pool.checkedout())
+        return await submit(transaction)
+
+    monkeypatch.setattr(transaction_batcher, "submit", checking_submit)
+    response = TestClient(app).post("/transactions/", json={
+        "account_id": 1, "category_id": 4, "amount": "3.00"})
+    assert response.status_code == 200, response.text
+    assert held == [0]